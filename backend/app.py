@@ -1,26 +1,79 @@
 #!/usr/bin/env python3
 
 import os
-import json
 import uuid
+import hashlib
+import atexit
 import shutil
-import fcntl
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
-from typing import Dict, List, Any, Optional
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Any, Optional, Tuple
 import logging
-from contextlib import contextmanager
 
 logging.basicConfig(level=logging.INFO)
 
-from flask import Flask, request, jsonify, send_file, Response
+from flask import Flask, request, jsonify, send_file, redirect, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import secure_filename
-from mutagen import File as MutagenFile
+
+import serializers
+from batch import BREAK_TYPES, BatchError, apply_operations
+from blobs import BLOB_DIR, BlobStore
+from changefeed import RETRY_MS, ChangeFeed, delta
+from listing import ListingError, apply_listing, created_key
+import loudness
+from loudness import LOUDNESS_DIR, LoudnessQueue, loudness_updates
+from metadata import FAILED, METADATA_DIR, PENDING, MetadataCache, MetadataQueue, metadata_updates
+from ordering import ORDERED_KINDS, Rebalancer, arrange, needs_rebalance, next_order, rebalance
+from streaming import file_etag, send_audio_file
+import uploads
+from resumable import create_upload, expire_uploads, get_upload
+from uploads import UploadError, UploadedFile, streamed_upload
+import transcode
+from peaks import CACHE_MAX_AGE as PEAKS_MAX_AGE, PeaksQueue, peaks_path, ready_peaks
+from prefetch import MAX_PREFETCH_COUNT, PREFETCH_COUNT, Prefetcher, prefetch_hint, track_files, upcoming_performances
+from transcode import TranscodeQueue
+from storage import StorageEngine, create_storage, file_lock, op_put, op_delete, EVENTS
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes responses with orjson when it is installed"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if serializers.orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode()
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if serializers.orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return serializers.json_loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        if serializers.orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            # Pretty-printed debug output stays on the stdlib encoder
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_dumps(obj) + b'\n', mimetype=self.mimetype)
+
+    def _orjson_dumps(self, obj: Any) -> bytes:
+        # Dates, dataclasses etc. go through Flask's default() so output matches the stdlib provider
+        option = (serializers.orjson.OPT_PASSTHROUGH_DATETIME | serializers.orjson.OPT_PASSTHROUGH_DATACLASS
+                  | serializers.orjson.OPT_NON_STR_KEYS)
+        if self.sort_keys:
+            option |= serializers.orjson.OPT_SORT_KEYS
+        return serializers.orjson.dumps(obj, default=self.default, option=option)
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 # Enable CORS for all routes and origins
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['X-Total-Count', 'X-Next-Cursor', 'ETag', 'Last-Modified',
+                                                                     'Upload-Offset', 'Upload-Length', 'Location'])
 
 # Configuration
 if os.environ.get('PERFORMANCE_MANAGER_DATA_DIR'):
@@ -31,55 +84,441 @@ else:
 ALLOWED_EXTENSIONS = {'mp3', 'mp4', 'aac', 'm4a', 'wav', 'flac'}
 ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp'}
 
+# Number of events whose parsed performances/breaks are kept in memory
+EVENT_CACHE_SIZE = int(os.environ.get('PERFORMANCE_MANAGER_EVENT_CACHE_SIZE', '16'))
+
+# Storage engine: 'json' (one file per list) or 'sqlite' (row-level updates)
+STORAGE_ENGINE = os.environ.get('PERFORMANCE_MANAGER_STORAGE', 'json')
+
 # Ensure config directory exists
 CONFIG_DIR.mkdir(parents=True, exist_ok=True)
 
-@contextmanager
-def file_lock(file_path: Path):
-    """Context manager for file locking to prevent concurrent writes"""
-    lock_file = file_path.parent / f".{file_path.name}.lock"
-    lock_file.touch(exist_ok=True)
+class RecordIndex:
+    """A list of records (performances or breaks) with id lookups
+
+    `records` is the list exactly as persisted; `by_id` maps record ids to the
+    same dict objects. For performances, `tracks` maps each track id to a
+    (performance, track) pair and `files` each (performance id, filename), so
+    nested tracks can be found without scanning.
+    The index is maintained incrementally by EventManager mutations.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], child_key: Optional[str] = None):
+        self.records = records
+        self.child_key = child_key
+        self.by_id: Dict[str, Dict[str, Any]] = {r['id']: r for r in records}
+        self.tracks: Dict[str, tuple] = {}
+        self.files: Dict[tuple, tuple] = {}
+        if child_key:
+            for record in records:
+                self.index_children(record)
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        return self.by_id.get(record_id)
+
+    def get_track(self, record_id: str, track_id: str) -> Optional[Dict[str, Any]]:
+        """Get a nested track, only if it belongs to the given record"""
+        entry = self.tracks.get(track_id)
+        if entry and entry[0]['id'] == record_id:
+            return entry[1]
+        return None
 
-    with open(lock_file, 'w') as lock:
-        try:
-            # Acquire exclusive lock
-            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
-            yield
-        finally:
-            # Release lock
-            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+    def get_file(self, record_id: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Get the nested track of a record stored under `filename`"""
+        entry = self.files.get((record_id, filename))
+        return entry[1] if entry else None
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+        self.by_id[record['id']] = record
+        if self.child_key:
+            self.index_children(record)
+
+    def remove(self, record_id: str) -> Optional[Dict[str, Any]]:
+        record = self.by_id.pop(record_id, None)
+        if record is not None:
+            self.records.remove(record)
+            if self.child_key:
+                self.unindex_children(record)
+        return record
+
+    def index_children(self, record: Dict[str, Any]) -> None:
+        for child in record.get(self.child_key) or []:
+            self.tracks[child['id']] = (record, child)
+            self.files[(record['id'], child.get('filename'))] = (record, child)
+
+    def unindex_children(self, record: Dict[str, Any], children: Optional[List[Dict[str, Any]]] = None) -> None:
+        """Drop the track entries of a record's children (or of `children`, its former ones)"""
+        for child in record.get(self.child_key) or [] if children is None else children:
+            entry = self.tracks.get(child['id'])
+            if entry is not None and entry[0] is record:
+                del self.tracks[child['id']]
+            key = (record['id'], child.get('filename'))
+            entry = self.files.get(key)
+            if entry is not None and entry[1] is child:
+                del self.files[key]
+
+    def reindex_children(self, record: Dict[str, Any], previous: List[Dict[str, Any]]) -> None:
+        """Refresh track entries after a record's track list `previous` was replaced"""
+        self.unindex_children(record, previous)
+        self.index_children(record)
+
+    def add_child(self, record: Dict[str, Any], child: Dict[str, Any]) -> None:
+        record[self.child_key].append(child)
+        self.tracks[child['id']] = (record, child)
+        self.files[(record['id'], child.get('filename'))] = (record, child)
+
+    def remove_child(self, record: Dict[str, Any], child_id: str) -> Optional[Dict[str, Any]]:
+        entry = self.tracks.get(child_id)
+        if entry is None or entry[0] is not record:
+            return None
+        self.unindex_children(record, [entry[1]])
+        record[self.child_key] = [c for c in record[self.child_key] if c['id'] != child_id]
+        return entry[1]
+
+# Nested collection indexed for each kind of per-event record list
+INDEXED_CHILDREN = {'performances': 'tracks', 'breaks': None}
+
+def summarize_records(kind: str, records: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Compute the denormalized counters stored in an event's 'stats' for one record list"""
+    if kind == 'performances':
+        tracks = [t for p in records for t in p.get('tracks') or []]
+        return {
+            'performanceCount': len(records),
+            'performancesDone': sum(1 for p in records if p.get('isDone')),
+            'trackCount': len(tracks),
+            'tracksCompleted': sum(1 for t in tracks if t.get('isCompleted')),
+            'totalDuration': sum(t.get('duration') or 0 for t in tracks),
+        }
+    return {
+        'breakCount': len(records),
+        'breaksDone': sum(1 for b in records if b.get('isDone')),
+    }
+
+def event_transaction(method):
+    """Run an EventManager method whose first argument is an event id inside transaction()"""
+    @functools.wraps(method)
+    def wrapper(self, event_id, *args, **kwargs):
+        with self.transaction(event_id):
+            return method(self, event_id, *args, **kwargs)
+    return wrapper
 
 class EventManager:
-    def __init__(self):
-        self.events_file = CONFIG_DIR / 'events.json'
+    def __init__(self, config_dir: Optional[Path] = None, cache_size: int = EVENT_CACHE_SIZE,
+                 storage: Optional[str] = None):
+        self.config_dir = Path(config_dir) if config_dir else CONFIG_DIR
+        self.storage: StorageEngine = create_storage(storage or STORAGE_ENGINE, self.config_dir)
         self.events: List[Dict[str, Any]] = []
+        self._events_by_id: Dict[str, Dict[str, Any]] = {}
+        # event_id -> {'performances': (stamp, RecordIndex), 'breaks': (stamp, RecordIndex)}
+        # where stamp is the storage engine's freshness token for the list
+        # kept in least-recently-used order
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[str, Dict[str, tuple]]' = OrderedDict()
+        self._cache_lock = threading.RLock()
+        # Storage stamp of the event list held in self.events; None forces a reload
+        self._events_stamp: Any = None
+        self._events_lock = threading.Lock()
+        # Events with a transaction open in this process, and per thread
+        self._active_events: set = set()
+        self._held = threading.local()
+        # Extracts audio metadata of uploaded tracks in the background
+        self.metadata = MetadataQueue(self.update_track, MetadataCache(self.config_dir / METADATA_DIR))
+        # Measures loudness for level-matched playback; decodes whole files, so it has its own pool
+        self.loudness = LoudnessQueue(self.update_track, loudness.create_cache(self.config_dir / LOUDNESS_DIR))
+        # Track files are hard links to content-addressed blobs (see blobs.py)
+        self.blobs = BlobStore(self.config_dir / BLOB_DIR)
+        # Compressed renditions for streaming, when ffmpeg is installed
+        self.transcoder = TranscodeQueue()
+        # Waveform peaks for the player's seekbar
+        self.peaks = PeaksQueue()
+        # Show mode: reads upcoming tracks into the page cache (see prefetch.py)
+        self.prefetcher = Prefetcher()
+        # Renumbers running orders whose gaps got too small (see ordering.py)
+        self.rebalancer = Rebalancer(self.rebalance_order)
+        # Deltas of every change, pushed to clients (see changefeed.py)
+        self.changes = ChangeFeed(self.config_dir)
+        # Set by close(); long-running work such as change streams ends when it is
+        self.closing = threading.Event()
+        self._blob_migration: Optional[threading.Thread] = None
         self.load_events()
+        self._start_blob_migration()
+
+    def close(self) -> None:
+        """Finish metadata jobs, flush pending writes and release storage resources"""
+        self.closing.set()
+        # Ends open change streams
+        self.changes.notify()
+        if self._blob_migration is not None:
+            self._blob_migration.join()
+        self.metadata.close()
+        self.loudness.close()
+        self.transcoder.close()
+        self.peaks.close()
+        self.prefetcher.close()
+        self.rebalancer.close()
+        self.storage.close()
+
+    def _start_blob_migration(self) -> None:
+        """Move track files stored before the blob store into it, once per data directory"""
+        if self.blobs.is_migrated():
+            return
+        if not self.events:
+            self.blobs.mark_migrated()
+            return
+
+        def migrate():
+            # Other workers wait here and find the marker
+            with file_lock(self.blobs.root):
+                if not self.blobs.is_migrated() and self.migrate_blobs():
+                    self.blobs.mark_migrated()
+
+        # Hashing every file can take a while; the server starts meanwhile
+        self._blob_migration = threading.Thread(target=migrate, name='blob-migration', daemon=True)
+        self._blob_migration.start()
+
+    def migrate_blobs(self) -> bool:
+        """Move track files without a contentHash into the blob store
+
+        Duplicate files are replaced by links to one stored copy. Runs event
+        by event inside its transaction; returns False if interrupted by close().
+        """
+        for event_id in [e['id'] for e in self.events]:
+            if self.closing.is_set():
+                return False
+            with self.transaction(event_id):
+                if not self.get_event(event_id):
+                    continue
+                index = self._load_index(event_id, 'performances')
+                changed = []
+                for performance in index.records:
+                    performance_dir = self.get_performance_dir(event_id, performance['id'])
+                    for track in performance.get('tracks', []):
+                        file_path = performance_dir / track['filename']
+                        if track.get('contentHash') or not file_path.is_file():
+                            continue
+                        content_hash = self.blobs.adopt(file_path)
+                        if content_hash is None:
+                            # Kept as a plain copy
+                            continue
+                        track['contentHash'] = content_hash
+                        if not changed or changed[-1] is not performance:
+                            changed.append(performance)
+                if changed:
+                    self._save_index(event_id, 'performances', index, [op_put(p) for p in changed])
+                    logging.info(f"Moved track files of {len(changed)} performances of event {event_id} into the blob store")
+        return True
+
+    def store_track_file(self, directory: Path, upload: UploadedFile) -> Tuple[str, Optional[str]]:
+        """Put an uploaded file into directory through the blob store
+
+        Returns (filename, contentHash); the hash is None if the file was
+        stored as a plain copy.
+        """
+        filename = secure_filename(upload.filename)
+        if upload.sha256:
+            stored = self.blobs.store(upload.temp_path, upload.sha256, directory, filename)
+            if stored is not None:
+                upload.discard()
+                return stored, upload.sha256
+        return upload.move_to_unique(directory, filename), None
 
     def load_events(self):
-        """Load events from JSON file"""
-        if self.events_file.exists():
-            try:
-                with open(self.events_file, 'r') as f:
-                    self.events = json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                self.events = []
-        else:
-            self.events = []
+        """Load events from storage"""
+        events, stamp = self.storage.load(None, EVENTS)
+        # An event inside an open transaction is current (no other process can
+        # change it) and may be mid-change, so its dict is kept as it is
+        events = [self._events_by_id[e['id']] if e['id'] in self._active_events and e['id'] in self._events_by_id
+                  else e for e in events]
+        self._events_by_id = {e['id']: e for e in events}
+        self.events = events
+        self._events_stamp = stamp
+
+    def save_events(self, changes: Optional[List[Dict[str, Any]]] = None):
+        """Save events to storage (only the changed events when `changes` is given)"""
+        before = self.storage.stamp(None, EVENTS)
+        stamp = self.storage.save(None, EVENTS, self.events, changes)
+        # If another process wrote in the meantime, a row-level save leaves our
+        # list without its changes, so it is reloaded on the next sync()
+        self._events_stamp = stamp if changes is None or before == self._events_stamp else None
+
+    def sync(self) -> bool:
+        """Reload the event list if another process has changed it
+
+        Server workers each hold their own EventManager; this is called at the
+        start of every request and costs one stamp check when nothing changed.
+        Per-event performances and breaks are revalidated on every access
+        already. Returns True if the list was reloaded.
+        """
+        if self.storage.stamp(None, EVENTS) == self._events_stamp:
+            return False
+        with self._events_lock:
+            if self.storage.stamp(None, EVENTS) == self._events_stamp:
+                return False
+            self.load_events()
+            return True
+
+    @contextmanager
+    def transaction(self, event_id: str):
+        """Hold an event's exclusive lock for a read-modify-write of its data
 
-    def save_events(self):
-        """Save events to JSON file with file locking"""
-        with file_lock(self.events_file):
-            with open(self.events_file, 'w') as f:
-                json.dump(self.events, f, indent=2)
+        The lock is taken on a file in the data directory, so it serializes
+        changes to one event across threads and server workers while other
+        events stay available. Everything read inside the block is current,
+        and nothing else can write the event until it ends. Re-entrant within
+        a thread.
+        """
+        held = self._held.__dict__.setdefault('events', set())
+        if event_id in held:
+            yield
+            return
+        with file_lock(self.config_dir / f'event-{event_id}'):
+            self.sync()
+            held.add(event_id)
+            with self._events_lock:
+                self._active_events.add(event_id)
+            try:
+                yield
+            finally:
+                with self._events_lock:
+                    self._active_events.discard(event_id)
+                held.discard(event_id)
 
     def get_event_dir(self, event_id: str) -> Path:
         """Get directory path for an event"""
-        return CONFIG_DIR / event_id
+        return self.config_dir / event_id
 
     def get_event_performances_file(self, event_id: str) -> Path:
         """Get performances file path for an event"""
         return self.get_event_dir(event_id) / 'performances.json'
 
+    def _cache_get(self, event_id: str, kind: str, stamp: Any) -> Optional[RecordIndex]:
+        """Return cached records if they are still fresh for the given storage stamp"""
+        with self._cache_lock:
+            entry = self._cache.get(event_id)
+            if entry is None:
+                return None
+            self._cache.move_to_end(event_id)
+            cached = entry.get(kind)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            return None
+
+    def _cache_put(self, event_id: str, kind: str, index: RecordIndex, stamp: Any) -> None:
+        """Store parsed records for an event, evicting the least recently used events"""
+        with self._cache_lock:
+            entry = self._cache.setdefault(event_id, {})
+            entry[kind] = (stamp, index)
+            self._cache.move_to_end(event_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def invalidate_cache(self, event_id: Optional[str] = None) -> None:
+        """Drop cached data for one event, or for all events"""
+        with self._cache_lock:
+            if event_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(event_id, None)
+
+    def _load_index(self, event_id: str, kind: str) -> RecordIndex:
+        """Load a per-event record list, served from the cache while storage is unchanged"""
+        index = self._cache_get(event_id, kind, self.storage.stamp(event_id, kind))
+        if index is not None:
+            return index
+
+        records, stamp = self.storage.load(event_id, kind)
+        index = RecordIndex(records, INDEXED_CHILDREN[kind])
+        self._cache_put(event_id, kind, index, stamp)
+        if kind == 'performances':
+            # Metadata and loudness jobs do not survive a restart
+            for performance in records:
+                performance_dir = self.get_performance_dir(event_id, performance['id'])
+                self.metadata.resubmit_stale(event_id, performance, performance_dir)
+                self.loudness.resubmit_stale(event_id, performance, performance_dir)
+        if kind in ORDERED_KINDS and needs_rebalance(index.records):
+            # Equal integer orders written before fractional ordering
+            self.rebalancer.submit(event_id, kind)
+        return index
+
+    def _save_index(self, event_id: str, kind: str, index: RecordIndex,
+                    changes: Optional[List[Dict[str, Any]]] = None) -> None:
+        """Persist a per-event record list and update the cache"""
+        before = self.storage.stamp(event_id, kind)
+        try:
+            stamp = self.storage.save(event_id, kind, index.records, changes)
+        except BaseException:
+            # Callers mutate cached records in place before saving, so a failed
+            # write must not leave those unsaved changes in memory
+            self.invalidate_cache(event_id)
+            raise
+        if changes is None or self._cache_get(event_id, kind, before) is not None:
+            self._cache_put(event_id, kind, index, stamp)
+        else:
+            # Another process wrote since the list was loaded, so the stored list
+            # differs from ours; it is re-read on next access
+            self.invalidate_cache(event_id)
+        self._update_stats(event_id, kind, index.records, changed=True)
+        self._publish(event_id, kind, changes, index.records)
+        if kind in ORDERED_KINDS and needs_rebalance(index.records):
+            self.rebalancer.submit(event_id, kind)
+
+    def _publish(self, event_id: str, kind: str, changes: Optional[List[Dict[str, Any]]],
+                 records: List[Dict[str, Any]]) -> None:
+        """Append the delta of a change that bumped the event's version to its change feed"""
+        event = self.get_event(event_id)
+        if event:
+            self.changes.publish(event_id, delta(event['version'], kind, changes, records))
+
+    def _update_stats(self, event_id: str, kind: str, records: List[Dict[str, Any]],
+                      changed: bool = False) -> None:
+        """Refresh an event's counters for one record list
+
+        The event is saved only if its counters changed or, with changed=True,
+        after bumping its version because the record list itself was modified.
+        """
+        event = self.get_event(event_id)
+        if not event:
+            return
+        stats = summarize_records(kind, records)
+        current = event.get('stats') or {}
+        stats_changed = any(current.get(key) != value for key, value in stats.items())
+        if stats_changed:
+            event['stats'] = {**current, **stats}
+        if changed:
+            self._bump_version(event)
+        if stats_changed or changed:
+            self.save_events([op_put(event)])
+
+    @staticmethod
+    def _bump_version(event: Dict[str, Any]) -> None:
+        """Record a change to an event or its data; version and updatedAt back ETag/Last-Modified"""
+        event['version'] = event.get('version', 0) + 1
+        event['updatedAt'] = datetime.now().isoformat()
+
+    def get_event_stats(self, event_id: str) -> Dict[str, int]:
+        """Get an event's counters, computing them once for events stored before they existed"""
+        event = self.get_event(event_id)
+        if not event:
+            return {}
+        stats = event.get('stats') or {}
+        for kind, count_key in (('performances', 'performanceCount'), ('breaks', 'breakCount')):
+            if count_key not in stats:
+                with self.transaction(event_id):
+                    self._update_stats(event_id, kind, self._load_index(event_id, kind).records)
+        return event['stats']
+
+    def get_event_summary(self, event_id: str) -> Optional[Dict[str, Any]]:
+        """Get a copy of an event with its counters, without reading per-event data"""
+        event = self.get_event(event_id)
+        if not event:
+            return None
+        summary = event.copy()
+        summary['stats'] = dict(self.get_event_stats(event_id))
+        # Top-level count kept for existing clients
+        summary['performanceCount'] = summary['stats']['performanceCount']
+        return summary
+
     def create_event(self, name: str, description: str = '', unlock_code: str = '12345', remote_player_url: str = '') -> Dict[str, Any]:
         """Create a new event"""
         event_id = str(uuid.uuid4())
@@ -100,68 +539,74 @@ class EventManager:
             'breaks': [],
             'coverImage': None,
             'imagePosition': {'x': 50, 'y': 50},  # Default center position as percentages
-            'remotePlayerUrl': remote_player_url
+            'remotePlayerUrl': remote_player_url,
+            'stats': {**summarize_records('performances', []), **summarize_records('breaks', [])}
         }
+        self._bump_version(event)
 
         self.events.append(event)
-        self.save_events()
+        self._events_by_id[event_id] = event
+        self.save_events([op_put(event)])
 
         # Create performances file for this event
-        performances_file = self.get_event_performances_file(event_id)
-        with open(performances_file, 'w') as f:
-            json.dump([], f, indent=2)
+        self.save_event_performances(event_id, [])
 
         return event
 
     def get_event(self, event_id: str) -> Optional[Dict[str, Any]]:
         """Get an event by ID"""
-        return next((e for e in self.events if e['id'] == event_id), None)
+        return self._events_by_id.get(event_id)
 
+    @event_transaction
     def delete_event(self, event_id: str) -> bool:
         """Delete an event and all its data"""
         event = self.get_event(event_id)
         if event:
             # Remove from list
             self.events = [e for e in self.events if e['id'] != event_id]
+            del self._events_by_id[event_id]
 
-            # Delete event directory
+            # Delete event directory, then the blobs only its tracks used
+            hashes = [track.get('contentHash') for performance in self.load_event_performances(event_id)
+                      for track in performance.get('tracks', [])]
             event_dir = self.get_event_dir(event_id)
             if event_dir.exists():
                 shutil.rmtree(event_dir)
+            for content_hash in hashes:
+                self.blobs.release(content_hash)
+            self.storage.drop_event(event_id)
+            self.invalidate_cache(event_id)
 
-            self.save_events()
+            self.save_events([op_delete(event_id)])
             return True
         return False
 
     def load_event_performances(self, event_id: str) -> List[Dict[str, Any]]:
-        """Load performances for a specific event"""
-        performances_file = self.get_event_performances_file(event_id)
-        if performances_file.exists():
-            try:
-                with open(performances_file, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                return []
-        return []
+        """Load performances for a specific event
 
+        The returned list is shared with the in-memory cache: callers that
+        modify it must persist the change with save_event_performances.
+        """
+        return self._load_index(event_id, 'performances').records
+
+    @event_transaction
     def save_event_performances(self, event_id: str, performances: List[Dict[str, Any]]):
         """Save performances for a specific event with file locking"""
-        performances_file = self.get_event_performances_file(event_id)
-        with file_lock(performances_file):
-            with open(performances_file, 'w') as f:
-                json.dump(performances, f, indent=2)
+        # The list may have been edited arbitrarily, so the index is rebuilt
+        self._save_index(event_id, 'performances', RecordIndex(performances, INDEXED_CHILDREN['performances']))
 
     def get_performance_dir(self, event_id: str, performance_id: str) -> Path:
         """Get directory path for a performance within an event"""
         return self.get_event_dir(event_id) / performance_id
 
+    @event_transaction
     def create_performance(self, event_id: str, name: str, performer: str = '', perf_type: str = 'Song', mode: str = 'Solo', expected_duration: Optional[int] = None, is_continuous: bool = False) -> Dict[str, Any]:
         """Create a new performance within an event"""
         event = self.get_event(event_id)
         if not event:
             return None
 
-        performances = self.load_event_performances(event_id)
+        index = self._load_index(event_id, 'performances')
 
         performance_id = str(uuid.uuid4())
         performance_dir = self.get_performance_dir(event_id, performance_id)
@@ -177,129 +622,289 @@ class EventManager:
             'isDone': False,
             'isContinuous': is_continuous,
             'createdAt': datetime.now().isoformat(),
-            'order': len(performances)
+            'order': next_order(index.records)
         }
 
         if expected_duration is not None:
             performance['expectedDuration'] = expected_duration
 
-        performances.append(performance)
-        self.save_event_performances(event_id, performances)
+        index.append(performance)
+        self._save_index(event_id, 'performances', index, [op_put(performance)])
         return performance
 
     def get_performance(self, event_id: str, performance_id: str) -> Optional[Dict[str, Any]]:
         """Get a performance by ID within an event"""
-        performances = self.load_event_performances(event_id)
-        return next((p for p in performances if p['id'] == performance_id), None)
+        return self._load_index(event_id, 'performances').get(performance_id)
+
+    def get_track(self, event_id: str, performance_id: str, track_id: str) -> Optional[Dict[str, Any]]:
+        """Get a track by ID within a performance"""
+        return self._load_index(event_id, 'performances').get_track(performance_id, track_id)
 
+    def get_track_by_filename(self, event_id: str, performance_id: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Get the track of a performance stored under `filename`"""
+        return self._load_index(event_id, 'performances').get_file(performance_id, filename)
+
+    @event_transaction
     def update_performance(self, event_id: str, performance_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update a performance within an event"""
-        performances = self.load_event_performances(event_id)
-        performance = next((p for p in performances if p['id'] == performance_id), None)
+        index = self._load_index(event_id, 'performances')
+        performance = index.get(performance_id)
 
         if performance:
+            previous = performance.get('tracks') or []
             performance.update(updates)
-            self.save_event_performances(event_id, performances)
+            if 'tracks' in updates:
+                index.reindex_children(performance, previous)
+            self._save_index(event_id, 'performances', index, [op_put(performance)])
             return performance
         return None
 
+    @event_transaction
     def update_track(self, event_id: str, performance_id: str, track_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update a track's properties"""
         try:
-            performances = self.load_event_performances(event_id)
-            performance = next((p for p in performances if p['id'] == performance_id), None)
-
-            if performance:
-                track = next((t for t in performance['tracks'] if t['id'] == track_id), None)
-                if track:
-                    track.update(updates)
-                    self.save_event_performances(event_id, performances)
-                    return track
+            index = self._load_index(event_id, 'performances')
+            track = index.get_track(performance_id, track_id)
+            if track:
+                performance = index.get(performance_id)
+                if 'filename' in updates:
+                    index.unindex_children(performance, [track])
+                track.update(updates)
+                if 'filename' in updates:
+                    index.index_children(performance)
+                self._save_index(event_id, 'performances', index, [op_put(performance)])
+                return track
             return None
         except Exception:
             return None
 
+    @event_transaction
     def delete_performance(self, event_id: str, performance_id: str) -> bool:
         """Delete a performance and its files within an event"""
-        performances = self.load_event_performances(event_id)
-        performance = next((p for p in performances if p['id'] == performance_id), None)
+        index = self._load_index(event_id, 'performances')
+        performance = index.remove(performance_id)
 
         if performance:
-            # Remove from list
-            performances = [p for p in performances if p['id'] != performance_id]
-
             # Delete performance directory
             performance_dir = self.get_performance_dir(event_id, performance_id)
             if performance_dir.exists():
                 shutil.rmtree(performance_dir)
+            for track in performance.get('tracks', []):
+                self.blobs.release(track.get('contentHash'))
 
-            self.save_event_performances(event_id, performances)
+            self._save_index(event_id, 'performances', index, [op_delete(performance_id)])
             return True
         return False
 
-    def add_track(self, event_id: str, performance_id: str, filename: str, performer: str, file_path: Optional[Path] = None) -> Optional[Dict[str, Any]]:
-        """Add a track to a performance within an event"""
-        performances = self.load_event_performances(event_id)
-        performance = next((p for p in performances if p['id'] == performance_id), None)
+    def add_track(self, event_id: str, performance_id: str, filename: str, performer: str,
+                  file_path: Optional[Path] = None, content_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Add a track to a performance within an event
 
-        if performance:
-            track_id = str(uuid.uuid4())
-            track = {
-                'id': track_id,
-                'filename': filename,
-                'performer': performer,
-                'url': f'/api/events/{event_id}/performances/{performance_id}/files/{filename}',
-                'isCompleted': False
-            }
-
-            # Extract audio duration if file path is provided
-            if file_path and file_path.exists():
-                duration = get_audio_duration(file_path)
-                if duration is not None:
-                    track['duration'] = duration
-
-            performance['tracks'].append(track)
-            self.save_event_performances(event_id, performances)
-            return track
-        return None
+        If file_path is given, the track's metadata (duration, bitrate, ...) is
+        taken from the metadata cache, or read in the background; until then
+        its metadataStatus is 'pending'. Its loudness and gain are handled the
+        same way, with loudnessStatus. content_hash is the blob the file links
+        to (see store_track_file).
+        """
+        track = {
+            'id': str(uuid.uuid4()),
+            'filename': filename,
+            'performer': performer,
+            'url': f'/api/events/{event_id}/performances/{performance_id}/files/{filename}',
+            'isCompleted': False
+        }
+
+        if content_hash:
+            track['contentHash'] = content_hash
+        queue_metadata = queue_loudness = False
+        if file_path is not None and file_path.exists():
+            cached = self.metadata.cache.lookup(file_path, content_hash)
+            if cached is not None:
+                track.update(metadata_updates(cached))
+            else:
+                track['metadataStatus'] = PENDING
+                queue_metadata = True
+            measured = self.loudness.cache.lookup(file_path, content_hash)
+            if measured is not None:
+                track.update(loudness_updates(measured))
+            else:
+                track['loudnessStatus'] = PENDING
+                queue_loudness = True
+
+        with self.transaction(event_id):
+            index = self._load_index(event_id, 'performances')
+            performance = index.get(performance_id)
+            if not performance:
+                return None
+            index.add_child(performance, track)
+            self._save_index(event_id, 'performances', index, [op_put(performance)])
+            # The stored dict is patched by the metadata job
+            added = dict(track)
+        if queue_metadata:
+            self.metadata.submit(event_id, performance_id, track['id'], file_path, content_hash)
+        if queue_loudness:
+            self.loudness.submit(event_id, performance_id, track['id'], file_path, content_hash)
+        if file_path is not None and file_path.exists():
+            self.peaks.submit(file_path)
+            for quality in transcode.UPLOAD_QUALITIES:
+                self.transcoder.submit(file_path, quality)
+        return added
+
+    def rescan_event(self, event_id: str) -> Dict[str, int]:
+        """Re-derive the metadata of all tracks of an event from their files
+
+        Unchanged files are answered by the metadata cache, so only new or
+        modified files are parsed. Loudness comes from its cache too; files
+        not measured yet are queued for analysis, except those whose analysis
+        failed and that have not changed since. Returns counts of tracks,
+        updated tracks, parsed files and missing files.
+        """
+        files = {}
+        performance_ids = {}
+        missing = 0
+        for performance in self.load_event_performances(event_id):
+            performance_dir = self.get_performance_dir(event_id, performance['id'])
+            for track in performance.get('tracks', []):
+                file_path = performance_dir / track['filename']
+                if file_path.is_file():
+                    files[track['id']] = (file_path, track.get('contentHash'))
+                    performance_ids[track['id']] = performance['id']
+                else:
+                    missing += 1
+        # Parsed outside the lock; the results are applied in one write
+        results, parsed = self.metadata.scan(files)
+        measured = {track_id: self.loudness.cache.lookup(*args) for track_id, args in files.items()}
+
+        updated = 0
+        unmeasured = []
+        with self.transaction(event_id):
+            index = self._load_index(event_id, 'performances')
+            changes = []
+            for performance in index.records:
+                changed = False
+                for track in performance.get('tracks', []):
+                    if track['id'] not in results:
+                        continue
+                    updates = metadata_updates(results[track['id']])
+                    if measured[track['id']] is not None:
+                        updates.update(loudness_updates(measured[track['id']]))
+                    elif track.get('loudnessStatus') != FAILED or track['id'] in parsed:
+                        # Failures are not cached; an unchanged file would fail again
+                        updates['loudnessStatus'] = PENDING
+                        unmeasured.append(track['id'])
+                    if any(track.get(key) != value for key, value in updates.items()):
+                        track.update(updates)
+                        updated += 1
+                        changed = True
+                if changed:
+                    changes.append(op_put(performance))
+            if changes:
+                self._save_index(event_id, 'performances', index, changes)
+        for track_id in unmeasured:
+            self.loudness.submit(event_id, performance_ids[track_id], track_id, *files[track_id])
+        return {'tracks': len(files) + missing, 'updated': updated, 'parsed': len(parsed), 'missing': missing}
+
+    def upcoming_performances(self, event_id: str, performance_id: Optional[str],
+                              count: int) -> Optional[List[Dict[str, Any]]]:
+        """The current performance and the next `count` not done (see prefetch.py)"""
+        return upcoming_performances(self.load_event_performances(event_id), performance_id, count)
+
+    def warm_performances(self, event_id: str, performances: List[Dict[str, Any]]) -> int:
+        """Start reading the performances' track files into the page cache; returns the files queued"""
+        queued = 0
+        for performance in performances:
+            performance_dir = self.get_performance_dir(event_id, performance['id'])
+            for track in performance.get('tracks', []):
+                if track.get('isDisabled'):
+                    continue
+                for path in track_files(performance_dir / track['filename']):
+                    queued += self.prefetcher.submit(path)
+        return queued
+
+    @event_transaction
+    def delete_track(self, event_id: str, performance_id: str, track_id: str) -> Optional[Dict[str, Any]]:
+        """Remove a track and its file from a performance"""
+        index = self._load_index(event_id, 'performances')
+        performance = index.get(performance_id)
+        if not performance:
+            return None
 
+        track = index.remove_child(performance, track_id)
+        if track:
+            # Remove file from filesystem
+            file_path = self.get_performance_dir(event_id, performance_id) / track['filename']
+            if file_path.exists():
+                file_path.unlink()
+            transcode.remove_renditions(file_path)
+            peaks_path(file_path).unlink(missing_ok=True)
+            self.blobs.release(track.get('contentHash'))
+            self._save_index(event_id, 'performances', index, [op_put(performance)])
+        return track
+
+    @event_transaction
     def reorder_performances(self, event_id: str, order: List[str]) -> bool:
         """Reorder performances within an event
 
-        IMPORTANT: This only updates the order field for performances in the order list.
-        All other performances are preserved with their existing order values.
+        IMPORTANT: Performances not in the order list keep their order values,
+        and so do listed ones already in place: moving one performance writes
+        only that one (see ordering.arrange), and an unchanged order nothing.
         """
         try:
-            performances = self.load_event_performances(event_id)
-            performance_map = {p['id']: p for p in performances}
-
-            # Update order ONLY for performances that are in the reorder list
-            for i, perf_id in enumerate(order):
-                if perf_id in performance_map:
-                    performance_map[perf_id]['order'] = i
-
-            # Keep ALL performances, not just the ones being reordered
-            # Performances not in the order list keep their existing order
-            all_performances = list(performance_map.values())
-
-            self.save_event_performances(event_id, all_performances)
+            index = self._load_index(event_id, 'performances')
+            changed = arrange(index.records, order)
+            if changed:
+                self._save_index(event_id, 'performances', index, [op_put(p) for p in changed])
             return True
         except Exception as e:
             logging.error(f"Error reordering performances: {e}")
             return False
 
+    @event_transaction
+    def apply_batch(self, event_id: str, operations: Any,
+                    expected_version: Optional[int] = None) -> Tuple[int, Dict[str, List[Dict[str, Any]]]]:
+        """Apply batched operations (see batch.py), saving each record list once
+
+        Returns the event version afterwards and the changed records by kind.
+        Raises BatchError; with status 404 if the event does not exist and 409
+        if expected_version is given and the event has moved on since.
+        """
+        event = self.get_event(event_id)
+        if event is None:
+            raise BatchError('Event not found', 404)
+        version = event.get('version', 0)
+        if expected_version is not None and expected_version != version:
+            raise BatchError(f'Event is at version {version}', 409)
+
+        indexes: Dict[str, RecordIndex] = {}
+
+        def load(kind: str) -> RecordIndex:
+            if kind not in indexes:
+                indexes[kind] = self._load_index(event_id, kind)
+            return indexes[kind]
+
+        try:
+            changed = apply_operations(load, operations)
+        except Exception:
+            # Earlier operations changed cached records in place
+            self.invalidate_cache(event_id)
+            raise
+        for kind, records in changed.items():
+            if records:
+                self._save_index(event_id, kind, indexes[kind], [op_put(r) for r in records.values()])
+        # Saving bumped the version
+        event = self.get_event(event_id) or event
+        return event.get('version', 0), {kind: list(records.values()) for kind, records in changed.items()}
+
+    @event_transaction
     def update_track_completion(self, event_id: str, performance_id: str, track_id: str, is_completed: bool) -> Optional[Dict[str, Any]]:
         """Update track completion status"""
         try:
-            performances = self.load_event_performances(event_id)
-            performance = next((p for p in performances if p['id'] == performance_id), None)
-
-            if performance:
-                track = next((t for t in performance['tracks'] if t['id'] == track_id), None)
-                if track:
-                    track['isCompleted'] = is_completed
-                    self.save_event_performances(event_id, performances)
-                    return track
+            index = self._load_index(event_id, 'performances')
+            track = index.get_track(performance_id, track_id)
+            if track:
+                track['isCompleted'] = is_completed
+                self._save_index(event_id, 'performances', index, [op_put(index.get(performance_id))])
+                return track
             return None
         except Exception:
             return None
@@ -309,23 +914,18 @@ class EventManager:
         return self.get_event_dir(event_id) / 'breaks.json'
 
     def load_event_breaks(self, event_id: str) -> List[Dict[str, Any]]:
-        """Load breaks for an event"""
-        breaks_file = self.get_event_breaks_file(event_id)
-        if breaks_file.exists():
-            with open(breaks_file, 'r') as f:
-                return json.load(f)
-        return []
+        """Load breaks for an event (shared with the cache, see load_event_performances)"""
+        return self._load_index(event_id, 'breaks').records
 
+    @event_transaction
     def save_event_breaks(self, event_id: str, breaks: List[Dict[str, Any]]) -> None:
         """Save breaks for an event with file locking"""
-        breaks_file = self.get_event_breaks_file(event_id)
-        with file_lock(breaks_file):
-            with open(breaks_file, 'w') as f:
-                json.dump(breaks, f, indent=2)
+        self._save_index(event_id, 'breaks', RecordIndex(breaks))
 
+    @event_transaction
     def create_break(self, event_id: str, name: str, break_type: str, expected_duration: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """Create a new break within an event"""
-        breaks = self.load_event_breaks(event_id)
+        index = self._load_index(event_id, 'breaks')
 
         break_id = str(uuid.uuid4())
         break_obj = {
@@ -334,52 +934,77 @@ class EventManager:
             'type': break_type,
             'isDone': False,
             'createdAt': datetime.now().isoformat(),
-            'order': len(breaks)
+            'order': next_order(index.records)
         }
 
         if expected_duration is not None:
             break_obj['expectedDuration'] = expected_duration
 
-        breaks.append(break_obj)
-        self.save_event_breaks(event_id, breaks)
+        index.append(break_obj)
+        self._save_index(event_id, 'breaks', index, [op_put(break_obj)])
         return break_obj
 
     def get_break(self, event_id: str, break_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific break"""
-        breaks = self.load_event_breaks(event_id)
-        return next((b for b in breaks if b['id'] == break_id), None)
+        return self._load_index(event_id, 'breaks').get(break_id)
 
+    @event_transaction
     def update_break(self, event_id: str, break_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update a break"""
-        breaks = self.load_event_breaks(event_id)
-        break_obj = next((b for b in breaks if b['id'] == break_id), None)
+        index = self._load_index(event_id, 'breaks')
+        break_obj = index.get(break_id)
 
         if break_obj:
             break_obj.update(updates)
-            self.save_event_breaks(event_id, breaks)
+            self._save_index(event_id, 'breaks', index, [op_put(break_obj)])
             return break_obj
         return None
 
+    @event_transaction
     def delete_break(self, event_id: str, break_id: str) -> bool:
         """Delete a break"""
-        breaks = self.load_event_breaks(event_id)
-        original_count = len(breaks)
-        breaks = [b for b in breaks if b['id'] != break_id]
-
-        if len(breaks) < original_count:
-            self.save_event_breaks(event_id, breaks)
+        index = self._load_index(event_id, 'breaks')
+        if index.remove(break_id):
+            self._save_index(event_id, 'breaks', index, [op_delete(break_id)])
             return True
         return False
 
+    @event_transaction
+    def reorder_breaks(self, event_id: str, order: List[str]) -> List[Dict[str, Any]]:
+        """Reorder breaks within an event
+
+        Like reorder_performances, only breaks that have to move are updated.
+        """
+        index = self._load_index(event_id, 'breaks')
+        changed = arrange(index.records, order)
+        if changed:
+            self._save_index(event_id, 'breaks', index, [op_put(b) for b in changed])
+        return index.records
+
+    @event_transaction
+    def rebalance_order(self, event_id: str, kind: str) -> bool:
+        """Renumber an event's performances or breaks 0, 1, 2, ... if their orders got too close"""
+        if not self.get_event(event_id):
+            return True
+        index = self._load_index(event_id, kind)
+        if needs_rebalance(index.records):
+            changed = rebalance(index.records)
+            self._save_index(event_id, kind, index, [op_put(r) for r in changed])
+        return True
+
+    @event_transaction
     def update_event(self, event_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update an event"""
         event = self.get_event(event_id)
         if event:
             event.update(updates)
-            self.save_events()
+            self._bump_version(event)
+            self.save_events([op_put(event)])
+            self._publish(event_id, 'event', [op_put(event)], [event])
             return event
         return None
 
+    @event_transaction
     def save_event_cover_image(self, event_id: str, file, filename: str) -> Optional[str]:
         """Save a cover image for an event"""
         event_dir = self.get_event_dir(event_id)
@@ -405,7 +1030,9 @@ class EventManager:
         event = self.get_event(event_id)
         if event:
             event['coverImage'] = cover_filename
-            self.save_events()
+            self._bump_version(event)
+            self.save_events([op_put(event)])
+            self._publish(event_id, 'event', [op_put(event)], [event])
             return cover_filename
         return None
 
@@ -420,6 +1047,7 @@ class EventManager:
 
 # Global event manager instance
 em = EventManager()
+atexit.register(em.close)
 
 def allowed_file(filename: str) -> bool:
     """Check if file extension is allowed"""
@@ -431,37 +1059,85 @@ def allowed_image_file(filename: str) -> bool:
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
 
-def get_audio_duration(file_path: Path) -> Optional[int]:
-    """Extract audio duration in seconds from file"""
-    try:
-        audio = MutagenFile(str(file_path))
-        if audio is not None and audio.info is not None:
-            return int(audio.info.length)
-    except Exception as e:
-        logging.warning(f"Could not extract duration from {file_path}: {e}")
-    return None
+def event_validators(events: List[Dict[str, Any]]) -> Tuple[str, Optional[datetime]]:
+    """Strong ETag and Last-Modified time for a response built from these events
+
+    Every change to an event or its performances/breaks bumps the event's
+    version, so the versions plus the query string identify the response body.
+    """
+    digest = hashlib.sha1()
+    last_modified = None
+    for event in events:
+        digest.update(f"{event['id']}:{event.get('version', 0)};".encode())
+        try:
+            # Timestamps are stored as naive local time
+            modified = datetime.fromisoformat(event.get('updatedAt') or event['createdAt']).astimezone(timezone.utc)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if last_modified is None or modified > last_modified:
+            last_modified = modified
+    digest.update(b'?' + request.query_string)
+    return digest.hexdigest()[:32], last_modified
+
+def conditional_json(events: List[Dict[str, Any]], build: Callable[[], Any]) -> Response:
+    """Answer a GET with 304 if the client's copy is current, otherwise with build()'s response
+
+    build() only runs when the body is actually needed, so unchanged polls
+    skip loading and serializing the data.
+    """
+    etag, last_modified = event_validators(events)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(build())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Let browsers keep the body but revalidate on every request
+    response.cache_control.no_cache = True
+    return response
+
+def store_uploaded_tracks(event_id: str, performance_id: str, uploads, performer: str) -> List[Dict[str, Any]]:
+    """Move streamed uploads into a performance's directory and add them as tracks"""
+    performance_dir = em.get_performance_dir(event_id, performance_id)
+    performance_dir.mkdir(parents=True, exist_ok=True)
+    tracks = []
+    for upload in uploads:
+        if upload.temp_path is None or not allowed_file(upload.filename):
+            continue
+        # Linked from the blob store without overwriting; duplicate names get a _1, _2, ... suffix
+        filename, content_hash = em.store_track_file(performance_dir, upload)
+        # Add track to performance; its metadata is read in the background
+        track = em.add_track(event_id, performance_id, filename, performer, performance_dir / filename, content_hash)
+        if track:
+            tracks.append(track)
+        else:
+            # The performance was deleted meanwhile
+            (performance_dir / filename).unlink(missing_ok=True)
+            em.blobs.release(content_hash)
+    return tracks
+
+@app.before_request
+def sync_event_manager():
+    """Pick up changes made by other server workers"""
+    em.sync()
 
 # Event endpoints
 @app.route('/api/events', methods=['GET'])
 def get_events():
-    """Get all events with performance counts"""
-    events_with_counts = []
-    for event in em.events:
-        event_with_count = event.copy()
-        # Get performance count for this event
+    """Get all events with performance counts (supports pagination and fields=, see listing.py)"""
+    def build():
+        summaries = [em.get_event_summary(event['id']) for event in em.events]
+        if not request.args:
+            return jsonify(summaries)
         try:
-            # Load performances from the event's performances.json file
-            performances_file = em.get_event_performances_file(event['id'])
-            if performances_file.exists():
-                with open(performances_file, 'r') as f:
-                    event_performances = json.load(f)
-                event_with_count['performanceCount'] = len(event_performances)
-            else:
-                event_with_count['performanceCount'] = 0
-        except Exception:
-            event_with_count['performanceCount'] = 0
-        events_with_counts.append(event_with_count)
-    return jsonify(events_with_counts)
+            page, headers = apply_listing(summaries, request.args, sort_key=created_key)
+        except ListingError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(page), 200, headers
+    return conditional_json(em.events, build)
 
 @app.route('/api/events', methods=['POST'])
 def create_event():
@@ -510,21 +1186,9 @@ def create_event():
 def get_event(event_id: str):
     """Get a specific event with performance count"""
     event = em.get_event(event_id)
-    if event:
-        event_with_count = event.copy()
-        # Get performance count for consistency with list endpoint
-        try:
-            performances_file = em.get_event_performances_file(event['id'])
-            if performances_file.exists():
-                with open(performances_file, 'r') as f:
-                    event_performances = json.load(f)
-                event_with_count['performanceCount'] = len(event_performances)
-            else:
-                event_with_count['performanceCount'] = 0
-        except Exception:
-            event_with_count['performanceCount'] = 0
-        return jsonify(event_with_count)
-    return jsonify({'error': 'Event not found'}), 404
+    if not event:
+        return jsonify({'error': 'Event not found'}), 404
+    return conditional_json([event], lambda: jsonify(em.get_event_summary(event_id)))
 
 @app.route('/api/events/<event_id>', methods=['PUT'])
 def update_event_details(event_id: str):
@@ -611,13 +1275,18 @@ def verify_unlock_code(event_id: str):
 # Performance endpoints within events
 @app.route('/api/events/<event_id>/performances', methods=['GET'])
 def get_event_performances(event_id: str):
-    """Get all performances for an event"""
+    """Get all performances for an event (supports filtering, pagination and fields=, see listing.py)"""
     event = em.get_event(event_id)
     if not event:
         return jsonify({'error': 'Event not found'}), 404
 
-    performances = em.load_event_performances(event_id)
-    return jsonify(performances)
+    def build():
+        try:
+            page, headers = apply_listing(em.load_event_performances(event_id), request.args)
+        except ListingError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(page), 200, headers
+    return conditional_json([event], build)
 
 @app.route('/api/events/<event_id>/performances', methods=['POST'])
 def create_event_performance(event_id: str):
@@ -628,50 +1297,37 @@ def create_event_performance(event_id: str):
 
     # Check if this is a form submission with files
     if request.content_type and 'multipart/form-data' in request.content_type:
-        # Handle form data with files
-        name = request.form.get('name')
-        performer = request.form.get('performer', '')
-        perf_type = request.form.get('type', 'Song')
-        mode = request.form.get('mode', 'Solo')
-        expected_duration = request.form.get('expectedDuration')
-        is_continuous = request.form.get('isContinuous') == 'true'
-
-        if not name:
-            return jsonify({'error': 'Name is required'}), 400
-
-        # Convert expectedDuration to int if provided
-        duration = None
-        if expected_duration and expected_duration.strip():
-            try:
-                duration = int(expected_duration)
-            except ValueError:
-                pass
-
-        # Create performance
-        performance = em.create_performance(event_id, name, performer, perf_type, mode, duration, is_continuous)
-        if not performance:
-            return jsonify({'error': 'Failed to create performance'}), 500
-
-        # Handle file uploads
-        files = request.files.getlist('files')
-        for file in files:
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                performance_dir = em.get_performance_dir(event_id, performance['id'])
-                file_path = performance_dir / filename
-
-                # Handle duplicate filenames
-                counter = 1
-                original_name, ext = os.path.splitext(filename)
-                while file_path.exists():
-                    filename = f"{original_name}_{counter}{ext}"
-                    file_path = performance_dir / filename
-                    counter += 1
-
-                file.save(file_path)
-
-                # Add track to performance with file path for duration extraction
-                track = em.add_track(event_id, performance['id'], filename, performer, file_path)
+        # Files are streamed into the event directory, then moved into the
+        # new performance's directory once the form fields are known
+        try:
+            with streamed_upload(request, em.get_event_dir(event_id), accept=allowed_file) as (form, files):
+                name = form.get('name')
+                performer = form.get('performer', '')
+                perf_type = form.get('type', 'Song')
+                mode = form.get('mode', 'Solo')
+                expected_duration = form.get('expectedDuration')
+                is_continuous = form.get('isContinuous') == 'true'
+
+                if not name:
+                    return jsonify({'error': 'Name is required'}), 400
+
+                # Convert expectedDuration to int if provided
+                duration = None
+                if expected_duration and expected_duration.strip():
+                    try:
+                        duration = int(expected_duration)
+                    except ValueError:
+                        pass
+
+                # Create performance
+                performance = em.create_performance(event_id, name, performer, perf_type, mode, duration, is_continuous)
+                if not performance:
+                    return jsonify({'error': 'Failed to create performance'}), 500
+
+                # Handle file uploads
+                store_uploaded_tracks(event_id, performance['id'], files.getlist('files'), performer)
+        except UploadError as e:
+            return jsonify({'error': str(e)}), e.status
 
         # Return updated performance with tracks
         updated_performance = em.get_performance(event_id, performance['id'])
@@ -698,10 +1354,16 @@ def create_event_performance(event_id: str):
 @app.route('/api/events/<event_id>/performances/<performance_id>', methods=['GET'])
 def get_event_performance(event_id: str, performance_id: str):
     """Get a specific performance within an event"""
-    performance = em.get_performance(event_id, performance_id)
-    if performance:
-        return jsonify(performance)
-    return jsonify({'error': 'Performance not found'}), 404
+    event = em.get_event(event_id)
+    if not event:
+        return jsonify({'error': 'Performance not found'}), 404
+
+    def build():
+        performance = em.get_performance(event_id, performance_id)
+        if performance:
+            return jsonify(performance)
+        return jsonify({'error': 'Performance not found'}), 404
+    return conditional_json([event], build)
 
 @app.route('/api/events/<event_id>/performances/<performance_id>', methods=['PUT'])
 def update_event_performance(event_id: str, performance_id: str):
@@ -724,20 +1386,8 @@ def delete_event_performance(event_id: str, performance_id: str):
 
 @app.route('/api/events/<event_id>/performances/<performance_id>/upload', methods=['POST'])
 def upload_event_track(event_id: str, performance_id: str):
-    """Upload a track file to a performance within an event"""
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
-
-    file = request.files['file']
-    performer = request.form.get('performer', 'Unknown')
-
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-
-    if not allowed_file(file.filename):
-        return jsonify({'error': 'File type not allowed'}), 400
-
-    # Check if event and performance exist
+    """Upload a track file to a performance within an event (streamed to disk, see uploads.py)"""
+    # Check if event and performance exist before reading the body
     event = em.get_event(event_id)
     if not event:
         return jsonify({'error': 'Event not found'}), 404
@@ -746,31 +1396,38 @@ def upload_event_track(event_id: str, performance_id: str):
     if not performance:
         return jsonify({'error': 'Performance not found'}), 404
 
-    # Save file
-    filename = secure_filename(file.filename)
     performance_dir = em.get_performance_dir(event_id, performance_id)
-    file_path = performance_dir / filename
+    performance_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        with streamed_upload(request, performance_dir, accept=allowed_file) as (form, files):
+            if 'file' not in files:
+                return jsonify({'error': 'No file provided'}), 400
 
-    # Handle duplicate filenames
-    counter = 1
-    original_name, ext = os.path.splitext(filename)
-    while file_path.exists():
-        filename = f"{original_name}_{counter}{ext}"
-        file_path = performance_dir / filename
-        counter += 1
+            file = files['file']
+            performer = form.get('performer', 'Unknown')
 
-    file.save(file_path)
+            if file.filename == '':
+                return jsonify({'error': 'No file selected'}), 400
 
-    # Add track to performance with file path for duration extraction
-    track = em.add_track(event_id, performance_id, filename, performer, file_path)
-    if track:
-        return jsonify(track), 201
+            if not allowed_file(file.filename):
+                return jsonify({'error': 'File type not allowed'}), 400
+
+            tracks = store_uploaded_tracks(event_id, performance_id, [file], performer)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+
+    if tracks:
+        return jsonify(tracks[0]), 201
 
     return jsonify({'error': 'Failed to add track'}), 500
 
 @app.route('/api/events/<event_id>/performances/<performance_id>/files/<filename>')
 def serve_event_track_file(event_id: str, performance_id: str, filename: str):
-    """Serve audio files with range support for streaming"""
+    """Serve audio files with range support for streaming
+
+    ?quality=low|medium|aac serves a compressed rendition (see transcode.py).
+    Until it has been made, the request is redirected to the original.
+    """
     event = em.get_event(event_id)
     if not event:
         return jsonify({'error': 'Event not found'}), 404
@@ -784,43 +1441,50 @@ def serve_event_track_file(event_id: str, performance_id: str, filename: str):
     if not file_path.exists():
         return jsonify({'error': 'File not found'}), 404
 
-    # Handle range requests for audio streaming
-    range_header = request.headers.get('Range', None)
-    if not range_header:
-        return send_file(file_path)
+    quality = request.args.get('quality', transcode.ORIGINAL)
+    if quality != transcode.ORIGINAL:
+        if quality not in transcode.RENDITIONS:
+            return jsonify({'error': f'Unknown quality: {quality}'}), 400
+        rendition = transcode.ready_rendition(file_path, quality)
+        if rendition is not None:
+            return send_audio_file(rendition, request)
+
+        track = em.get_track_by_filename(event_id, performance_id, file_path.name) or {}
+        # Not worth it for files that are already small enough
+        if not track.get('bitrate') or track['bitrate'] > transcode.RENDITIONS[quality].bitrate:
+            em.transcoder.submit(file_path, quality)
+        # A redirect (not the original under this URL) keeps range requests
+        # of one playback on one file when the rendition appears
+        response = redirect(request.path, 307)
+        response.cache_control.no_store = True
+        return response
+
+    return send_audio_file(file_path, request)
+
+@app.route('/api/events/<event_id>/performances/<performance_id>/tracks/<track_id>/peaks')
+def get_track_peaks(event_id: str, performance_id: str, track_id: str):
+    """Waveform peaks of a track in the binary format described in peaks.py
+
+    Answers 202 while they are computed in the background.
+    """
+    track = em.get_track(event_id, performance_id, track_id)
+    if not track:
+        return jsonify({'error': 'Track not found'}), 404
 
-    # Parse range header
-    byte_start = 0
-    byte_end = None
-    file_size = file_path.stat().st_size
-
-    if range_header:
-        match = range_header.replace('bytes=', '').split('-')
-        byte_start = int(match[0]) if match[0] else 0
-        byte_end = int(match[1]) if match[1] else file_size - 1
-
-    if byte_end is None:
-        byte_end = file_size - 1
-
-    # Read file chunk
-    chunk_size = byte_end - byte_start + 1
-
-    def generate():
-        with open(file_path, 'rb') as f:
-            f.seek(byte_start)
-            data = f.read(chunk_size)
-            yield data
-
-    rv = Response(generate(),
-                  206,
-                  headers={
-                      "Content-Range": f"bytes {byte_start}-{byte_end}/{file_size}",
-                      "Accept-Ranges": "bytes",
-                      "Content-Length": str(chunk_size),
-                      "Content-Type": "audio/mpeg",
-                  }
-                  )
-    return rv
+    file_path = em.get_performance_dir(event_id, performance_id) / track['filename']
+    if not file_path.exists():
+        return jsonify({'error': 'File not found'}), 404
+
+    path = ready_peaks(file_path)
+    if path is None:
+        em.peaks.submit(file_path)
+        if em.peaks.failed(file_path):
+            return jsonify({'error': 'Waveform not available for this file'}), 422
+        return jsonify({'status': 'pending'}), 202, {'Retry-After': '2', 'Cache-Control': 'no-store'}
+
+    stat = path.stat()
+    return send_file(path, mimetype='application/octet-stream', conditional=True,
+                     etag=file_etag(stat), last_modified=stat.st_mtime, max_age=PEAKS_MAX_AGE)
 
 @app.route('/api/events/<event_id>/performances/reorder', methods=['POST'])
 def reorder_event_performances(event_id: str):
@@ -830,6 +1494,8 @@ def reorder_event_performances(event_id: str):
         return jsonify({'error': 'Event not found'}), 404
 
     data = request.get_json()
+    if data and 'id' in data:
+        return move_record(event_id, 'performances', data)
     if not data or 'order' not in data:
         return jsonify({'error': 'Order array is required'}), 400
 
@@ -837,6 +1503,36 @@ def reorder_event_performances(event_id: str):
         return jsonify({'success': True})
     return jsonify({'error': 'Failed to reorder performances'}), 500
 
+def move_record(event_id: str, kind: str, data: Dict[str, Any]):
+    """Reorder by moving one record: JSON {id, before} or {id, after}; only that record is written"""
+    operation = {'op': 'move', 'kind': kind, 'id': data['id']}
+    operation.update((key, data[key]) for key in ('before', 'after') if key in data)
+    try:
+        _, changed = em.apply_batch(event_id, [operation])
+    except BatchError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'success': True, 'changed': changed.get(kind, [])})
+
+@app.route('/api/events/<event_id>/batch', methods=['POST'])
+def apply_event_batch(event_id: str):
+    """Apply many changes in one transaction: JSON {operations, version} (see batch.py)
+
+    Answers with the event version afterwards and the changed records. With
+    `version`, the batch is refused (409) if the event has changed since.
+    """
+    if not em.get_event(event_id):
+        return jsonify({'error': 'Event not found'}), 404
+    data = request.get_json(silent=True) or {}
+    expected = data.get('version')
+    if expected is not None and (not isinstance(expected, int) or isinstance(expected, bool)):
+        return jsonify({'error': 'version must be an event version number'}), 400
+
+    try:
+        version, changed = em.apply_batch(event_id, data.get('operations'), expected)
+    except BatchError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'version': version, 'changed': changed})
+
 @app.route('/api/events/<event_id>/performances/<performance_id>/tracks/<track_id>', methods=['PUT'])
 def update_track(event_id: str, performance_id: str, track_id: str):
     """Update a specific track's properties"""
@@ -888,34 +1584,223 @@ def add_tracks_to_performance(event_id: str, performance_id: str):
     if not performance:
         return jsonify({'error': 'Performance not found'}), 404
 
-    performer = request.form.get('performer', 'Unknown')
-    files = request.files.getlist('files')
-
-    if not files:
-        return jsonify({'error': 'No files provided'}), 400
-
-    added_tracks = []
-    for file in files:
-        if file and file.filename and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            performance_dir = em.get_performance_dir(event_id, performance_id)
-            file_path = performance_dir / filename
-
-            # Handle duplicate filenames
-            counter = 1
-            original_name, ext = os.path.splitext(filename)
-            while file_path.exists():
-                filename = f"{original_name}_{counter}{ext}"
-                file_path = performance_dir / filename
-                counter += 1
-
-            file.save(file_path)
-            track = em.add_track(event_id, performance_id, filename, performer, file_path)
-            if track:
-                added_tracks.append(track)
+    performance_dir = em.get_performance_dir(event_id, performance_id)
+    performance_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        with streamed_upload(request, performance_dir, accept=allowed_file) as (form, files):
+            uploads = files.getlist('files')
+            if not uploads:
+                return jsonify({'error': 'No files provided'}), 400
+            added_tracks = store_uploaded_tracks(event_id, performance_id, uploads, form.get('performer', 'Unknown'))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
 
     return jsonify({'message': f'Added {len(added_tracks)} tracks', 'tracks': added_tracks}), 201
 
+@app.route('/api/events/<event_id>/performances/<performance_id>/tracks/by-hash', methods=['POST'])
+def add_track_by_hash(event_id: str, performance_id: str):
+    """Add a track whose content is already stored, without uploading it again"""
+    performance = em.get_performance(event_id, performance_id)
+    if not performance:
+        return jsonify({'error': 'Performance not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+
+    content_hash = data.get('contentHash', '')
+    if not isinstance(content_hash, str):
+        return jsonify({'error': 'contentHash must be a string'}), 400
+    performance_dir = em.get_performance_dir(event_id, performance_id)
+    performance_dir.mkdir(parents=True, exist_ok=True)
+    stored = em.blobs.link(content_hash, performance_dir, secure_filename(filename))
+    if stored is None:
+        # The client uploads the file instead
+        return jsonify({'error': 'Content not stored'}), 404
+
+    track = em.add_track(event_id, performance_id, stored, data.get('performer', 'Unknown'),
+                         performance_dir / stored, content_hash)
+    if track:
+        return jsonify(track), 201
+    (performance_dir / stored).unlink(missing_ok=True)
+    em.blobs.release(content_hash)
+    return jsonify({'error': 'Failed to add track'}), 500
+
+@app.route('/api/events/<event_id>/rescan', methods=['POST'])
+def rescan_event(event_id: str):
+    """Re-read track metadata (duration, bitrate, ...) of an event from its files"""
+    if not em.get_event(event_id):
+        return jsonify({'error': 'Event not found'}), 404
+    return jsonify(em.rescan_event(event_id))
+
+def prefetch_count(value: Any) -> Optional[int]:
+    """A requested number of performances to prefetch, None if invalid"""
+    if value is None:
+        return PREFETCH_COUNT
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        return None
+    return count if 0 <= count <= MAX_PREFETCH_COUNT else None
+
+@app.route('/api/events/<event_id>/changes')
+def stream_event_changes(event_id: str):
+    """Push channel: Server-Sent Events with the deltas of an event's changes (see changefeed.py)
+
+    Clients load the event and apply the 'change' messages after it; on
+    'reset' they load it again. ?since=<version> starts after the version
+    the client loaded; EventSource sends Last-Event-ID when it reconnects.
+    A worker serves at most changefeed.MAX_STREAMS at once; more get 503.
+    """
+    event = em.get_event(event_id)
+    if not event:
+        return jsonify({'error': 'Event not found'}), 404
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an event version'}), 400
+
+    if not em.changes.open_stream():
+        # Every stream holds a server thread; EventSource stops on this answer
+        # and the web interface tries again after Retry-After
+        return jsonify({'error': 'Too many open change streams'}), 503, {'Retry-After': str(RETRY_MS // 1000)}
+    stream = em.changes.stream(event_id, event.get('version', 0), last_id, em.closing)
+    response = Response(stream, mimetype='text/event-stream',
+                        # Proxies must pass each message on as it is written
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(em.changes.close_stream)
+    return response
+
+@app.route('/api/events/<event_id>/show', methods=['POST'])
+def warm_show(event_id: str):
+    """Show mode: warm the current performance and the next `count` (JSON {performanceId, count})
+
+    The files are read into the page cache in the background; the answer is
+    the prefetch hint for the same performances.
+    """
+    if not em.get_event(event_id):
+        return jsonify({'error': 'Event not found'}), 404
+    data = request.get_json(silent=True) or {}
+    count = prefetch_count(data.get('count'))
+    if count is None:
+        return jsonify({'error': f'count must be a number from 0 to {MAX_PREFETCH_COUNT}'}), 400
+
+    performances = em.upcoming_performances(event_id, data.get('performanceId'), count)
+    if performances is None:
+        return jsonify({'error': 'Performance not found'}), 404
+    em.warm_performances(event_id, performances)
+    return jsonify(prefetch_hint(event_id, performances))
+
+@app.route('/api/events/<event_id>/prefetch')
+def get_prefetch_hint(event_id: str):
+    """Tracks a player may preload: ?performance=<current id>&count=<performances after it>"""
+    event = em.get_event(event_id)
+    if not event:
+        return jsonify({'error': 'Event not found'}), 404
+    count = prefetch_count(request.args.get('count'))
+    if count is None:
+        return jsonify({'error': f'count must be a number from 0 to {MAX_PREFETCH_COUNT}'}), 400
+
+    def build():
+        performances = em.upcoming_performances(event_id, request.args.get('performance'), count)
+        if performances is None:
+            return jsonify({'error': 'Performance not found'}), 404
+        return jsonify(prefetch_hint(event_id, performances))
+    return conditional_json([event], build)
+
+# Resumable uploads (see resumable.py)
+def find_resumable_upload(event_id: str, performance_id: str, upload_id: str):
+    """Return (upload, None) or (None, error response)"""
+    if not em.get_performance(event_id, performance_id):
+        return None, (jsonify({'error': 'Performance not found'}), 404)
+    upload = get_upload(em.get_performance_dir(event_id, performance_id), upload_id)
+    if upload is None:
+        return None, (jsonify({'error': 'Upload not found'}), 404)
+    return upload, None
+
+def upload_offset_headers(upload) -> Dict[str, str]:
+    return {
+        'Upload-Offset': str(upload.offset),
+        'Upload-Length': str(upload.length),
+        'Cache-Control': 'no-store',
+    }
+
+@app.route('/api/events/<event_id>/performances/<performance_id>/uploads', methods=['POST'])
+def create_resumable_upload(event_id: str, performance_id: str):
+    """Start a resumable upload; the client then PATCHes the data in pieces"""
+    if not em.get_performance(event_id, performance_id):
+        return jsonify({'error': 'Performance not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    length = data.get('length')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    if not isinstance(length, int) or isinstance(length, bool) or length <= 0:
+        return jsonify({'error': 'length must be a positive number of bytes'}), 400
+    if length > uploads.MAX_FILE_SIZE:
+        return jsonify({'error': f'{filename} is too large'}), 413
+
+    performance_dir = em.get_performance_dir(event_id, performance_id)
+    expire_uploads(em.config_dir)
+    upload = create_upload(performance_dir, filename, length, data.get('performer', 'Unknown'))
+    location = f'/api/events/{event_id}/performances/{performance_id}/uploads/{upload.id}'
+    return jsonify(upload.to_dict()), 201, {**upload_offset_headers(upload), 'Location': location}
+
+@app.route('/api/events/<event_id>/performances/<performance_id>/uploads/<upload_id>', methods=['GET'])
+def get_resumable_upload(event_id: str, performance_id: str, upload_id: str):
+    """Upload status; HEAD returns just the Upload-Offset to resume from"""
+    upload, error = find_resumable_upload(event_id, performance_id, upload_id)
+    if error:
+        return error
+    return jsonify(upload.to_dict()), 200, upload_offset_headers(upload)
+
+@app.route('/api/events/<event_id>/performances/<performance_id>/uploads/<upload_id>', methods=['PATCH'])
+def append_resumable_upload(event_id: str, performance_id: str, upload_id: str):
+    """Append the request body at the offset given in the Upload-Offset header"""
+    upload, error = find_resumable_upload(event_id, performance_id, upload_id)
+    if error:
+        return error
+
+    offset = request.headers.get('Upload-Offset', '')
+    if not offset.isdigit():
+        return jsonify({'error': 'Upload-Offset header required'}), 400
+    try:
+        upload.append(request.stream, int(offset))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status, upload_offset_headers(upload)
+    return '', 204, upload_offset_headers(upload)
+
+@app.route('/api/events/<event_id>/performances/<performance_id>/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_resumable_upload(event_id: str, performance_id: str, upload_id: str):
+    """Add a completely uploaded file to the performance as a track"""
+    upload, error = find_resumable_upload(event_id, performance_id, upload_id)
+    if error:
+        return error
+    try:
+        uploaded = upload.finish()
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status, upload_offset_headers(upload)
+
+    try:
+        tracks = store_uploaded_tracks(event_id, performance_id, [uploaded], upload.info['performer'])
+    finally:
+        uploaded.discard()
+    if tracks:
+        return jsonify(tracks[0]), 201
+    return jsonify({'error': 'Failed to add track'}), 500
+
+@app.route('/api/events/<event_id>/performances/<performance_id>/uploads/<upload_id>', methods=['DELETE'])
+def delete_resumable_upload(event_id: str, performance_id: str, upload_id: str):
+    """Abort a resumable upload and delete its data"""
+    upload, error = find_resumable_upload(event_id, performance_id, upload_id)
+    if error:
+        return error
+    upload.delete()
+    return '', 204
+
 @app.route('/api/events/<event_id>/performances/<performance_id>/tracks/<track_id>', methods=['DELETE'])
 def delete_track(event_id: str, performance_id: str, track_id: str):
     """Delete a specific track from a performance"""
@@ -927,42 +1812,26 @@ def delete_track(event_id: str, performance_id: str, track_id: str):
     if not performance:
         return jsonify({'error': 'Performance not found'}), 404
 
-    # Find the track
-    track = None
-    for t in performance['tracks']:
-        if t['id'] == track_id:
-            track = t
-            break
-
-    if not track:
+    if not em.delete_track(event_id, performance_id, track_id):
         return jsonify({'error': 'Track not found'}), 404
 
-    # Remove file from filesystem
-    performance_dir = em.get_performance_dir(event_id, performance_id)
-    file_path = performance_dir / track['filename']
-    if file_path.exists():
-        file_path.unlink()
-
-    # Remove track from performance
-    performances = em.load_event_performances(event_id)
-    for perf in performances:
-        if perf['id'] == performance_id:
-            perf['tracks'] = [t for t in perf['tracks'] if t['id'] != track_id]
-            break
-
-    em.save_event_performances(event_id, performances)
     return jsonify({'message': 'Track deleted successfully'}), 200
 
 # Break endpoints
 @app.route('/api/events/<event_id>/breaks', methods=['GET'])
 def get_event_breaks(event_id: str):
-    """Get all breaks for an event"""
+    """Get all breaks for an event (supports filtering, pagination and fields=, see listing.py)"""
     event = em.get_event(event_id)
     if not event:
         return jsonify({'error': 'Event not found'}), 404
 
-    breaks = em.load_event_breaks(event_id)
-    return jsonify(breaks)
+    def build():
+        try:
+            page, headers = apply_listing(em.load_event_breaks(event_id), request.args)
+        except ListingError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(page), 200, headers
+    return conditional_json([event], build)
 
 @app.route('/api/events/<event_id>/breaks', methods=['POST'])
 def create_event_break(event_id: str):
@@ -976,9 +1845,8 @@ def create_event_break(event_id: str):
         return jsonify({'error': 'Name and type are required'}), 400
 
     # Validate break type
-    valid_types = ['Lunch', 'Dinner', 'Broadcast', 'Announcement', 'Appearence', 'Special Show']
-    if data['type'] not in valid_types:
-        return jsonify({'error': f'Invalid break type. Must be one of: {", ".join(valid_types)}'}), 400
+    if data['type'] not in BREAK_TYPES:
+        return jsonify({'error': f'Invalid break type. Must be one of: {", ".join(BREAK_TYPES)}'}), 400
 
     break_obj = em.create_break(event_id, data['name'], data['type'], data.get('expectedDuration'))
     if break_obj:
@@ -999,9 +1867,8 @@ def update_event_break(event_id: str, break_id: str):
 
     # Validate break type if provided
     if 'type' in data:
-        valid_types = ['Lunch', 'Dinner', 'Broadcast', 'Announcement', 'Appearence', 'Special Show']
-        if data['type'] not in valid_types:
-            return jsonify({'error': f'Invalid break type. Must be one of: {", ".join(valid_types)}'}), 400
+        if data['type'] not in BREAK_TYPES:
+            return jsonify({'error': f'Invalid break type. Must be one of: {", ".join(BREAK_TYPES)}'}), 400
 
     break_obj = em.update_break(event_id, break_id, data)
     if break_obj:
@@ -1029,6 +1896,8 @@ def reorder_event_breaks(event_id: str):
         return jsonify({'error': 'Event not found'}), 404
 
     data = request.get_json()
+    if data and 'id' in data:
+        return move_record(event_id, 'breaks', data)
     if not data or 'order' not in data:
         return jsonify({'error': 'Order array is required'}), 400
 
@@ -1037,21 +1906,7 @@ def reorder_event_breaks(event_id: str):
         return jsonify({'error': 'Order must be an array'}), 400
 
     app.logger.info(f"Received new break order: {new_order}")
-    breaks = em.load_event_breaks(event_id)
-
-    # Create a mapping of id to break
-    break_map = {b['id']: b for b in breaks}
-
-    # Update order ONLY for breaks that are in the reorder list
-    # All other breaks are preserved with their existing order values
-    for index, break_id in enumerate(new_order):
-        if break_id in break_map:
-            break_map[break_id]['order'] = index
-
-    # Keep ALL breaks, not just the ones being reordered
-    all_breaks = list(break_map.values())
-
-    em.save_event_breaks(event_id, all_breaks)
+    all_breaks = em.reorder_breaks(event_id, new_order)
     app.logger.info(f"Saved new break order with {len(all_breaks)} total breaks")
     return jsonify({'message': 'Breaks reordered successfully'})
 
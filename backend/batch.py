@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Batched changes to an event's performances and breaks
+
+POST /api/events/<id>/batch applies a list of operations inside one event
+transaction and saves each record list once, with only the records that
+changed. The batch is all or nothing: if an operation is invalid, none are
+kept.
+
+    {"op": "move", "kind": "performances", "id": ..., "before": <id>}
+        also "after": <id>; with neither the record moves to the end
+    {"op": "update", "kind": "breaks", "id": ..., "set": {"name": "Interval"}}
+    {"op": "setDone", "kind": "performances", "id": ..., "isDone": true}
+    {"op": "completeTrack", "performanceId": ..., "trackId": ..., "isCompleted": true}
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+
+from listing import order_key
+from ordering import arrange
+
+KINDS = ('performances', 'breaks')
+MAX_OPERATIONS = 500
+
+BREAK_TYPES = ['Lunch', 'Dinner', 'Broadcast', 'Announcement', 'Appearence', 'Special Show']
+
+# Set through other operations or by the server only
+PROTECTED_FIELDS = frozenset({'id', 'order', 'tracks', 'createdAt'})
+
+class BatchError(ValueError):
+    """Raised for an invalid operation; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 400, position: Optional[int] = None):
+        super().__init__(message if position is None else f'Operation {position}: {message}')
+        self.status = status
+
+def move(records: List[Dict[str, Any]], record: Dict[str, Any],
+         before: Optional[str] = None, after: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Move a record before or after another in running order (or to the end)
+
+    Only the moved record gets a new order, between its new neighbours
+    (see ordering.py); returns the records whose order changed.
+    """
+    ordered = [r for r in sorted(records, key=order_key) if r['id'] != record['id']]
+    anchor = before if before is not None else after
+    if anchor is None:
+        position = len(ordered)
+    else:
+        position = next((i for i, r in enumerate(ordered) if r['id'] == anchor), None)
+        if position is None:
+            raise BatchError(f'{anchor} not found', 404)
+        if after is not None:
+            position += 1
+    ordered.insert(position, record)
+    return arrange(records, [r['id'] for r in ordered])
+
+def _id(operation: Dict[str, Any], field: str, required: bool = True) -> Optional[str]:
+    """The id in `field` of an operation; None if it is optional and not given"""
+    if field not in operation and not required:
+        return None
+    value = operation.get(field)
+    if not isinstance(value, str):
+        raise BatchError(f'{field} must be a string')
+    return value
+
+def _record(load: Callable[[str], Any], operation: Dict[str, Any]):
+    kind = operation.get('kind')
+    if kind not in KINDS:
+        raise BatchError(f"kind must be one of: {', '.join(KINDS)}")
+    record_id = _id(operation, 'id')
+    index = load(kind)
+    record = index.get(record_id)
+    if record is None:
+        raise BatchError(f'{record_id} not found', 404)
+    return kind, index, record
+
+def apply_operation(load: Callable[[str], Any], operation: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Apply one operation to the record indexes returned by load(kind)
+
+    Returns the changed records by kind. The records are changed in place.
+    """
+    if not isinstance(operation, dict):
+        raise BatchError('must be an object')
+    op = operation.get('op')
+
+    if op == 'move':
+        kind, index, record = _record(load, operation)
+        before, after = _id(operation, 'before', False), _id(operation, 'after', False)
+        if before is not None and after is not None:
+            raise BatchError('give before or after, not both')
+        return {kind: move(index.records, record, before, after)}
+
+    if op == 'update':
+        kind, index, record = _record(load, operation)
+        updates = operation.get('set')
+        if not isinstance(updates, dict) or not updates:
+            raise BatchError('set must be an object of fields')
+        protected = PROTECTED_FIELDS.intersection(updates)
+        if protected:
+            raise BatchError(f"{', '.join(sorted(protected))} cannot be set")
+        if kind == 'breaks' and 'type' in updates and updates['type'] not in BREAK_TYPES:
+            raise BatchError(f'Invalid break type. Must be one of: {", ".join(BREAK_TYPES)}')
+        record.update(updates)
+        return {kind: [record]}
+
+    if op == 'setDone':
+        kind, index, record = _record(load, operation)
+        if not isinstance(operation.get('isDone'), bool):
+            raise BatchError('isDone must be true or false')
+        record['isDone'] = operation['isDone']
+        return {kind: [record]}
+
+    if op == 'completeTrack':
+        performance_id, track_id = _id(operation, 'performanceId'), _id(operation, 'trackId')
+        index = load('performances')
+        track = index.get_track(performance_id, track_id)
+        if track is None:
+            raise BatchError(f'track {track_id} not found', 404)
+        is_completed = operation.get('isCompleted', True)
+        if not isinstance(is_completed, bool):
+            raise BatchError('isCompleted must be true or false')
+        track['isCompleted'] = is_completed
+        return {'performances': [index.get(performance_id)]}
+
+    raise BatchError('op must be one of: move, update, setDone, completeTrack')
+
+def apply_operations(load: Callable[[str], Any], operations: Any) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Apply operations in order; returns the changed records by kind and id
+
+    Raises BatchError for the first invalid operation, after which the
+    records may be partly changed and must be reloaded.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('operations must be a non-empty array')
+    if len(operations) > MAX_OPERATIONS:
+        raise BatchError(f'At most {MAX_OPERATIONS} operations per batch')
+    changed: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for position, operation in enumerate(operations):
+        try:
+            result = apply_operation(load, operation)
+        except BatchError as e:
+            raise BatchError(str(e), e.status, position) from None
+        for kind, records in result.items():
+            changed.setdefault(kind, {}).update((r['id'], r) for r in records)
+    return changed
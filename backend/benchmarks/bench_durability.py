@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cost of each storage durability mode
+
+Measures, for every PERFORMANCE_MANAGER_DURABILITY mode:
+- snapshot: a full save of an event's performances (rewrites the document)
+- journal:  a single-record save (appended to the journal / one SQLite row)
+
+Usage:
+    python benchmarks/bench_durability.py [--performances 200] [--saves 200] [--dir /path/on/target/disk]
+
+Run it on the disk the data directory lives on: fsync costs depend heavily
+on the device and filesystem.
+"""
+
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from storage import DURABILITY_MODES, JsonStorage, SqliteStorage, SQLITE_DB_NAME, op_put
+
+
+def make_performances(count: int):
+    return [{
+        'id': f'perf-{i}',
+        'name': f'Performance {i}',
+        'performer': f'Artist {i}',
+        'type': 'Song',
+        'mode': 'Solo',
+        'isDone': False,
+        'order': i,
+        'tracks': [{
+            'id': f'track-{i}-{t}',
+            'filename': f'track_{t}.mp3',
+            'performer': f'Artist {i}',
+            'url': f'/api/events/bench/performances/perf-{i}/files/track_{t}.mp3',
+            'isCompleted': False,
+            'duration': 180,
+        } for t in range(3)],
+    } for i in range(count)]
+
+
+def time_saves(engine, performances, saves: int, single_record: bool) -> float:
+    """Return the mean save latency in milliseconds"""
+    start = time.perf_counter()
+    for i in range(saves):
+        record = performances[i % len(performances)]
+        record['isDone'] = not record['isDone']
+        changes = [op_put(record)] if single_record else None
+        engine.save('bench', 'performances', performances, changes)
+    return (time.perf_counter() - start) * 1000 / saves
+
+
+def run(args) -> None:
+    base_dir = Path(tempfile.mkdtemp(dir=args.dir))
+    try:
+        print(f"{args.performances} performances, {args.saves} saves per measurement, in {base_dir}")
+        print(f"{'engine':<8} {'durability':<10} {'snapshot ms':>12} {'single-record ms':>17}")
+        for durability in DURABILITY_MODES:
+            for name in ('json', 'sqlite'):
+                data_dir = base_dir / f'{name}-{durability}'
+                (data_dir / 'bench').mkdir(parents=True)
+                if name == 'json':
+                    # Keep compaction out of the single-record numbers
+                    engine = JsonStorage(data_dir, durability=durability,
+                                         compact_ops=args.saves + 1, compact_seconds=3600)
+                else:
+                    engine = SqliteStorage(data_dir / SQLITE_DB_NAME, durability)
+                performances = make_performances(args.performances)
+                engine.save('bench', 'performances', performances)
+
+                snapshot = time_saves(engine, performances, args.saves, single_record=False)
+                single = time_saves(engine, performances, args.saves, single_record=True)
+                engine.close()
+                print(f"{name:<8} {durability:<10} {snapshot:>12.3f} {single:>17.3f}")
+    finally:
+        shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark storage durability modes')
+    parser.add_argument('--performances', type=int, default=200, help='Performances in the event (default: 200)')
+    parser.add_argument('--saves', type=int, default=200, help='Saves per measurement (default: 200)')
+    parser.add_argument('--dir', default=None, help='Directory to run in (default: system temp dir)')
+    run(parser.parse_args())
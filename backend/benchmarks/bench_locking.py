@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark lock contention with parallel clients
+
+Each client process holds its own EventManager on a shared data directory,
+like a server worker, and runs several threads that add tracks to
+performances (a read-modify-write inside EventManager.transaction) while
+reader threads list performances. Two layouts are measured:
+- same-event:  every writer targets one event (fully contended lock)
+- per-event:   each process writes to its own event (independent locks)
+
+The track count is checked at the end, so any lost update is reported.
+
+Usage:
+    python benchmarks/bench_locking.py [--processes 4] [--threads 4] [--ops 50] [--storage json]
+"""
+
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app import EventManager
+
+
+def client(data_dir: str, storage: str, targets, threads: int, ops: int, readers: int, start, results) -> None:
+    """One worker process: writer threads add tracks, reader threads list performances"""
+    em = EventManager(config_dir=Path(data_dir), storage=storage)
+    stop_reading = False
+
+    def write(thread: int) -> float:
+        event_id, performance_id = targets[thread % len(targets)]
+        latencies = []
+        for i in range(ops):
+            began = time.perf_counter()
+            em.add_track(event_id, performance_id, f'{multiprocessing.current_process().name}-{thread}-{i}.mp3', 'Bench')
+            latencies.append(time.perf_counter() - began)
+        return max(latencies)
+
+    def read(thread: int) -> int:
+        event_id, _ = targets[thread % len(targets)]
+        count = 0
+        while not stop_reading:
+            em.sync()
+            em.load_event_performances(event_id)
+            count += 1
+        return count
+
+    start.wait()
+    with ThreadPoolExecutor(max_workers=threads + readers) as pool:
+        reader_futures = [pool.submit(read, t) for t in range(readers)]
+        began = time.perf_counter()
+        worst = max(pool.map(write, range(threads)))
+        elapsed = time.perf_counter() - began
+        stop_reading = True
+        reads = sum(f.result() for f in reader_futures)
+    em.close()
+    results.put((elapsed, worst, reads))
+
+
+def run_layout(args, layout: str) -> None:
+    data_dir = Path(tempfile.mkdtemp(dir=args.dir))
+    try:
+        em = EventManager(config_dir=data_dir, storage=args.storage)
+        event_count = 1 if layout == 'same-event' else args.processes
+        events = []
+        for e in range(event_count):
+            event = em.create_event(f'Bench {e}')
+            performance = em.create_performance(event['id'], 'Opening', 'Bench')
+            events.append((event['id'], performance['id']))
+        em.close()
+
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(
+            target=client,
+            args=(str(data_dir), args.storage, [events[p % len(events)]], args.threads, args.ops,
+                  args.readers, start, results))
+            for p in range(args.processes)]
+        for process in processes:
+            process.start()
+        start.set()
+        measured = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        elapsed = max(m[0] for m in measured)
+        worst = max(m[1] for m in measured)
+        reads = sum(m[2] for m in measured)
+        writes = args.processes * args.threads * args.ops
+
+        em = EventManager(config_dir=data_dir, storage=args.storage)
+        stored = sum(len(em.get_performance(e, p)['tracks']) for e, p in events)
+        em.close()
+
+        print(f"{layout:<11} {writes / elapsed:>10.0f} {worst * 1000:>14.1f} {reads / elapsed:>10.0f} "
+              f"{writes - stored:>6}")
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def run(args) -> None:
+    print(f"{args.processes} processes x {args.threads} writer threads x {args.ops} track adds, "
+          f"{args.readers} reader threads per process, {args.storage} storage")
+    print(f"{'layout':<11} {'writes/s':>10} {'max write ms':>14} {'reads/s':>10} {'lost':>6}")
+    for layout in ('same-event', 'per-event'):
+        run_layout(args, layout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark lock contention with parallel clients')
+    parser.add_argument('--processes', type=int, default=4, help='Client processes (default: 4)')
+    parser.add_argument('--threads', type=int, default=4, help='Writer threads per process (default: 4)')
+    parser.add_argument('--readers', type=int, default=2, help='Reader threads per process (default: 2)')
+    parser.add_argument('--ops', type=int, default=50, help='Track adds per writer thread (default: 50)')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json', help='Storage engine (default: json)')
+    parser.add_argument('--dir', default=None, help='Directory to run in (default: system temp dir)')
+    run(parser.parse_args())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store for track files
+
+Every distinct audio file is kept once under .blobs/<ab>/<sha256> in the data
+directory. A track's file in its performance directory is a hard link to the
+blob, so the same backing track used by several performances and events
+takes the disk space of one copy, and serving, streaming and deleting files
+work on the performance directory as before.
+
+The reference count of a blob is its link count minus the store's own link.
+It is kept by the filesystem, so it cannot drift from the files that exist,
+and needs no lock shared between events. release() deletes a blob once no
+track file links to it.
+
+On filesystems without hard links the store is not used and files are
+stored as plain copies.
+"""
+
+import os
+import re
+import uuid
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional
+
+from uploads import CHUNK_SIZE, TEMP_PREFIX, link_unique
+
+BLOB_DIR = '.blobs'
+
+# Written once existing track files have been moved into the store
+MIGRATED_MARKER = 'migrated'
+
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+def valid_hash(content_hash: str) -> bool:
+    """Whether a (client supplied) string is a SHA-256 hex digest"""
+    return bool(_SHA256.match(content_hash))
+
+def hash_file(path: Path) -> str:
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+class BlobStore:
+    """Hash -> file store whose blobs are hard-linked into performance directories"""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path(self, content_hash: str) -> Path:
+        return self.root / content_hash[:2] / content_hash
+
+    def refcount(self, content_hash: str) -> int:
+        """Number of track files that share a blob"""
+        try:
+            return self.path(content_hash).stat().st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def contains(self, content_hash: str) -> bool:
+        return valid_hash(content_hash) and self.path(content_hash).is_file()
+
+    def store(self, source: Path, content_hash: str, directory: Path, filename: str) -> Optional[str]:
+        """Link content into directory under filename (or name_1.ext, ...)
+
+        source becomes the blob if the content is new; otherwise the stored
+        copy is linked and source is left for the caller to delete. Returns
+        the filename used, or None if the filesystem has no hard links.
+        """
+        blob = self.path(content_hash)
+        try:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            while True:
+                try:
+                    os.link(source, blob)
+                except FileExistsError:
+                    pass
+                try:
+                    return link_unique(blob, directory, filename)
+                except FileNotFoundError:
+                    # Released by another process in between: store it again
+                    if not directory.is_dir():
+                        raise
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            logging.warning(f"Blob store unavailable, storing a plain copy: {e}")
+            return None
+
+    def link(self, content_hash: str, directory: Path, filename: str) -> Optional[str]:
+        """Link an already stored blob into directory; None if it is not stored"""
+        if not valid_hash(content_hash):
+            return None
+        try:
+            return link_unique(self.path(content_hash), directory, filename)
+        except FileNotFoundError:
+            return None
+
+    def adopt(self, file_path: Path) -> Optional[str]:
+        """Move an existing track file into the store and return its hash
+
+        A file whose content is already stored is replaced by a link to the
+        stored copy. Returns None if the filesystem has no hard links.
+        """
+        content_hash = hash_file(file_path)
+        blob = self.path(content_hash)
+        try:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(file_path, blob)
+            except FileExistsError:
+                if not os.path.samefile(blob, file_path):
+                    temp = file_path.with_name(f'{TEMP_PREFIX}{uuid.uuid4().hex}.part')
+                    os.link(blob, temp)
+                    os.replace(temp, file_path)
+        except OSError as e:
+            logging.warning(f"Could not move {file_path} into the blob store: {e}")
+            return None
+        return content_hash
+
+    def release(self, content_hash: Optional[str]) -> bool:
+        """Delete a blob that no track file links to any more
+
+        Called after a track file is deleted. If another process links the
+        blob at the same moment, its file keeps the data as a plain copy.
+        """
+        if not content_hash:
+            return False
+        blob = self.path(content_hash)
+        try:
+            if blob.stat().st_nlink > 1:
+                return False
+            blob.unlink()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def collect(self) -> int:
+        """Delete blobs left unreferenced by a crash; returns how many"""
+        removed = 0
+        for blob in self.root.glob('*/*'):
+            if valid_hash(blob.name) and self.release(blob.name):
+                removed += 1
+        return removed
+
+    def is_migrated(self) -> bool:
+        return (self.root / MIGRATED_MARKER).exists()
+
+    def mark_migrated(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / MIGRATED_MARKER).touch()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Change feed of an event, pushed to clients with Server-Sent Events
+
+Every change to an event's data is appended as a delta to changes.log in
+the event directory, one JSON line per change, tagged with the event
+version it produced:
+
+    {"version": 12, "kind": "performances", "put": [records], "deleted": [ids]}
+    {"version": 13, "kind": "performances", "records": [all records]}  (whole list replaced)
+    {"version": 14, "kind": "event", "put": [event]}
+
+Server workers are separate processes, so the file (not memory) is what
+connects a change to the streams that report it: a stream follows the file,
+is woken right away by changes made in its own process and otherwise
+notices growth within POLL_SECONDS. Once the file passes MAX_BYTES its
+older half is dropped; a stream whose client is further behind (its
+Last-Event-ID is older than the file) or that sees a gap in the versions
+sends 'reset', after which the client reloads the event.
+"""
+
+import os
+import time
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import serializers
+from storage import file_lock
+
+FEED_FILE = 'changes.log'
+
+# Size at which the older half of a feed file is dropped
+MAX_BYTES = 1024 * 1024
+
+# How often a stream checks the file for changes made by other processes
+POLL_SECONDS = 0.25
+# Comment lines that keep proxies from closing an idle stream
+HEARTBEAT_SECONDS = 15
+# Streams end after this long; EventSource reconnects with Last-Event-ID,
+# which lets server workers be restarted without holding connections
+MAX_STREAM_SECONDS = 300
+# Open streams per process. Each holds a server thread for its whole length,
+# so this stays below the threads of a worker to leave some for the API
+MAX_STREAMS = int(os.environ.get('PERFORMANCE_MANAGER_MAX_STREAMS', '4'))
+# Reconnection delay suggested to EventSource (ms)
+RETRY_MS = 2000
+
+def delta(version: int, kind: str, changes: Optional[List[Dict[str, Any]]],
+          records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The delta for a save of `kind` with storage changes (see storage.op_put), or the whole list"""
+    if changes is None:
+        return {'version': version, 'kind': kind, 'records': records}
+    return {
+        'version': version,
+        'kind': kind,
+        'put': [c['record'] for c in changes if c['op'] == 'put'],
+        'deleted': [c['id'] for c in changes if c['op'] == 'delete'],
+    }
+
+def format_message(event: str, data: Dict[str, Any], version: Optional[int] = None) -> bytes:
+    """One Server-Sent Events message"""
+    lines = [f'id: {version}'] if version is not None else []
+    lines.append(f'event: {event}')
+    lines.append(f'data: {serializers.json_dumps(data).decode()}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+class ChangeFeed:
+    """Appends deltas to the feed files and follows them for streams"""
+
+    def __init__(self, config_dir: Path):
+        self.config_dir = config_dir
+        # Wakes the streams of this process when it appends
+        self._changed = threading.Condition()
+        self._streams = 0
+        self._streams_lock = threading.Lock()
+
+    def path(self, event_id: str) -> Path:
+        return self.config_dir / event_id / FEED_FILE
+
+    def publish(self, event_id: str, change: Dict[str, Any]) -> None:
+        path = self.path(event_id)
+        if not path.parent.is_dir():
+            # Event deleted
+            return
+        line = serializers.json_dumps(change) + b'\n'
+        with file_lock(path):
+            with open(path, 'ab') as f:
+                f.write(line)
+                size = f.tell()
+            if size > MAX_BYTES:
+                self._trim(path)
+        with self._changed:
+            self._changed.notify_all()
+
+    def _trim(self, path: Path) -> None:
+        data = path.read_bytes()
+        # From the first whole line in the newer half
+        start = data.find(b'\n', len(data) - MAX_BYTES // 2) + 1
+        # Replaced, not truncated in place: readers see a new inode and start over
+        temp = path.with_name(f'.{path.name}.tmp')
+        temp.write_bytes(data[start:])
+        os.replace(temp, path)
+
+    def notify(self) -> None:
+        """Wake all streams of this process, e.g. to let them see a shutdown"""
+        with self._changed:
+            self._changed.notify_all()
+
+    def open_stream(self) -> bool:
+        """Count a new stream; False if this process already has MAX_STREAMS open"""
+        with self._streams_lock:
+            if self._streams >= MAX_STREAMS:
+                return False
+            self._streams += 1
+            return True
+
+    def close_stream(self) -> None:
+        """Count a stream opened with open_stream() as ended"""
+        with self._streams_lock:
+            self._streams -= 1
+
+    def _read(self, path: Path, offset: int, inode: Optional[int]):
+        """New complete lines since offset: (entries, new offset, inode)"""
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != inode or stat.st_size < offset:
+                    offset = 0
+                if stat.st_size == offset:
+                    return [], offset, stat.st_ino
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0, None
+        # A line being appended by another process is read next time
+        end = data.rfind(b'\n') + 1
+        entries = []
+        for line in data[:end].splitlines():
+            try:
+                entries.append(serializers.json_loads(line))
+            except serializers.DecodeError:
+                continue
+        return entries, offset + end, stat.st_ino
+
+    def stream(self, event_id: str, version: int, last_id: Optional[int],
+               stop: threading.Event) -> Iterator[bytes]:
+        """Server-Sent Events for changes after last_id (or from `version`, the current one)
+
+        Ends after MAX_STREAM_SECONDS or when `stop` is set.
+        """
+        path = self.path(event_id)
+        yield f'retry: {RETRY_MS}\n\n'.encode()
+        if last_id is None or last_id > version:
+            # A new client (or one ahead of the data, e.g. after a restore)
+            # loads the current state itself and gets the changes after it
+            after = version
+            yield format_message('ready', {'version': version}, version)
+        else:
+            after = last_id
+        entries, offset, inode = self._read(path, 0, None)
+
+        started = heartbeat = time.monotonic()
+        while True:
+            for entry in entries:
+                entry_version = entry.get('version', 0)
+                if entry_version <= after:
+                    continue
+                if entry_version != after + 1:
+                    # Deltas were missed (trimmed, or lost); the client must reload
+                    yield format_message('reset', {'version': entry_version}, entry_version)
+                else:
+                    yield format_message('change', entry, entry_version)
+                after = entry_version
+                heartbeat = time.monotonic()
+
+            now = time.monotonic()
+            if stop.is_set() or now - started >= MAX_STREAM_SECONDS:
+                return
+            if now - heartbeat >= HEARTBEAT_SECONDS:
+                # Also how a closed connection is noticed
+                yield b': keepalive\n\n'
+                heartbeat = now
+            with self._changed:
+                self._changed.wait(POLL_SECONDS)
+            entries, offset, inode = self._read(path, offset, inode)
@@ -0,0 +1,45 @@
+"""
+Gunicorn settings for the production server mode
+
+Used by `python start.py --mode production` and the Docker image:
+
+    gunicorn -c backend/gunicorn.conf.py
+
+Settings can be overridden with environment variables or gunicorn's own
+command-line flags. Send SIGHUP to the master process (`python stop.py
+reload`) to restart the workers gracefully, e.g. after an upgrade.
+"""
+
+import os
+import multiprocessing
+
+# Run from the backend directory so `app:app` resolves wherever gunicorn is started
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = 'app:app'
+
+bind = f"{os.environ.get('PERFORMANCE_MANAGER_HOST', '0.0.0.0')}:{os.environ.get('PERFORMANCE_MANAGER_PORT', '5000')}"
+
+# Worker processes scale API throughput with cores; threads per worker keep
+# long-running audio streams from blocking API polling
+workers = int(os.environ.get('PERFORMANCE_MANAGER_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+# A change stream (see changefeed.py) holds a thread for up to 5 minutes.
+# Each worker takes at most PERFORMANCE_MANAGER_MAX_STREAMS (default 4) and
+# answers more with 503, so keep threads above it: the rest serve the API.
+# Raise both for more operator screens than workers * MAX_STREAMS.
+threads = int(os.environ.get('PERFORMANCE_MANAGER_THREADS', '8'))
+
+# Each worker imports the app after forking so it opens its own storage
+# handles and background journal thread; workers stay consistent through
+# the on-disk stamps and file locks rather than shared memory
+preload_app = False
+
+# Whole files and single ranges are sent with os.sendfile() (see streaming.py)
+sendfile = True
+
+timeout = int(os.environ.get('PERFORMANCE_MANAGER_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Background queues for work derived from track files
+
+JobQueue runs functions on a thread pool that is started on first use. Jobs
+are identified by a key (usually the file they produce): a key already
+queued is not queued again, and a job that reports failure (returns False)
+is not retried by this process, so a file that cannot be decoded does not
+start a new run on every request.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+class JobQueue:
+    """Deduplicating thread pool for background jobs"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queued: Set[Hashable] = set()
+        self._failed: Set[Hashable] = set()
+        self._futures: Set[Future] = set()
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        # Called with the lock held
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._pool
+
+    def submit(self, key: Hashable, job: Callable[..., Any], *args) -> bool:
+        """Queue job(*args) unless `key` is queued or has failed; True if queued"""
+        with self._lock:
+            if key in self._queued or key in self._failed:
+                return False
+            self._queued.add(key)
+            future = self._get_pool().submit(self._run, key, job, *args)
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return True
+
+    def gather(self, function: Callable[..., Any], calls: Dict[Hashable, Tuple]) -> Dict[Hashable, Any]:
+        """Run function(*args) for each entry of `calls` on the pool and wait for the results
+
+        Not deduplicated or remembered as jobs are; exceptions propagate.
+        """
+        with self._lock:
+            pool = self._get_pool()
+            futures = {key: pool.submit(function, *args) for key, args in calls.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def queued(self, key: Hashable) -> bool:
+        return key in self._queued
+
+    def failed(self, key: Hashable) -> bool:
+        return key in self._failed
+
+    def _run(self, key: Hashable, job: Callable[..., Any], *args) -> None:
+        try:
+            succeeded = job(*args) is not False
+        except Exception as e:
+            logging.error(f"{self.name} job {key} failed: {e}")
+            succeeded = False
+        with self._lock:
+            self._queued.discard(key)
+            if not succeeded:
+                self._failed.add(key)
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Block until the queued jobs are done"""
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures, timeout)
+
+    def close(self) -> None:
+        """Finish running jobs, drop queued ones and stop the threads"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
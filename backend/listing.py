@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Pagination, filtering and field projection for list endpoints
+
+Query parameters understood by apply_listing():
+- isDone=true|false            exact match on the isDone flag
+- type=Song,Dance / mode=Solo  match any of the comma-separated values
+- performer=text               case-insensitive substring match
+- limit=N and offset=N         offset pagination
+- limit=N and cursor=TOKEN     cursor pagination; TOKEN comes from X-Next-Cursor
+- fields=id,name,tracks.id     keep only these keys; 'a.b' projects the 'b'
+                               key of each item in list/dict field 'a'
+
+Records are sorted stably by (order, id), so pages do not shift when records
+are edited. The response body stays a plain JSON array; the total number of
+matching records and the next cursor are returned in headers.
+"""
+
+import json
+import base64
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+MAX_LIMIT = 500
+
+FILTER_FIELDS = ('type', 'mode')
+
+class ListingError(ValueError):
+    """Raised for malformed listing parameters"""
+
+def order_key(record: Dict[str, Any]) -> Tuple:
+    """Sort key for performances and breaks: order, then id for ties"""
+    order = record.get('order')
+    return (order if isinstance(order, (int, float)) else float('inf'), str(record.get('id', '')))
+
+def created_key(record: Dict[str, Any]) -> Tuple:
+    """Sort key for events: creation time, then id for ties"""
+    return (str(record.get('createdAt', '')), str(record.get('id', '')))
+
+def encode_cursor(key: Tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(token: str) -> Tuple:
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise ListingError('Invalid cursor')
+    if not isinstance(key, list) or len(key) != 2:
+        raise ListingError('Invalid cursor')
+    return tuple(key)
+
+def _parse_int(args, name: str, default: Optional[int], minimum: int = 0) -> Optional[int]:
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ListingError(f'{name} must be an integer')
+    if number < minimum:
+        raise ListingError(f'{name} must be at least {minimum}')
+    return number
+
+def _parse_bool(args, name: str) -> Optional[bool]:
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ListingError(f'{name} must be true or false')
+
+def filter_records(records: List[Dict[str, Any]], args) -> List[Dict[str, Any]]:
+    """Apply the isDone/type/mode/performer filters"""
+    predicates: List[Callable[[Dict[str, Any]], bool]] = []
+
+    is_done = _parse_bool(args, 'isDone')
+    if is_done is not None:
+        predicates.append(lambda r: bool(r.get('isDone')) == is_done)
+
+    for field in FILTER_FIELDS:
+        if args.get(field):
+            allowed = {v.strip() for v in args[field].split(',') if v.strip()}
+            predicates.append(lambda r, field=field, allowed=allowed: r.get(field) in allowed)
+
+    performer = (args.get('performer') or '').strip().lower()
+    if performer:
+        predicates.append(lambda r: performer in str(r.get('performer') or '').lower())
+
+    if not predicates:
+        return records
+    return [r for r in records if all(p(r) for p in predicates)]
+
+def parse_fields(args) -> Optional[Dict[str, Optional[set]]]:
+    """Parse fields=... into {top-level key: nested keys or None for the whole value}"""
+    value = args.get('fields')
+    if not value:
+        return None
+    fields: Dict[str, Optional[set]] = {}
+    for name in (f.strip() for f in value.split(',')):
+        if not name:
+            continue
+        top, _, nested = name.partition('.')
+        if not nested:
+            fields[top] = None
+        else:
+            selected = fields.get(top, set())
+            # Selecting the whole field wins over selecting parts of it
+            if selected is not None:
+                selected.add(nested)
+                fields[top] = selected
+    return fields
+
+def project(record: Dict[str, Any], fields: Dict[str, Optional[set]]) -> Dict[str, Any]:
+    """Keep only the selected fields of a record"""
+    projected = {}
+    for key, nested in fields.items():
+        if key not in record:
+            continue
+        value = record[key]
+        if nested is None:
+            projected[key] = value
+        elif isinstance(value, list):
+            projected[key] = [{k: v for k, v in item.items() if k in nested} if isinstance(item, dict) else item
+                              for item in value]
+        elif isinstance(value, dict):
+            projected[key] = {k: v for k, v in value.items() if k in nested}
+        else:
+            projected[key] = value
+    return projected
+
+def apply_listing(records: List[Dict[str, Any]], args,
+                  sort_key: Callable[[Dict[str, Any]], Tuple] = order_key) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """Filter, sort, paginate and project records according to query args
+
+    Returns the page and the response headers to send with it.
+    """
+    limit = _parse_int(args, 'limit', None, minimum=1)
+    if limit is not None:
+        limit = min(limit, MAX_LIMIT)
+    offset = _parse_int(args, 'offset', 0)
+    cursor = args.get('cursor')
+    if cursor and offset:
+        raise ListingError('Use either cursor or offset, not both')
+    fields = parse_fields(args)
+
+    matching = sorted(filter_records(records, args), key=sort_key)
+    headers = {'X-Total-Count': str(len(matching))}
+
+    if cursor:
+        after = decode_cursor(cursor)
+        try:
+            page = [r for r in matching if sort_key(r) > after]
+        except TypeError:
+            raise ListingError('Invalid cursor')
+    else:
+        page = matching[offset:]
+    if limit is not None:
+        has_more = len(page) > limit
+        page = page[:limit]
+        if has_more and page:
+            headers['X-Next-Cursor'] = encode_cursor(sort_key(page[-1]))
+
+    if fields is not None:
+        page = [project(r, fields) for r in page]
+    return page, headers
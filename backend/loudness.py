@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Loudness of track files, for level-matched playback between acts
+
+Each track is measured once in the background: integrated loudness (LUFS)
+and true peak (dBTP) with ffmpeg's EBU R128 filter. Without ffmpeg, WAV
+files are measured with the standard library using the same 400 ms blocks
+and gates, but without the K-weighting filter and with the sample peak, so
+the values can differ from ffmpeg's by a dB or so. Measurements are cached
+by content hash under .loudness/ in the data directory (see MetadataCache).
+
+From the measurement the track gets a ReplayGain-style `gain`: the dB that
+bring it to the target loudness, lowered where needed to keep its peak under
+PEAK_CEILING.
+
+- PERFORMANCE_MANAGER_LOUDNESS_TARGET    target loudness in LUFS (default -18,
+                                         the ReplayGain 2.0 reference level)
+- PERFORMANCE_MANAGER_LOUDNESS_WORKERS   parallel analyses (default 1)
+"""
+
+import os
+import re
+import math
+import time
+import wave
+import logging
+import subprocess
+from array import array
+from operator import mul
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import transcode
+from jobs import JobQueue
+from metadata import FAILED, PENDING, READY, STALE_PENDING_SECONDS, MetadataCache
+from peaks import read_wav
+
+LOUDNESS_TARGET = float(os.environ.get('PERFORMANCE_MANAGER_LOUDNESS_TARGET', '-18'))
+LOUDNESS_WORKERS = int(os.environ.get('PERFORMANCE_MANAGER_LOUDNESS_WORKERS', '1'))
+
+LOUDNESS_DIR = '.loudness'
+
+# Bump when the analysis changes, so older cache entries are ignored
+ANALYZER_VERSION = 1
+
+# dBTP a track's peak may reach after its gain is applied
+PEAK_CEILING = -1.0
+
+# BS.1770 gating: 400 ms blocks overlapping by 75%, an absolute gate and a
+# gate relative to the loudness of the blocks above it
+STEP_SECONDS = 0.1
+STEPS_PER_BLOCK = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+FULL_SCALE = 32768
+
+_INTEGRATED = re.compile(r'\bI:\s+(-?[\d.]+|-inf) LUFS')
+_PEAK = re.compile(r'\bPeak:\s+(-?[\d.]+|-inf) dBFS')
+
+def cache_version() -> str:
+    """Cache version of the analysis this process runs; WAV results are redone once ffmpeg is installed"""
+    return f"{ANALYZER_VERSION}-{'ebur128' if transcode.available() else 'wav'}"
+
+def _level(value: str) -> Optional[float]:
+    return None if value == '-inf' else float(value)
+
+def _ffmpeg_loudness(file_path: Path) -> Dict[str, Any]:
+    result = subprocess.run(
+        [transcode.FFMPEG, '-nostdin', '-hide_banner', '-nostats', '-i', str(file_path),
+         # The summary is logged at info level; per-frame values only at verbose
+         '-vn', '-af', 'ebur128=peak=true:framelog=verbose', '-f', 'null', '-'],
+        capture_output=True, timeout=transcode.TRANSCODE_TIMEOUT)
+    output = result.stderr.decode(errors='replace')
+    integrated = _INTEGRATED.findall(output)
+    peak = _PEAK.findall(output)
+    if result.returncode != 0 or not integrated:
+        return {}
+    # The summary comes last
+    return {'loudness': _level(integrated[-1]), 'truePeak': _level(peak[-1]) if peak else None}
+
+def _lufs(power: float) -> float:
+    return -0.691 + 10 * math.log10(power) if power > 0 else -math.inf
+
+def gated_loudness(blocks: List[float]) -> Optional[float]:
+    """Integrated loudness of mean-square block powers, None if all are below the absolute gate"""
+    blocks = [z for z in blocks if _lufs(z) > ABSOLUTE_GATE]
+    if not blocks:
+        return None
+    threshold = _lufs(sum(blocks) / len(blocks)) + RELATIVE_GATE
+    blocks = [z for z in blocks if _lufs(z) > threshold]
+    return _lufs(sum(blocks) / len(blocks))
+
+def _wav_loudness(file_path: Path) -> Dict[str, Any]:
+    frame_rate, channels, chunks = read_wav(file_path)
+    frames = max(1, round(frame_rate * STEP_SECONDS))
+    step = frames * channels
+    # Mean square of each 100 ms step, summed over the channels
+    powers = []
+    peak = 0
+    pending = array('h')
+    for chunk in chunks:
+        if chunk:
+            peak = max(peak, max(chunk), -min(chunk))
+        pending.extend(chunk)
+        whole = len(pending) - len(pending) % step
+        for start in range(0, whole, step):
+            block = pending[start:start + step]
+            powers.append(sum(map(mul, block, block)) / (frames * FULL_SCALE ** 2))
+        del pending[:whole]
+
+    blocks = [sum(powers[i:i + STEPS_PER_BLOCK]) / STEPS_PER_BLOCK
+              for i in range(len(powers) - STEPS_PER_BLOCK + 1)]
+    return {
+        'loudness': gated_loudness(blocks),
+        'truePeak': 20 * math.log10(peak / FULL_SCALE) if peak else None,
+    }
+
+def analyze_loudness(file_path: Path) -> Dict[str, Any]:
+    """Measure loudness (LUFS) and truePeak (dBTP) of a file
+
+    Either is None for silence; an empty dict if the file cannot be decoded.
+    """
+    try:
+        if transcode.available():
+            measured = _ffmpeg_loudness(file_path)
+        else:
+            measured = _wav_loudness(file_path)
+    except (OSError, EOFError, ValueError, subprocess.TimeoutExpired, wave.Error) as e:
+        logging.warning(f"Could not measure the loudness of {file_path}: {e}")
+        return {}
+    return {key: round(value, 2) if value is not None else None for key, value in measured.items()}
+
+def loudness_updates(measured: Dict[str, Any]) -> Dict[str, Any]:
+    """Track fields for a measurement: loudness, truePeak, gain and loudnessStatus"""
+    if not measured:
+        return {'loudnessStatus': FAILED}
+    loudness, peak = measured.get('loudness'), measured.get('truePeak')
+    gain = 0.0
+    if loudness is not None:
+        gain = LOUDNESS_TARGET - loudness
+        if peak is not None:
+            gain = min(gain, PEAK_CEILING - peak)
+    return {**measured, 'gain': round(gain, 2), 'loudnessStatus': READY}
+
+def create_cache(directory: Path) -> MetadataCache:
+    # A failure may be an ffmpeg timeout; it is retried by the next upload of the content
+    # or a rescan after the file changed
+    return MetadataCache(directory, extract=analyze_loudness, version=cache_version(), cache_failures=False)
+
+class LoudnessQueue(JobQueue):
+    """Background loudness analysis, reported to `apply` like MetadataQueue
+
+    The whole file is decoded, so this pool is kept small and separate from
+    the metadata pool, whose jobs only read headers.
+    """
+
+    def __init__(self, apply: Callable[[str, str, str, Dict[str, Any]], Any], cache: MetadataCache,
+                 workers: int = LOUDNESS_WORKERS):
+        super().__init__('loudness', workers)
+        self.apply = apply
+        self.cache = cache
+
+    def submit(self, event_id: str, performance_id: str, track_id: str, file_path: Path,
+               content_hash: Optional[str] = None) -> bool:
+        return super().submit(track_id, self._analyze, event_id, performance_id, track_id, file_path, content_hash)
+
+    def resubmit_stale(self, event_id: str, performance: Dict[str, Any], performance_dir: Path) -> None:
+        """Queue pending tracks of a performance whose job was lost"""
+        for track in performance.get('tracks', []):
+            if track.get('loudnessStatus') != PENDING or self.queued(track['id']):
+                continue
+            file_path = performance_dir / track['filename']
+            try:
+                if time.time() - file_path.stat().st_mtime < STALE_PENDING_SECONDS:
+                    continue
+            except FileNotFoundError:
+                continue
+            self.submit(event_id, performance['id'], track['id'], file_path, track.get('contentHash'))
+
+    def _analyze(self, event_id: str, performance_id: str, track_id: str, file_path: Path,
+                 content_hash: Optional[str]) -> None:
+        if not file_path.exists():
+            # Deleted while queued
+            return
+        self.apply(event_id, performance_id, track_id, loudness_updates(self.cache.extract(file_path, content_hash)))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Background extraction of audio metadata
+
+Uploaded tracks are stored with metadataStatus 'pending' and the request
+returns right away. MetadataQueue reads duration, bitrate, sample rate,
+channels and codec with mutagen on a small thread pool and hands the result
+to a callback, which patches the track record. mutagen only reads the file
+headers, so threads are enough and the result is written through the
+EventManager of the process that owns the pool.
+
+Results are kept in MetadataCache, keyed by the file's content hash (or its
+path, size and mtime for files outside the blob store): a persistent entry
+per file under .metadata/ in the data directory, with an LRU dict in front.
+A file is parsed once; repeated uploads and rescans of unchanged files are
+served from the cache.
+
+PERFORMANCE_MANAGER_METADATA_WORKERS sets the number of threads (default 2),
+PERFORMANCE_MANAGER_METADATA_CACHE_SIZE the entries kept in memory (default 4096).
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from mutagen import File as MutagenFile
+
+import serializers
+from jobs import JobQueue
+from storage import atomic_write
+
+METADATA_WORKERS = int(os.environ.get('PERFORMANCE_MANAGER_METADATA_WORKERS', '2'))
+METADATA_CACHE_SIZE = int(os.environ.get('PERFORMANCE_MANAGER_METADATA_CACHE_SIZE', '4096'))
+
+METADATA_DIR = '.metadata'
+
+# Bump when extract_metadata() changes, so older cache entries are ignored
+EXTRACTOR_VERSION = 1
+
+# Values of a track's metadataStatus
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+# A pending track whose file is older than this is assumed to have lost its
+# job (e.g. the server restarted) and is queued again
+STALE_PENDING_SECONDS = 300
+
+def extract_metadata(file_path: Path) -> Dict[str, Any]:
+    """Read duration (seconds), bitrate (bits/s), sampleRate, channels and codec
+
+    Returns only the values the file provides; an empty dict if it cannot be
+    parsed.
+    """
+    try:
+        audio = MutagenFile(str(file_path))
+    except Exception as e:
+        logging.warning(f"Could not read metadata from {file_path}: {e}")
+        return {}
+    if audio is None or audio.info is None:
+        return {}
+
+    info = audio.info
+    metadata = {
+        'duration': int(info.length) if getattr(info, 'length', None) is not None else None,
+        'bitrate': getattr(info, 'bitrate', None) or None,
+        'sampleRate': getattr(info, 'sample_rate', None) or None,
+        'channels': getattr(info, 'channels', None) or None,
+        # MP4 reports the codec (e.g. mp4a.40.2); otherwise the container type
+        'codec': getattr(info, 'codec', None) or type(audio).__name__.lower(),
+    }
+    return {key: value for key, value in metadata.items() if value is not None}
+
+class MetadataCache:
+    """Extracted metadata by file, persisted under `directory` with an LRU front
+
+    Entries are small files written atomically, so worker processes share
+    them without locking. An empty dict is cached for unparseable files.
+    Other per-file analyses (see loudness.py) use their own directory,
+    `extract` function (default extract_metadata) and `version`.
+    """
+
+    def __init__(self, directory: Path, size: int = METADATA_CACHE_SIZE,
+                 extract: Optional[Callable[[Path], Dict[str, Any]]] = None, version: Any = EXTRACTOR_VERSION,
+                 cache_failures: bool = True):
+        self.directory = directory
+        self.size = size
+        self.extractor = extract
+        self.version = version
+        # Whether an empty result (the file could not be read) is kept
+        self.cache_failures = cache_failures
+        self._memory: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(file_path: Path, content_hash: Optional[str] = None) -> Optional[str]:
+        """Cache key of a file; None if it does not exist"""
+        if content_hash:
+            return content_hash
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            return None
+        identity = f'{file_path.resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}'
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory / key[:2] / f'{key}.json'
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        try:
+            entry = serializers.json_loads(self._entry_path(key).read_bytes())
+        except (FileNotFoundError, serializers.DecodeError):
+            return None
+        if entry.get('version') != self.version:
+            return None
+        self._remember(key, entry['metadata'])
+        return entry['metadata']
+
+    def put(self, key: str, metadata: Dict[str, Any]) -> None:
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(path, serializers.json_dumps({'version': self.version, 'metadata': metadata}), 'rename')
+        self._remember(key, metadata)
+
+    def _remember(self, key: str, metadata: Dict[str, Any]) -> None:
+        with self._lock:
+            self._memory[key] = metadata
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.size:
+                self._memory.popitem(last=False)
+
+    def lookup(self, file_path: Path, content_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Cached metadata of a file, or None if it has not been extracted"""
+        key = self.key(file_path, content_hash)
+        return self.get(key) if key else None
+
+    def extract(self, file_path: Path, content_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Cached metadata of a file, extracting and caching it on a miss"""
+        key = self.key(file_path, content_hash)
+        metadata = self.get(key) if key else None
+        if metadata is None:
+            metadata = (self.extractor or extract_metadata)(file_path)
+            if key and (metadata or self.cache_failures):
+                self.put(key, metadata)
+        return metadata
+
+def metadata_updates(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Track fields for extracted metadata, including metadataStatus"""
+    return {**metadata, 'metadataStatus': READY} if metadata else {'metadataStatus': FAILED}
+
+class MetadataQueue(JobQueue):
+    """Thread pool that extracts track metadata and reports it to `apply`
+
+    apply(event_id, performance_id, track_id, updates) receives the metadata
+    plus metadataStatus 'ready', or only metadataStatus 'failed'.
+    """
+
+    def __init__(self, apply: Callable[[str, str, str, Dict[str, Any]], Any], cache: MetadataCache,
+                 workers: int = METADATA_WORKERS):
+        super().__init__('metadata', workers)
+        self.apply = apply
+        self.cache = cache
+
+    def submit(self, event_id: str, performance_id: str, track_id: str, file_path: Path,
+               content_hash: Optional[str] = None) -> bool:
+        return super().submit(track_id, self._extract, event_id, performance_id, track_id, file_path, content_hash)
+
+    def scan(self, files: Dict[str, Tuple[Path, Optional[str]]]) -> Tuple[Dict[str, Dict[str, Any]], Set[str]]:
+        """Metadata for many files, keyed like `files`
+
+        Cached files are answered directly, the others extracted in parallel
+        on the pool. Returns the results and the keys of the files parsed,
+        which are the new or modified ones.
+        """
+        results = {}
+        misses = {}
+        for key, (file_path, content_hash) in files.items():
+            cached = self.cache.lookup(file_path, content_hash)
+            if cached is None:
+                misses[key] = (file_path, content_hash)
+            else:
+                results[key] = cached
+        if misses:
+            results.update(self.gather(self.cache.extract, misses))
+        return results, set(misses)
+
+    def resubmit_stale(self, event_id: str, performance: Dict[str, Any], performance_dir: Path) -> None:
+        """Queue pending tracks of a performance whose job was lost"""
+        for track in performance.get('tracks', []):
+            if track.get('metadataStatus') != PENDING or self.queued(track['id']):
+                continue
+            file_path = performance_dir / track['filename']
+            try:
+                if time.time() - file_path.stat().st_mtime < STALE_PENDING_SECONDS:
+                    continue
+            except FileNotFoundError:
+                continue
+            self.submit(event_id, performance['id'], track['id'], file_path, track.get('contentHash'))
+
+    def _extract(self, event_id: str, performance_id: str, track_id: str, file_path: Path,
+                 content_hash: Optional[str]) -> None:
+        self.apply(event_id, performance_id, track_id, metadata_updates(self.cache.extract(file_path, content_hash)))
+
+    def close(self) -> None:
+        """Finish queued jobs and stop the threads"""
+        # Unlike other queues, pending tracks would otherwise wait for a restart
+        self.wait()
+        super().close()
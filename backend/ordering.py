@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Fractional running order of performances and breaks
+
+`order` is a number and records run in (order, id) order (see
+listing.order_key). A record moved between two others gets an order between
+theirs, so a move writes that one record instead of renumbering the list:
+
+    0, 1, 2, 3   move 3 between 0 and 1   ->   0, 0.5, 1, 2
+
+Repeated moves into the same place halve the gap each time. When two orders
+get closer than MIN_GAP, or are equal, the list is renumbered 0, 1, 2, ...
+in the background (Rebalancer). Equal orders are how integer orders from
+before this scheme look after a reorder that left records out, so the same
+renumbering migrates them the first time the list is loaded.
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, List, Optional
+
+from jobs import JobQueue
+from listing import order_key
+
+ORDERED_KINDS = ('performances', 'breaks')
+
+# About 20 moves into the same gap; far above the precision of a float
+MIN_GAP = 2 ** -20
+
+def _order(record: Dict[str, Any]) -> Optional[float]:
+    order = record.get('order')
+    if isinstance(order, bool) or not isinstance(order, (int, float)) or not math.isfinite(order):
+        return None
+    return order
+
+def next_order(records: List[Dict[str, Any]]) -> int:
+    """Order for a record added at the end"""
+    orders = [o for o in map(_order, records) if o is not None]
+    return math.floor(max(orders)) + 1 if orders else 0
+
+def needs_rebalance(records: List[Dict[str, Any]]) -> bool:
+    """True if records lack an order or two orders are closer than MIN_GAP"""
+    orders = list(map(_order, records))
+    if None in orders:
+        return True
+    orders.sort()
+    return any(high - low < MIN_GAP for low, high in zip(orders, orders[1:]))
+
+def rebalance(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Renumber records 0, 1, 2, ... in running order; returns the records that changed"""
+    changed = []
+    for i, record in enumerate(sorted(records, key=order_key)):
+        if record.get('order') != i:
+            record['order'] = i
+            changed.append(record)
+    return changed
+
+def _increasing(orders: List[float]) -> List[int]:
+    """Positions of a longest strictly increasing run of orders (not necessarily adjacent)"""
+    tails: List[float] = []
+    tail_positions: List[int] = []
+    previous: List[Optional[int]] = []
+    for position, order in enumerate(orders):
+        length = bisect_left(tails, order)
+        if length == len(tails):
+            tails.append(order)
+            tail_positions.append(position)
+        else:
+            tails[length] = order
+            tail_positions[length] = position
+        previous.append(tail_positions[length - 1] if length else None)
+    kept = []
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        kept.append(position)
+        position = previous[position]
+    return kept[::-1]
+
+def _spread(low: Optional[float], high: Optional[float], count: int) -> Optional[List[float]]:
+    """`count` increasing orders strictly between low and high (None: open end)"""
+    if low is None and high is None:
+        return list(range(count))
+    if low is None:
+        return [math.floor(high) - count + i for i in range(count)]
+    if high is None:
+        return [math.floor(low) + 1 + i for i in range(count)]
+    step = (high - low) / (count + 1)
+    if step < MIN_GAP:
+        return None
+    return [low + step * (i + 1) for i in range(count)]
+
+def _arrange(records: List[Dict[str, Any]], sequence: List[Dict[str, Any]]) -> Optional[Dict[str, float]]:
+    """New orders by id that put `sequence` in that order, or None if there is no room
+
+    A record that has to move goes right after the listed record before it
+    (or right before the listed record after it), so records that are not
+    listed keep their neighbours.
+    """
+    orders = list(map(_order, sequence))
+    if None in orders:
+        return None
+    kept = _increasing(orders)
+    moving = {r['id'] for r in sequence} - {sequence[i]['id'] for i in kept}
+    fixed = sorted(o for r in records if r['id'] not in moving for o in [_order(r)] if o is not None)
+
+    updates: Dict[str, float] = {}
+    low: Optional[float] = None
+    start = 0
+    for end in kept + [len(sequence)]:
+        if end > start:
+            if low is not None:
+                position = bisect_right(fixed, low)
+                spread = _spread(low, fixed[position] if position < len(fixed) else None, end - start)
+            else:
+                high = orders[end] if end < len(sequence) else None
+                position = bisect_left(fixed, high) if high is not None else len(fixed)
+                spread = _spread(fixed[position - 1] if position else None, high, end - start)
+            if spread is None:
+                return None
+            updates.update((r['id'], order) for r, order in zip(sequence[start:end], spread))
+        if end < len(sequence):
+            low = orders[end]
+        start = end + 1
+    return updates
+
+def arrange(records: List[Dict[str, Any]], ids: List[str]) -> List[Dict[str, Any]]:
+    """Give the listed records orders that run in the order of `ids`
+
+    Records that are not listed, and listed ones already in place relative
+    to each other, keep their orders: moving one record in the list writes
+    only that record. Unknown ids are ignored. Returns the records that
+    changed; if the orders are too close to fit the moved records between,
+    every record is renumbered first.
+    """
+    by_id = {r['id']: r for r in records}
+    sequence = list({i: by_id[i] for i in ids if i in by_id}.values())
+    updates = _arrange(records, sequence)
+    changed: Dict[str, Dict[str, Any]] = {}
+    if updates is None:
+        changed.update((r['id'], r) for r in rebalance(records))
+        updates = _arrange(records, sequence)
+    for record_id, order in updates.items():
+        record = by_id[record_id]
+        if record.get('order') != order:
+            record['order'] = order
+            changed[record_id] = record
+    return list(changed.values())
+
+class Rebalancer(JobQueue):
+    """Renumbers an event's performances or breaks in the background"""
+
+    def __init__(self, rebalance_event: Callable[[str, str], Any]):
+        super().__init__('rebalance', 1)
+        self.rebalance_event = rebalance_event
+
+    def submit(self, event_id: str, kind: str) -> bool:
+        return super().submit((event_id, kind), self.rebalance_event, event_id, kind)
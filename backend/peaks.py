@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Waveform peaks of track files for the media player's seekbar
+
+The audio is decoded once in the background (ffmpeg to 8 kHz mono, or WAV
+files with the standard library when ffmpeg is missing) and reduced to the
+minimum and maximum sample of every bucket of SAMPLES_PER_BUCKET samples.
+Coarser zoom levels merge LEVEL_FACTOR buckets of the previous level until
+a level has at most MIN_BUCKETS buckets. The result is cached next to the
+original as a hidden .<filename>.peaks file.
+
+File format (little-endian):
+    header  'PEAK', version u8 (1), bits u8 (8), levels u16, sample_rate u32
+    levels  samples_per_bucket u32, buckets u32           (finest first)
+    data    per level, per bucket: min i8, max i8
+"""
+
+import os
+import sys
+import uuid
+import wave
+import struct
+import subprocess
+from array import array
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import transcode
+from jobs import JobQueue
+from uploads import TEMP_PREFIX
+
+PEAKS_WORKERS = int(os.environ.get('PERFORMANCE_MANAGER_PEAKS_WORKERS', '1'))
+
+VERSION = 1
+SAMPLE_RATE = 8000
+# 32 ms per bucket at the finest level
+SAMPLES_PER_BUCKET = 256
+LEVEL_FACTOR = 4
+MIN_BUCKETS = 256
+
+# A track's file never changes, so browsers may keep its peaks for a day
+# (and revalidate them with the ETag afterwards)
+CACHE_MAX_AGE = 24 * 3600
+
+HEADER = struct.Struct('<4sBBHI')
+LEVEL = struct.Struct('<II')
+
+# Samples read from the decoder at a time
+READ_SAMPLES = 64 * 1024
+
+def peaks_path(file_path: Path) -> Path:
+    return file_path.parent / f'.{file_path.name}.peaks'
+
+def ready_peaks(file_path: Path) -> Optional[Path]:
+    """The cached peaks file if it exists and is newer than the original"""
+    path = peaks_path(file_path)
+    try:
+        if path.stat().st_mtime_ns >= file_path.stat().st_mtime_ns:
+            return path
+    except FileNotFoundError:
+        pass
+    return None
+
+def _ffmpeg_samples(file_path: Path) -> Tuple[int, Iterator[array]]:
+    process = subprocess.Popen(
+        [transcode.FFMPEG, '-nostdin', '-v', 'error', '-i', str(file_path),
+         '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def read() -> Iterator[array]:
+        rest = b''
+        try:
+            while True:
+                data = process.stdout.read(READ_SAMPLES * 2)
+                if not data:
+                    break
+                data = rest + data
+                cut = len(data) - len(data) % 2
+                rest = data[cut:]
+                samples = array('h', data[:cut])
+                if sys.byteorder == 'big':
+                    samples.byteswap()
+                yield samples
+        finally:
+            process.stdout.close()
+            if process.wait() != 0:
+                raise ValueError(f'ffmpeg could not decode {file_path}')
+
+    return SAMPLE_RATE, read()
+
+def read_wav(file_path: Path) -> Tuple[int, int, Iterator[array]]:
+    """Decode an 8 or 16-bit WAV file with the standard library
+
+    Returns the frame rate, the number of channels and chunks of interleaved
+    16-bit samples.
+    """
+    w = wave.open(str(file_path), 'rb')
+    width, channels = w.getsampwidth(), w.getnchannels()
+    if width not in (1, 2):
+        w.close()
+        raise ValueError(f'{width * 8}-bit WAV needs ffmpeg')
+
+    def read() -> Iterator[array]:
+        with w:
+            while True:
+                data = w.readframes(READ_SAMPLES // channels)
+                if not data:
+                    break
+                if width == 1:
+                    # 8-bit WAV is unsigned
+                    samples = array('h', ((b - 128) << 8 for b in data))
+                else:
+                    samples = array('h', data)
+                    if sys.byteorder == 'big':
+                        samples.byteswap()
+                yield samples
+
+    return w.getframerate(), channels, read()
+
+def _wav_samples(file_path: Path) -> Tuple[int, Iterator[array]]:
+    frame_rate, channels, chunks = read_wav(file_path)
+    # Channels are interleaved; a bucket spans the same time in all
+    return frame_rate * channels, chunks
+
+def compute_peaks(file_path: Path) -> Tuple[int, List[Tuple[int, array]]]:
+    """Decode a file and return (sample_rate, [(samples_per_bucket, min/max pairs), ...])"""
+    if transcode.available():
+        sample_rate, chunks = _ffmpeg_samples(file_path)
+    else:
+        sample_rate, chunks = _wav_samples(file_path)
+    per_bucket = SAMPLES_PER_BUCKET * max(1, round(sample_rate / SAMPLE_RATE))
+
+    pairs = array('b')
+    pending = array('h')
+    for chunk in chunks:
+        pending.extend(chunk)
+        whole = len(pending) - len(pending) % per_bucket
+        for start in range(0, whole, per_bucket):
+            bucket = pending[start:start + per_bucket]
+            pairs.append(min(bucket) >> 8)
+            pairs.append(max(bucket) >> 8)
+        del pending[:whole]
+    if pending:
+        pairs.append(min(pending) >> 8)
+        pairs.append(max(pending) >> 8)
+
+    levels = [(per_bucket, pairs)]
+    while len(pairs) // 2 > MIN_BUCKETS:
+        coarse = array('b')
+        step = LEVEL_FACTOR * 2
+        for start in range(0, len(pairs), step):
+            group = pairs[start:start + step]
+            coarse.append(min(group[0::2]))
+            coarse.append(max(group[1::2]))
+        pairs = coarse
+        levels.append((levels[-1][0] * LEVEL_FACTOR, pairs))
+    return sample_rate, levels
+
+def encode_peaks(sample_rate: int, levels: List[Tuple[int, array]]) -> bytes:
+    parts = [HEADER.pack(b'PEAK', VERSION, 8, len(levels), sample_rate)]
+    parts.extend(LEVEL.pack(per_bucket, len(pairs) // 2) for per_bucket, pairs in levels)
+    parts.extend(pairs.tobytes() for _, pairs in levels)
+    return b''.join(parts)
+
+def decode_peaks(data: bytes) -> Tuple[int, List[Tuple[int, array]]]:
+    """Inverse of encode_peaks()"""
+    magic, version, bits, count, sample_rate = HEADER.unpack_from(data)
+    if magic != b'PEAK' or version != VERSION or bits != 8:
+        raise ValueError('Not a peaks file')
+    offset = HEADER.size
+    sizes = []
+    for _ in range(count):
+        sizes.append(LEVEL.unpack_from(data, offset))
+        offset += LEVEL.size
+    levels = []
+    for per_bucket, buckets in sizes:
+        levels.append((per_bucket, array('b', data[offset:offset + buckets * 2])))
+        offset += buckets * 2
+    return sample_rate, levels
+
+def generate_peaks(file_path: Path) -> bool:
+    """Compute and store the peaks of a file; False if it cannot be decoded"""
+    if not file_path.exists():
+        # Deleted while queued
+        return True
+    try:
+        data = encode_peaks(*compute_peaks(file_path))
+    except (OSError, EOFError, ValueError, wave.Error):
+        return False
+    temp = file_path.parent / f'{TEMP_PREFIX}{uuid.uuid4().hex}.part'
+    try:
+        temp.write_bytes(data)
+        os.replace(temp, peaks_path(file_path))
+    finally:
+        temp.unlink(missing_ok=True)
+    return True
+
+class PeaksQueue(JobQueue):
+    """Background peak computation, each file queued at most once"""
+
+    def __init__(self, workers: int = PEAKS_WORKERS):
+        super().__init__('peaks', workers)
+
+    def submit(self, file_path: Path) -> bool:
+        if ready_peaks(file_path):
+            return False
+        return super().submit(peaks_path(file_path), generate_peaks, file_path)
+
+    def failed(self, file_path: Path) -> bool:
+        return super().failed(peaks_path(file_path))
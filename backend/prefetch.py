@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Show mode: warming caches for the performances that come next
+
+During a show the operator goes through the performances in running order.
+Given the current performance, the files of its tracks and of the next few
+performances' tracks (originals, ready renditions and peaks) are handed to
+the kernel with posix_fadvise(WILLNEED), which reads them into the page
+cache in the background, so the first play of a track does not wait for
+the disk. Where posix_fadvise is missing (macOS, Windows) the start of each
+file is read instead. Loading the hint also puts the event's records in the
+process cache.
+
+- PERFORMANCE_MANAGER_PREFETCH_COUNT   performances warmed after the current one (default 2)
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import transcode
+from jobs import JobQueue
+from listing import order_key
+from peaks import ready_peaks
+
+PREFETCH_COUNT = int(os.environ.get('PERFORMANCE_MANAGER_PREFETCH_COUNT', '2'))
+MAX_PREFETCH_COUNT = 10
+
+# Read from each file when the kernel cannot be asked to read ahead
+FALLBACK_READ_BYTES = 1024 * 1024
+
+def upcoming_performances(performances: List[Dict[str, Any]], current_id: Optional[str],
+                          count: int) -> Optional[List[Dict[str, Any]]]:
+    """The current performance and the next `count` that are not done, in running order
+
+    Without current_id the show has not started: the first `count` + 1
+    performances that are not done. None if current_id is unknown.
+    """
+    ordered = sorted(performances, key=order_key)
+    if current_id is None:
+        return [p for p in ordered if not p.get('isDone')][:count + 1]
+    position = next((i for i, p in enumerate(ordered) if p['id'] == current_id), None)
+    if position is None:
+        return None
+    upcoming = [p for p in ordered[position + 1:] if not p.get('isDone')]
+    return [ordered[position]] + upcoming[:count]
+
+def track_files(file_path: Path) -> List[Path]:
+    """A track's file and the derived files a player may request"""
+    files = [file_path]
+    files.extend(path for path in (transcode.ready_rendition(file_path, quality) for quality in transcode.RENDITIONS)
+                 if path is not None)
+    peaks = ready_peaks(file_path)
+    if peaks is not None:
+        files.append(peaks)
+    return files
+
+def warm_file(path: Path) -> None:
+    """Start reading a file into the page cache"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            # Length 0 is the whole file; returns once the reads are queued
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            os.read(fd, FALLBACK_READ_BYTES)
+    finally:
+        os.close(fd)
+
+def prefetch_hint(event_id: str, performances: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """What a player may preload: the tracks it would play, in order"""
+    return {
+        'eventId': event_id,
+        'performances': [{
+            'id': performance['id'],
+            'name': performance.get('name'),
+            'tracks': [{key: track[key] for key in ('id', 'filename', 'url', 'duration', 'gain') if key in track}
+                       for track in performance.get('tracks', []) if not track.get('isDisabled')],
+        } for performance in performances],
+    }
+
+class Prefetcher(JobQueue):
+    """Warms files on a background thread, each file queued at most once at a time"""
+
+    def __init__(self):
+        super().__init__('prefetch', 1)
+
+    def submit(self, file_path: Path) -> bool:
+        return super().submit(file_path, warm_file, file_path)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Resumable chunked uploads
+
+A tus-like protocol for large audio files over unreliable connections:
+1. create:   the client announces filename and total length
+2. append:   the client sends the bytes from the current offset (PATCH with
+             Upload-Offset); after a dropped connection it asks for the
+             offset (HEAD) and continues from there
+3. finalize: the complete file is moved into place like a regular upload
+
+Partial data lives in the performance directory as .resumable-<id>.part with
+its metadata in .resumable-<id>.json. The offset is the size of the .part
+file, so it survives restarts. Uploads without activity for
+PERFORMANCE_MANAGER_UPLOAD_EXPIRY_HOURS (default 24) are deleted by
+expire_uploads(), which also removes streaming-upload temp files and blobs
+left by a crash.
+"""
+
+import os
+import re
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import serializers
+from blobs import BLOB_DIR, BlobStore, hash_file
+from storage import DURABILITY, atomic_write, file_lock
+from uploads import CHUNK_SIZE, TEMP_PREFIX, UploadError, UploadedFile
+
+UPLOAD_EXPIRY_SECONDS = float(os.environ.get('PERFORMANCE_MANAGER_UPLOAD_EXPIRY_HOURS', '24')) * 3600
+
+# expire_uploads() walks the data directory at most this often per process
+SWEEP_INTERVAL_SECONDS = 600
+
+PREFIX = '.resumable-'
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+_last_sweep = 0.0
+
+class ResumableUpload:
+    """A partially uploaded file in a performance directory"""
+
+    def __init__(self, directory: Path, upload_id: str, info: Dict[str, Any]):
+        self.directory = directory
+        self.id = upload_id
+        self.info = info
+
+    @property
+    def part_path(self) -> Path:
+        return self.directory / f'{PREFIX}{self.id}.part'
+
+    @property
+    def info_path(self) -> Path:
+        return self.directory / f'{PREFIX}{self.id}.json'
+
+    @property
+    def lock_path(self) -> Path:
+        # Created by file_lock() while data is appended
+        return self.directory / f'.{self.part_path.name}.lock'
+
+    @property
+    def length(self) -> int:
+        return self.info['length']
+
+    @property
+    def offset(self) -> int:
+        try:
+            return self.part_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def expires_at(self) -> datetime:
+        try:
+            last_activity = self.part_path.stat().st_mtime
+        except FileNotFoundError:
+            last_activity = time.time()
+        return datetime.fromtimestamp(last_activity) + timedelta(seconds=UPLOAD_EXPIRY_SECONDS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'filename': self.info['filename'],
+            'performer': self.info['performer'],
+            'length': self.length,
+            'offset': self.offset,
+            'expiresAt': self.expires_at().isoformat(),
+        }
+
+    def append(self, stream, offset: int) -> int:
+        """Append request data at `offset` and return the new offset
+
+        Data received before a dropped connection is kept, so the client can
+        resume from the returned (or later queried) offset.
+        """
+        with file_lock(self.part_path):
+            current = self.offset
+            if offset != current:
+                raise UploadError(f'Offset mismatch: upload is at {current}', 409)
+            with open(self.part_path, 'ab') as f:
+                try:
+                    while True:
+                        chunk = stream.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if current + len(chunk) > self.length:
+                            f.truncate(offset)
+                            raise UploadError('Data beyond the announced upload length', 413)
+                        f.write(chunk)
+                        current += len(chunk)
+                except UploadError:
+                    raise
+                except Exception as e:
+                    # Dropped connection: keep what arrived
+                    logging.info(f"Upload {self.id} interrupted at {current}: {e}")
+                f.flush()
+                if DURABILITY in ('fsync', 'fsync-dir'):
+                    os.fsync(f.fileno())
+            return current
+
+    def finish(self) -> UploadedFile:
+        """Hand a complete upload over as an UploadedFile for store_uploaded_tracks()
+
+        The info file is removed under the upload's lock, so of concurrent
+        finalize requests only the first gets the file.
+        """
+        with file_lock(self.part_path):
+            if not self.info_path.exists():
+                raise UploadError('Upload already finalized', 404)
+            if self.offset != self.length:
+                raise UploadError(f'Upload incomplete: {self.offset} of {self.length} bytes received', 409)
+            # Hashed here: the digest cannot be carried across requests and workers
+            uploaded = UploadedFile('file', self.info['filename'], self.part_path, self.length, hash_file(self.part_path))
+            self.info_path.unlink()
+        self.lock_path.unlink(missing_ok=True)
+        return uploaded
+
+    def delete(self) -> None:
+        for path in (self.part_path, self.info_path, self.lock_path):
+            path.unlink(missing_ok=True)
+
+def create_upload(directory: Path, filename: str, length: int, performer: str) -> ResumableUpload:
+    """Start a resumable upload in a performance directory"""
+    upload = ResumableUpload(directory, uuid.uuid4().hex, {
+        'filename': filename,
+        'performer': performer,
+        'length': length,
+        'createdAt': datetime.now().isoformat(),
+    })
+    directory.mkdir(parents=True, exist_ok=True)
+    upload.part_path.touch()
+    atomic_write(upload.info_path, serializers.json_dumps(upload.info), 'rename')
+    return upload
+
+def get_upload(directory: Path, upload_id: str) -> Optional[ResumableUpload]:
+    """Look up an upload; expired uploads are deleted and reported as missing"""
+    if not _UPLOAD_ID.match(upload_id):
+        return None
+    upload = ResumableUpload(directory, upload_id, {})
+    try:
+        upload.info = serializers.json_loads(upload.info_path.read_bytes())
+    except (FileNotFoundError, serializers.DecodeError):
+        return None
+    if upload.expires_at() < datetime.now():
+        upload.delete()
+        return None
+    return upload
+
+def expire_uploads(config_dir: Path, force: bool = False) -> int:
+    """Delete abandoned partial uploads under the data directory
+
+    Runs at most every SWEEP_INTERVAL_SECONDS unless forced. Returns the
+    number of files removed.
+    """
+    global _last_sweep
+    now = time.time()
+    if not force and now - _last_sweep < SWEEP_INTERVAL_SECONDS:
+        return 0
+    _last_sweep = now
+
+    removed = 0
+    for info_path in config_dir.glob(f'*/*/{PREFIX}*.json'):
+        upload = ResumableUpload(info_path.parent, info_path.name[len(PREFIX):-len('.json')], {})
+        if upload.expires_at() < datetime.now():
+            upload.delete()
+            removed += 1
+
+    # Streaming-upload temp files (in <event>/<performance>/, or <event>/ while
+    # creating a performance) and parts orphaned by a crash during finalize
+    for pattern in (f'*/*/{TEMP_PREFIX}*', f'*/{TEMP_PREFIX}*', f'*/*/{PREFIX}*.part'):
+        for path in config_dir.glob(pattern):
+            if path.suffix == '.part' and path.name.startswith(PREFIX) and path.with_suffix('.json').exists():
+                continue
+            try:
+                if now - path.stat().st_mtime > UPLOAD_EXPIRY_SECONDS:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    # A crash between storing a blob and linking it leaves it unreferenced
+    removed += BlobStore(config_dir / BLOB_DIR).collect()
+    if removed:
+        logging.info(f"Removed {removed} expired uploads")
+    return removed
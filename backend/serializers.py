@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Serializers for persisted data
+
+Persisted documents are encoded with compact JSON by default, using orjson
+when it is installed and the stdlib encoder otherwise. msgpack can be chosen
+as a binary on-disk format (PERFORMANCE_MANAGER_FORMAT=msgpack) when the
+msgpack package is installed. decode() detects the format from the data
+itself, so files written in either format keep loading after a switch.
+"""
+
+import os
+import json
+import logging
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+# On-disk format for snapshots: 'json' or 'msgpack'
+STORAGE_FORMAT = os.environ.get('PERFORMANCE_MANAGER_FORMAT', 'json')
+
+FORMATS = ('json', 'msgpack')
+
+# Bytes a JSON document can start with (after optional whitespace); msgpack
+# arrays and maps start with bytes outside this set
+_JSON_START = frozenset(b'[{"-0123456789tfn')
+_WHITESPACE = b' \t\r\n'
+
+class DecodeError(ValueError):
+    """Raised when data cannot be decoded in any supported format"""
+
+def json_dumps(obj: Any) -> bytes:
+    """Encode an object as compact JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode()
+
+def json_loads(data) -> Any:
+    """Decode JSON from bytes or str"""
+    try:
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+    except ValueError as e:
+        raise DecodeError(str(e)) from e
+
+def encode(obj: Any, fmt: str = STORAGE_FORMAT) -> bytes:
+    """Encode an object in the given on-disk format"""
+    if fmt == 'msgpack':
+        if msgpack is None:
+            raise ValueError("msgpack format selected but the msgpack package is not installed")
+        return msgpack.packb(obj, use_bin_type=True)
+    if fmt == 'json':
+        return json_dumps(obj)
+    raise ValueError(f"Unknown storage format: {fmt}")
+
+def detect_format(data: bytes) -> str:
+    """Return 'json' or 'msgpack' for encoded data"""
+    stripped = data.lstrip(_WHITESPACE)
+    if not stripped or stripped[0] in _JSON_START:
+        return 'json'
+    return 'msgpack'
+
+def decode(data: bytes) -> Any:
+    """Decode data written by encode() in any supported format"""
+    if detect_format(data) == 'json':
+        return json_loads(data)
+    if msgpack is None:
+        raise DecodeError("data looks like msgpack but the msgpack package is not installed")
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except ValueError as e:
+        raise DecodeError(str(e)) from e
+
+def check_format(fmt: str) -> str:
+    """Validate a format name, falling back to JSON if msgpack is unavailable"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown storage format: {fmt}")
+    if fmt == 'msgpack' and msgpack is None:
+        logging.warning("msgpack is not installed, storing data as JSON")
+        return 'json'
+    return fmt
@@ -34,7 +34,19 @@ def setup_venv():
 
     return python_path, backend_dir
 
-def start_server(port=5000):
+def server_command(python_path, port, mode, workers=None, threads=None):
+    """Command line for the development server or the production gunicorn server"""
+    if mode == "development":
+        return [str(python_path), "app.py", "--port", str(port)]
+
+    command = [str(python_path), "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"0.0.0.0:{port}"]
+    if workers:
+        command += ["--workers", str(workers)]
+    if threads:
+        command += ["--threads", str(threads)]
+    return command
+
+def start_server(port=5000, mode="development", workers=None, threads=None):
     print("Setting up Performance Manager...")
 
     try:
@@ -77,6 +89,7 @@ def start_server(port=5000):
         print("\n" + "="*60)
         print("🎵 Starting Performance Manager")
         print(f"📍 Server: http://127.0.0.1:{port}")
+        print(f"⚙️  Mode: {mode}")
         print("🎭 Cultural Events Performance Management System")
         print("📁 Config: " + str(config_dir))
         print("📝 Logs: " + str(log_file))
@@ -88,7 +101,7 @@ def start_server(port=5000):
         # Redirect output to log file
         with open(log_file, "w") as log:
             process = subprocess.Popen(
-                [str(python_path), "app.py", "--port", str(port)],
+                server_command(python_path, port, mode, workers, threads),
                 stdout=log,
                 stderr=subprocess.STDOUT,
                 cwd=backend_dir
@@ -123,6 +136,16 @@ def start_server(port=5000):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Start Performance Manager")
     parser.add_argument("--port", type=int, default=5000, help="Port to run the server on (default: 5000)")
+    parser.add_argument("--mode", choices=["development", "production"],
+                        default=os.environ.get("PERFORMANCE_MANAGER_MODE", "development"),
+                        help="development: Flask server; production: gunicorn with several workers "
+                             "(default: PERFORMANCE_MANAGER_MODE or development)")
+    parser.add_argument("--workers", type=int, help="Production mode: worker processes (default: CPU count)")
+    parser.add_argument("--threads", type=int, help="Production mode: threads per worker (default: 8)")
     args = parser.parse_args()
 
-    start_server(args.port)
\ No newline at end of file
+    if args.mode == "production" and os.name == 'nt':
+        print("⚠️  Production mode needs gunicorn, which does not run on Windows; using development mode")
+        args.mode = "development"
+
+    start_server(args.port, args.mode, args.workers, args.threads)
\ No newline at end of file
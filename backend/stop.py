@@ -109,10 +109,34 @@ def show_status():
             pid_file.unlink()
         return False
 
+def reload_server():
+    """Gracefully restart the server's workers (production mode only)"""
+    config_dir = Path.home() / ".config" / "performance-manager"
+    pid_file = config_dir / "performance-manager.pid"
+
+    if not pid_file.exists():
+        print("❌ Performance Manager is not running (no PID file found)")
+        return
+
+    try:
+        with open(pid_file, "r") as f:
+            pid = int(f.read().strip())
+        # gunicorn starts new workers and lets the old ones finish their requests
+        os.kill(pid, signal.SIGHUP)
+        print(f"🔄 Reload signal sent to Performance Manager (PID: {pid})")
+    except ValueError:
+        print("❌ Invalid PID file format")
+    except ProcessLookupError:
+        print("❌ Process not found (may have already stopped)")
+    except PermissionError:
+        print("❌ Permission denied - cannot signal process")
+
 if __name__ == "__main__":
     import sys
 
     if len(sys.argv) > 1 and sys.argv[1] == "status":
         show_status()
+    elif len(sys.argv) > 1 and sys.argv[1] == "reload":
+        reload_server()
     else:
         stop_server()
\ No newline at end of file
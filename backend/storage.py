@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""
+Storage engines for Performance Manager data
+
+EventManager keeps three kinds of record lists:
+- 'events': the global event list (event_id is None)
+- 'performances' and 'breaks': one list per event
+
+An engine loads and saves these lists. Saves may carry a list of changes
+(see op_put / op_delete) describing exactly which records were touched, so
+engines that support row-level writes only persist what changed. Every load
+returns a stamp; a different stamp means the stored data has changed since.
+"""
+
+import os
+import time
+import fcntl
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+from contextlib import contextmanager
+
+import serializers
+
+EVENTS = 'events'
+RECORD_KINDS = ('performances', 'breaks')
+
+SQLITE_DB_NAME = 'performance-manager.db'
+
+# JSON journal: fold into the snapshot after this many appended saves...
+JOURNAL_COMPACT_OPS = int(os.environ.get('PERFORMANCE_MANAGER_JOURNAL_COMPACT_OPS', '200'))
+# ...or once the oldest uncompacted save is this many seconds old
+JOURNAL_COMPACT_SECONDS = float(os.environ.get('PERFORMANCE_MANAGER_JOURNAL_COMPACT_SECONDS', '30'))
+# Appended saves are fsynced together at most this often
+JOURNAL_FSYNC_SECONDS = float(os.environ.get('PERFORMANCE_MANAGER_JOURNAL_FSYNC_SECONDS', '0.2'))
+
+# How hard writes try to survive crashes, from fastest to safest:
+# - none:      write files in place, never fsync (a crash can truncate a file)
+# - rename:    write a temp file and atomically rename it over the target
+# - fsync:     rename, fsync the temp file first; journal appends fsynced in batches
+# - fsync-dir: fsync, and fsync the directory after the rename; journal appends
+#              fsynced on every save
+DURABILITY_MODES = ('none', 'rename', 'fsync', 'fsync-dir')
+DURABILITY = os.environ.get('PERFORMANCE_MANAGER_DURABILITY', 'fsync')
+
+# SQLite synchronous setting matching each durability mode
+SQLITE_SYNCHRONOUS = {'none': 'OFF', 'rename': 'NORMAL', 'fsync': 'FULL', 'fsync-dir': 'EXTRA'}
+
+@contextmanager
+def file_lock(file_path: Path, shared: bool = False):
+    """Context manager for file locking to prevent concurrent writes
+
+    Writers take the lock exclusively; readers that only need a consistent
+    view pass shared=True and may hold it together. flock() locks belong to
+    the open file, so they also exclude other threads of the same process.
+    """
+    lock_file = file_path.parent / f".{file_path.name}.lock"
+    lock_file.touch(exist_ok=True)
+
+    with open(lock_file, 'a') as lock:
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            # Release lock
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+def file_stamp(file_path: Path) -> Optional[tuple]:
+    """Return a cheap freshness token for a file, or None if it does not exist
+
+    The token changes whenever the file is rewritten (mtime), replaced (inode)
+    or truncated (size), so it can be compared instead of re-parsing the file.
+    """
+    try:
+        stat = file_path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+def fsync_dir(dir_path: Path) -> None:
+    """Flush a directory entry (e.g. after a rename) to disk"""
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(file_path: Path, data: bytes, durability: str = DURABILITY) -> None:
+    """Replace a file's content according to the durability mode
+
+    Except in 'none' mode, the data is written to a temporary file in the same
+    directory and renamed over the target, so readers and crashes only ever
+    see the old or the new content, never a truncated file.
+    """
+    if durability == 'none':
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        return
+
+    tmp_path = file_path.parent / f'.{file_path.name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            if durability in ('fsync', 'fsync-dir'):
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    if durability == 'fsync-dir':
+        fsync_dir(file_path.parent)
+
+def op_put(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Change entry: insert or replace a record"""
+    return {'op': 'put', 'record': record}
+
+def op_delete(record_id: str) -> Dict[str, Any]:
+    """Change entry: remove a record by id"""
+    return {'op': 'delete', 'id': record_id}
+
+def apply_changes(records: List[Dict[str, Any]], changes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Apply put/delete changes to a record list in place and return it
+
+    Puts replace an existing record at its position or append a new one,
+    matching how EventManager edits its in-memory lists.
+    """
+    positions = {r['id']: i for i, r in enumerate(records)}
+    deleted = False
+    for change in changes:
+        if change['op'] == 'put':
+            record = change['record']
+            position = positions.get(record['id'])
+            if position is None:
+                positions[record['id']] = len(records)
+                records.append(record)
+            else:
+                records[position] = record
+        elif change['op'] == 'delete':
+            position = positions.pop(change['id'], None)
+            if position is not None:
+                records[position] = None
+                deleted = True
+    if deleted:
+        records[:] = [r for r in records if r is not None]
+    return records
+
+class StorageEngine:
+    """Interface implemented by the storage backends"""
+
+    name = ''
+
+    def load(self, event_id: Optional[str], kind: str) -> Tuple[List[Dict[str, Any]], Any]:
+        """Return (records, stamp) for a record list"""
+        raise NotImplementedError
+
+    def stamp(self, event_id: Optional[str], kind: str) -> Any:
+        """Return the current stamp of a record list without loading it"""
+        raise NotImplementedError
+
+    def save(self, event_id: Optional[str], kind: str, records: List[Dict[str, Any]],
+             changes: Optional[List[Dict[str, Any]]] = None) -> Any:
+        """Persist a record list and return its new stamp
+
+        `records` is always the complete list after the change. `changes`,
+        when given, lists the records that were put or deleted; None means the
+        list was edited arbitrarily and must be stored as a whole.
+        """
+        raise NotImplementedError
+
+    def drop_event(self, event_id: str) -> None:
+        """Forget all per-event records of an event"""
+
+    def close(self) -> None:
+        """Release any resources held by the engine"""
+
+class JsonStorage(StorageEngine):
+    """One JSON document per record list
+
+    This is the original on-disk layout:
+    - <config>/events.json
+    - <config>/<event_id>/performances.json and breaks.json
+
+    With journaling enabled, saves that carry a change list are appended as
+    one line to a sibling `.journal` file instead of rewriting the document,
+    so their cost does not depend on the size of the list. Loading replays
+    the journal over the snapshot, which also recovers every save that made
+    it to disk before a crash. A background compactor folds the journal into
+    the snapshot after JOURNAL_COMPACT_OPS saves or JOURNAL_COMPACT_SECONDS,
+    and fsyncs pending appends in batches every JOURNAL_FSYNC_SECONDS.
+    """
+
+    name = 'json'
+
+    def __init__(self, config_dir: Path, journal: bool = True,
+                 compact_ops: int = JOURNAL_COMPACT_OPS,
+                 compact_seconds: float = JOURNAL_COMPACT_SECONDS,
+                 fsync_seconds: float = JOURNAL_FSYNC_SECONDS,
+                 durability: str = DURABILITY,
+                 fmt: str = serializers.STORAGE_FORMAT):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.config_dir = Path(config_dir)
+        self.durability = durability
+        # Snapshot format; journals are always line-delimited JSON
+        self.format = serializers.check_format(fmt)
+        self.journal = journal
+        self.compact_ops = compact_ops
+        self.compact_seconds = compact_seconds
+        self.fsync_seconds = fsync_seconds
+        # snapshot path -> {'ops': appended saves, 'since': monotonic time of the first, 'unsynced': bool}
+        self._pending: Dict[Path, Dict[str, Any]] = {}
+        self._pending_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def path(self, event_id: Optional[str], kind: str) -> Path:
+        if kind == EVENTS:
+            return self.config_dir / 'events.json'
+        return self.config_dir / event_id / f'{kind}.json'
+
+    @staticmethod
+    def journal_path(records_file: Path) -> Path:
+        return records_file.with_suffix('.journal')
+
+    def _read_snapshot(self, records_file: Path) -> List[Dict[str, Any]]:
+        try:
+            with open(records_file, 'rb') as f:
+                return serializers.decode(f.read())
+        except (serializers.DecodeError, FileNotFoundError):
+            return []
+
+    def _read_journal(self, journal_file: Path) -> List[List[Dict[str, Any]]]:
+        """Return the change lists in a journal, skipping torn or corrupt lines"""
+        batches = []
+        try:
+            with open(journal_file, 'rb') as f:
+                for line in f:
+                    try:
+                        batches.append(serializers.json_loads(line))
+                    except serializers.DecodeError:
+                        logging.warning(f"Skipping corrupt journal entry in {journal_file}")
+        except FileNotFoundError:
+            pass
+        return batches
+
+    def _replay(self, records_file: Path) -> List[Dict[str, Any]]:
+        records = self._read_snapshot(records_file)
+        for changes in self._read_journal(self.journal_path(records_file)):
+            apply_changes(records, changes)
+        return records
+
+    def _write_snapshot(self, records_file: Path, records: List[Dict[str, Any]]) -> None:
+        atomic_write(records_file, serializers.encode(records, self.format), self.durability)
+        # A crash before the unlink just replays changes the snapshot already has
+        journal_file = self.journal_path(records_file)
+        if journal_file.exists():
+            journal_file.unlink()
+        with self._pending_lock:
+            self._pending.pop(records_file, None)
+
+    def _append(self, records_file: Path, changes: List[Dict[str, Any]]) -> int:
+        """Append one save to the journal and return the number of pending saves"""
+        journal_file = self.journal_path(records_file)
+        line = serializers.json_dumps(changes) + b'\n'
+        fd = os.open(journal_file, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # A crash can leave a torn last line; start on a fresh one so only
+            # the torn entry is lost on replay
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                line = b'\n' + line
+            os.write(fd, line)
+            if self.durability == 'fsync-dir':
+                os.fsync(fd)
+                if not size:
+                    fsync_dir(journal_file.parent)
+        finally:
+            os.close(fd)
+
+        with self._pending_lock:
+            state = self._pending.get(records_file)
+            if state is None:
+                # Count saves already journaled by an earlier run or another process
+                state = {'ops': len(self._read_journal(journal_file)) - 1, 'since': time.monotonic()}
+                self._pending[records_file] = state
+            state['ops'] += 1
+            # Only the 'fsync' mode leaves appends to the batched fsync
+            state['unsynced'] = self.durability == 'fsync'
+            ops = state['ops']
+        self._start_compactor()
+        return ops
+
+    def load(self, event_id, kind):
+        records_file = self.path(event_id, kind)
+        # Stat before reading: if the file changes in between, the returned
+        # stamp is older than the content and the next check simply re-reads it
+        stamp = self.stamp(event_id, kind)
+        if stamp[1] is not None:
+            # Snapshot and journal must be read as a pair; readers share the lock
+            with file_lock(records_file, shared=True):
+                return self._replay(records_file), stamp
+        if stamp[0] is None:
+            return [], stamp
+        return self._read_snapshot(records_file), stamp
+
+    def stamp(self, event_id, kind):
+        records_file = self.path(event_id, kind)
+        return (file_stamp(records_file), file_stamp(self.journal_path(records_file)))
+
+    def save(self, event_id, kind, records, changes=None):
+        records_file = self.path(event_id, kind)
+        records_file.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(records_file):
+            if changes is None or not self.journal:
+                self._write_snapshot(records_file, records)
+            elif changes:
+                if self._append(records_file, changes) >= self.compact_ops:
+                    # From the files, not `records`: other processes may have
+                    # journaled changes the caller has not loaded
+                    self._write_snapshot(records_file, self._replay(records_file))
+            return self.stamp(event_id, kind)
+
+    def compact(self, records_file: Path) -> None:
+        """Fold a journal into its snapshot"""
+        with file_lock(records_file):
+            if self.journal_path(records_file).exists():
+                self._write_snapshot(records_file, self._replay(records_file))
+            else:
+                with self._pending_lock:
+                    self._pending.pop(records_file, None)
+
+    def flush(self) -> None:
+        """Compact every pending journal now"""
+        with self._pending_lock:
+            pending = list(self._pending)
+        for records_file in pending:
+            if records_file.parent.exists():
+                self.compact(records_file)
+            else:
+                with self._pending_lock:
+                    self._pending.pop(records_file, None)
+
+    def _start_compactor(self) -> None:
+        if self._compactor is None:
+            with self._pending_lock:
+                if self._compactor is None:
+                    self._compactor = threading.Thread(target=self._compactor_loop,
+                                                       name='journal-compactor', daemon=True)
+                    self._compactor.start()
+
+    def _compactor_loop(self) -> None:
+        while not self._stop.wait(self.fsync_seconds):
+            now = time.monotonic()
+            with self._pending_lock:
+                pending = [(path, dict(state)) for path, state in self._pending.items()]
+            for records_file, state in pending:
+                try:
+                    if not records_file.parent.exists():
+                        with self._pending_lock:
+                            self._pending.pop(records_file, None)
+                    elif now - state['since'] >= self.compact_seconds:
+                        self.compact(records_file)
+                    elif state.get('unsynced'):
+                        self._fsync_journal(records_file)
+                except Exception as e:
+                    logging.error(f"Journal maintenance failed for {records_file}: {e}")
+
+    def _fsync_journal(self, records_file: Path) -> None:
+        with self._pending_lock:
+            state = self._pending.get(records_file)
+            if state:
+                state['unsynced'] = False
+        try:
+            fd = os.open(self.journal_path(records_file), os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+        self.flush()
+
+class SqliteStorage(StorageEngine):
+    """Records stored as rows in a WAL-mode SQLite database
+
+    Each record is a row holding its JSON document, with the event id and
+    order pulled out into indexed columns. `seq` preserves the list order the
+    JSON layout had. Saves with a change list only touch the affected rows;
+    every save bumps a per-list generation counter that serves as the stamp.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS events ('
+        ' id TEXT PRIMARY KEY, seq INTEGER NOT NULL, data TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS generations ('
+        ' event_id TEXT NOT NULL, kind TEXT NOT NULL, gen INTEGER NOT NULL,'
+        ' PRIMARY KEY (event_id, kind))',
+    ] + [
+        statement
+        for kind in RECORD_KINDS
+        for statement in (
+            f'CREATE TABLE IF NOT EXISTS {kind} ('
+            f' event_id TEXT NOT NULL, id TEXT NOT NULL, seq INTEGER NOT NULL,'
+            f' "order" REAL, data TEXT NOT NULL, PRIMARY KEY (event_id, id))',
+            f'CREATE INDEX IF NOT EXISTS {kind}_event_order ON {kind} (event_id, "order")',
+            f'CREATE INDEX IF NOT EXISTS {kind}_event_seq ON {kind} (event_id, seq)',
+        )
+    ]
+
+    def __init__(self, db_path: Path, durability: str = DURABILITY):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.db_path = Path(db_path)
+        self.synchronous = SQLITE_SYNCHRONOUS[durability]
+        self._local = threading.local()
+        with self.transaction() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, write: bool = True):
+        """Run statements in one transaction, taking the write lock up front for writes"""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _generation_key(event_id: Optional[str], kind: str) -> Tuple[str, str]:
+        return (event_id or '', kind)
+
+    def _generation(self, conn, event_id, kind) -> int:
+        row = conn.execute('SELECT gen FROM generations WHERE event_id = ? AND kind = ?',
+                           self._generation_key(event_id, kind)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_generation(self, conn, event_id, kind) -> int:
+        gen = self._generation(conn, event_id, kind) + 1
+        conn.execute('INSERT INTO generations (event_id, kind, gen) VALUES (?, ?, ?) '
+                     'ON CONFLICT (event_id, kind) DO UPDATE SET gen = excluded.gen',
+                     self._generation_key(event_id, kind) + (gen,))
+        return gen
+
+    def load(self, event_id, kind):
+        with self.transaction(write=False) as conn:
+            gen = self._generation(conn, event_id, kind)
+            if kind == EVENTS:
+                rows = conn.execute('SELECT data FROM events ORDER BY seq').fetchall()
+            else:
+                rows = conn.execute(f'SELECT data FROM {kind} WHERE event_id = ? ORDER BY seq',
+                                    (event_id,)).fetchall()
+        return [serializers.json_loads(row[0]) for row in rows], gen
+
+    def stamp(self, event_id, kind):
+        return self._generation(self.connection(), event_id, kind)
+
+    def _put(self, conn, event_id, kind, record, seq=None):
+        data = serializers.json_dumps(record).decode()
+        if kind == EVENTS:
+            if seq is None:
+                seq = conn.execute('SELECT COALESCE(MAX(seq), -1) + 1 FROM events').fetchone()[0]
+            conn.execute('INSERT INTO events (id, seq, data) VALUES (?, ?, ?) '
+                         'ON CONFLICT (id) DO UPDATE SET data = excluded.data',
+                         (record['id'], seq, data))
+            return
+        if seq is None:
+            seq = conn.execute(f'SELECT COALESCE(MAX(seq), -1) + 1 FROM {kind} WHERE event_id = ?',
+                               (event_id,)).fetchone()[0]
+        conn.execute(f'INSERT INTO {kind} (event_id, id, seq, "order", data) VALUES (?, ?, ?, ?, ?) '
+                     f'ON CONFLICT (event_id, id) DO UPDATE SET "order" = excluded."order", data = excluded.data',
+                     (event_id, record['id'], seq, record.get('order'), data))
+
+    def _delete(self, conn, event_id, kind, record_id):
+        if kind == EVENTS:
+            conn.execute('DELETE FROM events WHERE id = ?', (record_id,))
+        else:
+            conn.execute(f'DELETE FROM {kind} WHERE event_id = ? AND id = ?', (event_id, record_id))
+
+    def save(self, event_id, kind, records, changes=None):
+        with self.transaction() as conn:
+            if changes is None:
+                # Full replace: drop rows that disappeared, rewrite the rest in list order
+                if kind == EVENTS:
+                    conn.execute('DELETE FROM events')
+                else:
+                    conn.execute(f'DELETE FROM {kind} WHERE event_id = ?', (event_id,))
+                for seq, record in enumerate(records):
+                    self._put(conn, event_id, kind, record, seq)
+            else:
+                for change in changes:
+                    if change['op'] == 'put':
+                        self._put(conn, event_id, kind, change['record'])
+                    elif change['op'] == 'delete':
+                        self._delete(conn, event_id, kind, change['id'])
+            return self._bump_generation(conn, event_id, kind)
+
+    def drop_event(self, event_id):
+        with self.transaction() as conn:
+            for kind in RECORD_KINDS:
+                conn.execute(f'DELETE FROM {kind} WHERE event_id = ?', (event_id,))
+            conn.execute('DELETE FROM generations WHERE event_id = ?', (event_id,))
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def migrate_json_to_sqlite(config_dir: Path, target: Optional[SqliteStorage] = None) -> Dict[str, int]:
+    """Copy the JSON layout under config_dir into a SQLite database
+
+    The JSON files are left untouched so the migration can be repeated or
+    rolled back by switching the engine setting. Returns record counts.
+    """
+    config_dir = Path(config_dir)
+    source = JsonStorage(config_dir)
+    target = target or SqliteStorage(config_dir / SQLITE_DB_NAME)
+
+    counts = {EVENTS: 0, **{kind: 0 for kind in RECORD_KINDS}}
+    events, _ = source.load(None, EVENTS)
+    target.save(None, EVENTS, events)
+    counts[EVENTS] = len(events)
+    for event in events:
+        for kind in RECORD_KINDS:
+            records, _ = source.load(event['id'], kind)
+            target.save(event['id'], kind, records)
+            counts[kind] += len(records)
+
+    logging.info(f"Migrated {counts} from {config_dir} to {target.db_path}")
+    return counts
+
+def create_storage(name: str, config_dir: Path, durability: str = DURABILITY) -> StorageEngine:
+    """Create the storage engine selected by name ('json' or 'sqlite')"""
+    config_dir = Path(config_dir)
+    if name == JsonStorage.name:
+        return JsonStorage(config_dir, durability=durability)
+    if name == SqliteStorage.name:
+        db_path = config_dir / SQLITE_DB_NAME
+        # Several server workers may start at once; only one of them migrates
+        with file_lock(db_path):
+            is_new = not db_path.exists()
+            engine = SqliteStorage(db_path, durability)
+            # First start on SQLite: bring existing JSON data along once
+            if is_new and (config_dir / 'events.json').exists():
+                migrate_json_to_sqlite(config_dir, engine)
+        return engine
+    raise ValueError(f"Unknown storage engine: {name}")
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Performance Manager storage tools')
+    parser.add_argument('command', choices=['migrate'], help='migrate: copy JSON data into SQLite')
+    parser.add_argument('--data-dir', default=os.environ.get('PERFORMANCE_MANAGER_DATA_DIR',
+                                                             str(Path.home() / '.config' / 'performance-manager')),
+                        help='Data directory (default: PERFORMANCE_MANAGER_DATA_DIR or ~/.config/performance-manager)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    counts = migrate_json_to_sqlite(Path(args.data_dir))
+    print(f"Migrated {counts[EVENTS]} events, {counts['performances']} performances, {counts['breaks']} breaks")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Streaming of audio files with HTTP Range support
+
+Responses never hold more than CHUNK_SIZE bytes of a file in memory. A whole
+file or a single range is handed to the server's wsgi.file_wrapper, which
+lets servers such as gunicorn send it with os.sendfile(); a multi-range
+request is streamed as multipart/byteranges in chunks. Suffix ranges
+(bytes=-N), If-Range, ETag and Last-Modified are supported.
+"""
+
+import os
+import uuid
+import mimetypes
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from werkzeug.http import is_resource_modified, parse_if_range_header
+from werkzeug.wrappers import Request, Response
+from werkzeug.wsgi import wrap_file
+
+# Bytes read per iteration when a file is not sent with sendfile()
+CHUNK_SIZE = 256 * 1024
+
+# Requests for more (non-overlapping) ranges than this get the whole file
+MAX_RANGES = 16
+
+# Types for the upload extensions in app.ALLOWED_EXTENSIONS; the system MIME
+# database does not know all of them everywhere
+AUDIO_MIMETYPES = {
+    '.mp3': 'audio/mpeg',
+    '.mp4': 'audio/mp4',
+    '.m4a': 'audio/mp4',
+    '.aac': 'audio/aac',
+    '.wav': 'audio/wav',
+    '.flac': 'audio/flac',
+    # Renditions (see transcode.py)
+    '.opus': 'audio/ogg',
+}
+
+def audio_mimetype(path: Path) -> str:
+    """MIME type for an audio file, based on its extension"""
+    return (AUDIO_MIMETYPES.get(path.suffix.lower())
+            or mimetypes.guess_type(path.name)[0]
+            or 'application/octet-stream')
+
+def file_etag(stat: os.stat_result) -> str:
+    """Strong ETag for a file version (unquoted)"""
+    return f'{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+class FileSlice:
+    """A read-only window of an open file
+
+    fileno() is exposed so a server's wsgi.file_wrapper can sendfile() the
+    slice; such servers send from the current file offset and stop at the
+    response Content-Length, which is set to the slice length.
+    """
+
+    def __init__(self, f, start: int, length: int):
+        f.seek(start)
+        self._file = f
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        if size == 0:
+            return b''
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def close(self) -> None:
+        self._file.close()
+
+def resolve_ranges(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Turn a Range header into sorted, merged (start, stop) byte ranges
+
+    Returns None if the header should be ignored (malformed, other units or
+    too many ranges) and an empty list if no range can be satisfied.
+    Unlike werkzeug's parser, overlapping and unordered ranges are accepted,
+    as RFC 9110 allows.
+    """
+    units, _, specs = header.partition('=')
+    if units.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        first, dash, last = spec.strip().partition('-')
+        if not dash or not (first or last) or not (first + last).isdigit():
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            start, stop = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            stop = size if not last else min(int(last) + 1, size)
+        if start < stop:
+            ranges.append((start, stop))
+
+    merged: List[Tuple[int, int]] = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+def _if_range_matches(header: str, etag: str, last_modified: datetime) -> bool:
+    """Whether an If-Range header still refers to the current file version"""
+    if header.strip().startswith('W/'):
+        # Weak validators never match If-Range
+        return False
+    if_range = parse_if_range_header(header)
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == last_modified.replace(microsecond=0)
+    return False
+
+def _read_range(f, start: int, stop: int) -> Iterator[bytes]:
+    f.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        data = f.read(min(CHUNK_SIZE, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+def _multipart_response(path: Path, ranges: List[Tuple[int, int]], size: int, mimetype: str) -> Response:
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+        for start, stop in ranges
+    ]
+    closing = f'--{boundary}--\r\n'.encode()
+    length = sum(len(h) + (stop - start) + 2 for h, (start, stop) in zip(part_headers, ranges)) + len(closing)
+
+    def generate() -> Iterator[bytes]:
+        with open(path, 'rb') as f:
+            for header, (start, stop) in zip(part_headers, ranges):
+                yield header
+                yield from _read_range(f, start, stop)
+                yield b'\r\n'
+            yield closing
+
+    response = Response(generate(), 206, mimetype=f'multipart/byteranges; boundary={boundary}',
+                        direct_passthrough=True)
+    response.content_length = length
+    return response
+
+def send_audio_file(path: Path, request: Request) -> Response:
+    """Serve a file for streaming playback, honouring Range and conditional headers"""
+    stat = path.stat()
+    size = stat.st_size
+    etag = file_etag(stat)
+    last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+    mimetype = audio_mimetype(path)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        ranges = None
+        range_header = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if range_header and (if_range is None or _if_range_matches(if_range, etag, last_modified)):
+            ranges = resolve_ranges(range_header, size)
+
+        if ranges == []:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+        elif ranges is not None and len(ranges) > 1:
+            response = _multipart_response(path, ranges, size, mimetype)
+        else:
+            start, stop = ranges[0] if ranges else (0, size)
+            body = FileSlice(open(path, 'rb'), start, stop - start)
+            response = Response(wrap_file(request.environ, body, CHUNK_SIZE), 206 if ranges else 200,
+                                mimetype=mimetype, direct_passthrough=True)
+            response.content_length = stop - start
+            if ranges:
+                response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
@@ -6,6 +6,10 @@ import pytest
 import tempfile
 import shutil
 import json
+import stat
+import wave
+from array import array
+from io import BytesIO
 from pathlib import Path
 import sys
 import os
@@ -13,6 +17,43 @@ import os
 # Add parent directory to path to import app
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app import EventManager, file_lock
+import transcode
+
+
+def square_wav(parts, rate=8000, channels=1, width=2):
+    """WAV of (seconds, amplitude) square wave parts; amplitude is a fraction of full scale, 0 is silence"""
+    frames = array('h')
+    for seconds, amplitude in parts:
+        level = int(amplitude * 32767)
+        for i in range(int(seconds * rate)):
+            frames.extend([level if (i // 20) % 2 else -level] * channels)
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(width)
+        w.setframerate(rate)
+        if width == 1:
+            w.writeframes(bytes((v >> 8) + 128 for v in frames))
+        else:
+            w.writeframes(frames.tobytes())
+    return buffer.getvalue()
+
+
+def upload(client, event_id, performance_id, data, filename):
+    """Upload one track performed by Asha; returns the added track"""
+    response = client.post(f'/api/events/{event_id}/performances/{performance_id}/upload',
+                           data={'file': (BytesIO(data), filename), 'performer': 'Asha'})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def install_ffmpeg(directory, script, monkeypatch):
+    """Use `script` as the ffmpeg executable; returns its path"""
+    path = directory / 'ffmpeg'
+    path.write_text(script)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(transcode, 'FFMPEG', str(path))
+    return path
 
 
 @pytest.fixture
@@ -26,11 +67,24 @@ def temp_dir():
 @pytest.fixture
 def event_manager(temp_dir):
     """Create an EventManager instance with temporary directory"""
-    em = EventManager()
-    # Override config paths for testing
-    em.events_file = temp_dir / 'events.json'
-    em.events = []
-    return em
+    em = EventManager(config_dir=temp_dir)
+    yield em
+    em.close()
+
+
+@pytest.fixture
+def client(event_manager, monkeypatch):
+    """Flask test client whose routes use the temporary EventManager"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'em', event_manager)
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def no_ffmpeg(monkeypatch):
+    """Decode audio with the standard library WAV reader, as without ffmpeg installed"""
+    monkeypatch.setattr(transcode, 'FFMPEG', None)
 
 
 @pytest.fixture
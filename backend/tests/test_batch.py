@@ -0,0 +1,167 @@
+"""
+Tests for batched event changes
+"""
+
+import pytest
+
+import batch
+from listing import order_key
+
+
+@pytest.fixture
+def lineup(event_manager):
+    """An event with five performances (the first has a track) and a break"""
+    event = event_manager.create_event('Gala')
+    ids = [event_manager.create_performance(event['id'], f'Act {i}', 'Asha')['id'] for i in range(5)]
+    track = event_manager.add_track(event['id'], ids[0], 'song.mp3', 'Asha')
+    interval = event_manager.create_break(event['id'], 'Interval', 'Lunch')
+    return event['id'], ids, track['id'], interval['id']
+
+
+def running_order(event_manager, event_id):
+    return [p['id'] for p in sorted(event_manager.load_event_performances(event_id), key=order_key)]
+
+
+def version(event_manager, event_id):
+    return event_manager.get_event(event_id)['version']
+
+
+@pytest.mark.unit
+class TestMove:
+
+    def test_move_writes_only_the_moved_record(self):
+        records = [{'id': str(i), 'order': i} for i in range(5)]
+
+        assert batch.move(records, records[2]) == [records[2]]
+        assert [r['id'] for r in sorted(records, key=order_key)] == ['0', '1', '3', '4', '2']
+        assert batch.move(records, records[4], before='1') == [records[4]]
+        assert records[4]['order'] == 0.5
+
+    def test_move_before_and_after(self):
+        records = [{'id': str(i), 'order': i} for i in range(4)]
+
+        batch.move(records, records[3], before='1')
+        assert [r['id'] for r in sorted(records, key=order_key)] == ['0', '3', '1', '2']
+        batch.move(records, records[0], after='2')
+        assert [r['id'] for r in sorted(records, key=order_key)] == ['3', '1', '2', '0']
+        with pytest.raises(batch.BatchError):
+            batch.move(records, records[0], before='missing')
+
+
+@pytest.mark.unit
+class TestBatchEndpoint:
+
+    def test_operations_are_saved_once(self, client, event_manager, lineup, monkeypatch):
+        event_id, ids, track_id, _ = lineup
+        start = version(event_manager, event_id)
+        saves = []
+        save = event_manager.storage.save
+        monkeypatch.setattr(event_manager.storage, 'save',
+                            lambda event, kind, *args: saves.append(kind) or save(event, kind, *args))
+
+        response = client.post(f'/api/events/{event_id}/batch', json={'operations': [
+            {'op': 'move', 'kind': 'performances', 'id': ids[0], 'after': ids[4]},
+            {'op': 'update', 'kind': 'performances', 'id': ids[1], 'set': {'name': 'Welcome'}},
+            {'op': 'setDone', 'kind': 'performances', 'id': ids[2], 'isDone': True},
+            {'op': 'completeTrack', 'performanceId': ids[0], 'trackId': track_id},
+        ]})
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['version'] == start + 1 == version(event_manager, event_id)
+        assert {p['id'] for p in body['changed']['performances']} == set(ids[:3])
+        assert [kind for kind in saves if kind != 'events'] == ['performances']
+
+        assert running_order(event_manager, event_id) == ids[1:] + ids[:1]
+        assert event_manager.get_performance(event_id, ids[1])['name'] == 'Welcome'
+        assert event_manager.get_performance(event_id, ids[2])['isDone'] is True
+        assert event_manager.get_performance(event_id, ids[0])['tracks'][0]['isCompleted'] is True
+
+    def test_performances_and_breaks_in_one_batch(self, client, event_manager, lineup):
+        event_id, ids, _, break_id = lineup
+        start = version(event_manager, event_id)
+
+        response = client.post(f'/api/events/{event_id}/batch', json={'operations': [
+            {'op': 'setDone', 'kind': 'breaks', 'id': break_id, 'isDone': True},
+            {'op': 'move', 'kind': 'performances', 'id': ids[4], 'before': ids[0]},
+        ]})
+        assert response.get_json()['version'] == start + 2
+        assert event_manager.load_event_breaks(event_id)[0]['isDone'] is True
+        assert running_order(event_manager, event_id)[0] == ids[4]
+
+    def test_invalid_operation_applies_nothing(self, client, event_manager, lineup):
+        event_id, ids, _, _ = lineup
+        start = version(event_manager, event_id)
+
+        response = client.post(f'/api/events/{event_id}/batch', json={'operations': [
+            {'op': 'update', 'kind': 'performances', 'id': ids[0], 'set': {'name': 'Welcome'}},
+            {'op': 'setDone', 'kind': 'performances', 'id': 'missing', 'isDone': True},
+        ]})
+        assert response.status_code == 404
+        assert response.get_json()['error'].startswith('Operation 1:')
+        assert version(event_manager, event_id) == start
+        assert event_manager.get_performance(event_id, ids[0])['name'] == 'Act 0'
+
+    @pytest.mark.parametrize('operation', [
+        {'op': 'rename', 'kind': 'performances'},
+        {'op': 'update', 'kind': 'events', 'id': 'x', 'set': {'name': 'x'}},
+        {'op': 'update', 'kind': 'performances', 'set': {'order': 3}},
+        {'op': 'update', 'kind': 'breaks', 'set': {'type': 'Nap'}},
+        {'op': 'setDone', 'kind': 'performances', 'isDone': 'yes'},
+        {'op': 'setDone', 'kind': 'performances', 'id': [1], 'isDone': True},
+        {'op': 'move', 'kind': 'performances', 'before': {'id': 'x'}},
+        {'op': 'completeTrack', 'performanceId': ['x'], 'trackId': 'x'},
+        {'op': 'completeTrack', 'trackId': 'x'},
+    ])
+    def test_malformed_operations(self, client, lineup, operation):
+        event_id, ids, _, break_id = lineup
+        operation.setdefault('id', break_id if operation.get('kind') == 'breaks' else ids[0])
+        response = client.post(f'/api/events/{event_id}/batch', json={'operations': [operation]})
+        assert response.status_code == 400
+
+    def test_unhashable_id_applies_nothing(self, client, event_manager, lineup):
+        event_id, ids, _, _ = lineup
+
+        response = client.post(f'/api/events/{event_id}/batch', json={'operations': [
+            {'op': 'update', 'kind': 'performances', 'id': ids[0], 'set': {'name': 'Welcome'}},
+            {'op': 'setDone', 'kind': 'performances', 'id': [ids[1]], 'isDone': True},
+        ]})
+        assert response.status_code == 400
+        # A later save of the same list does not pick up the rejected update
+        event_manager.update_performance(event_id, ids[2], {'isDone': True})
+        assert event_manager.get_performance(event_id, ids[0])['name'] == 'Act 0'
+
+    def test_unexpected_error_applies_nothing(self, event_manager, lineup, monkeypatch):
+        event_id, ids, _, _ = lineup
+        monkeypatch.setattr(batch, 'move', lambda *args: 1 / 0)
+
+        with pytest.raises(ZeroDivisionError):
+            event_manager.apply_batch(event_id, [
+                {'op': 'update', 'kind': 'performances', 'id': ids[0], 'set': {'name': 'Welcome'}},
+                {'op': 'move', 'kind': 'performances', 'id': ids[1]},
+            ])
+        event_manager.update_performance(event_id, ids[2], {'isDone': True})
+        assert event_manager.get_performance(event_id, ids[0])['name'] == 'Act 0'
+
+    def test_deleted_event_is_not_found(self, event_manager, lineup):
+        event_id, ids, _, _ = lineup
+        event_manager.delete_event(event_id)
+
+        with pytest.raises(batch.BatchError) as error:
+            event_manager.apply_batch(event_id, [{'op': 'setDone', 'kind': 'performances', 'id': ids[0], 'isDone': True}])
+        assert error.value.status == 404
+
+    def test_stale_version_is_refused(self, client, event_manager, lineup):
+        event_id, ids, _, _ = lineup
+        stale = version(event_manager, event_id)
+        event_manager.update_performance(event_id, ids[0], {'name': 'Welcome'})
+
+        response = client.post(f'/api/events/{event_id}/batch', json={'version': stale, 'operations': [
+            {'op': 'setDone', 'kind': 'performances', 'id': ids[0], 'isDone': True}]})
+        assert response.status_code == 409
+        assert event_manager.get_performance(event_id, ids[0])['isDone'] is False
+
+    def test_missing_event_and_operations(self, client, lineup):
+        event_id, _, _, _ = lineup
+        assert client.post('/api/events/missing/batch', json={'operations': []}).status_code == 404
+        assert client.post(f'/api/events/{event_id}/batch', json={'operations': []}).status_code == 400
+        assert client.post(f'/api/events/{event_id}/batch', json={'operations': [{}] * 501}).status_code == 400
@@ -0,0 +1,156 @@
+"""
+Tests for the content-addressed blob store
+"""
+
+import hashlib
+from io import BytesIO
+
+import pytest
+
+import blobs
+from app import EventManager
+from conftest import upload
+
+
+AUDIO = bytes(range(256)) * 400
+DIGEST = hashlib.sha256(AUDIO).hexdigest()
+
+
+@pytest.fixture
+def two_events(event_manager):
+    placements = []
+    for name in ('Gala', 'Recital'):
+        event = event_manager.create_event(name)
+        performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+        placements.append((event['id'], performance['id']))
+    return placements
+
+
+@pytest.mark.unit
+class TestBlobStore:
+
+    def test_repeated_upload_is_stored_once(self, client, event_manager, two_events):
+        tracks = [upload(client, e, p, AUDIO, 'backing.mp3') for e, p in two_events]
+
+        assert [t['contentHash'] for t in tracks] == [DIGEST, DIGEST]
+        paths = [event_manager.get_performance_dir(e, p) / 'backing.mp3' for e, p in two_events]
+        assert paths[0].read_bytes() == AUDIO
+        assert paths[0].stat().st_ino == paths[1].stat().st_ino == event_manager.blobs.path(DIGEST).stat().st_ino
+        assert event_manager.blobs.refcount(DIGEST) == 2
+
+    def test_blob_is_deleted_with_its_last_track(self, client, event_manager, two_events):
+        tracks = [upload(client, e, p, AUDIO, 'backing.mp3') for e, p in two_events]
+        (first_event, first_perf), (second_event, second_perf) = two_events
+
+        event_manager.delete_track(first_event, first_perf, tracks[0]['id'])
+        assert event_manager.blobs.refcount(DIGEST) == 1
+        event_manager.delete_track(second_event, second_perf, tracks[1]['id'])
+        assert not event_manager.blobs.path(DIGEST).exists()
+
+    def test_deleting_performance_and_event_releases_blobs(self, client, event_manager, two_events):
+        for e, p in two_events:
+            upload(client, e, p, AUDIO, 'backing.mp3')
+        (first_event, first_perf), (second_event, _) = two_events
+
+        event_manager.delete_performance(first_event, first_perf)
+        assert event_manager.blobs.refcount(DIGEST) == 1
+        event_manager.delete_event(second_event)
+        assert not event_manager.blobs.path(DIGEST).exists()
+
+    def test_same_name_in_one_performance_gets_a_suffix(self, client, event_manager, two_events):
+        event_id, performance_id = two_events[0]
+        upload(client, event_id, performance_id, AUDIO, 'backing.mp3')
+        second = upload(client, event_id, performance_id, AUDIO, 'backing.mp3')
+
+        assert second['filename'] == 'backing_1.mp3'
+        assert event_manager.blobs.refcount(DIGEST) == 2
+
+    def test_add_track_by_hash_skips_the_upload(self, client, event_manager, two_events):
+        (first_event, first_perf), (second_event, second_perf) = two_events
+        upload(client, first_event, first_perf, AUDIO, 'backing.mp3')
+        url = f'/api/events/{second_event}/performances/{second_perf}/tracks/by-hash'
+
+        response = client.post(url, json={'contentHash': DIGEST, 'filename': 'mine.mp3', 'performer': 'Ravi'})
+        assert response.status_code == 201
+        track = response.get_json()
+        assert track['filename'] == 'mine.mp3'
+        assert track['contentHash'] == DIGEST
+        assert event_manager.blobs.refcount(DIGEST) == 2
+
+        unknown = hashlib.sha256(b'other').hexdigest()
+        assert client.post(url, json={'contentHash': unknown, 'filename': 'a.mp3'}).status_code == 404
+        assert client.post(url, json={'contentHash': '../../etc', 'filename': 'a.mp3'}).status_code == 404
+        assert client.post(url, json={'contentHash': DIGEST, 'filename': 'a.txt'}).status_code == 400
+        assert client.post(url, json={'contentHash': [DIGEST], 'filename': 'a.mp3'}).status_code == 400
+
+    def test_resumable_upload_is_stored_by_hash(self, client, event_manager, two_events):
+        event_id, performance_id = two_events[0]
+        response = client.post(f'/api/events/{event_id}/performances/{performance_id}/uploads',
+                               json={'filename': 'backing.mp3', 'length': len(AUDIO)})
+        location = response.headers['Location']
+        client.patch(location, data=AUDIO, headers={'Upload-Offset': '0'})
+
+        track = client.post(f'{location}/finalize').get_json()
+        assert track['contentHash'] == DIGEST
+        assert event_manager.blobs.refcount(DIGEST) == 1
+
+    def test_upload_to_a_deleted_performance_leaves_nothing(self, client, event_manager, two_events, monkeypatch):
+        event_id, performance_id = two_events[0]
+        # The performance disappears between the upload and adding the track
+        monkeypatch.setattr(event_manager, 'add_track', lambda *args: None)
+
+        response = client.post(f'/api/events/{event_id}/performances/{performance_id}/upload',
+                               data={'file': (BytesIO(AUDIO), 'backing.mp3'), 'performer': 'Asha'})
+        assert response.status_code == 500
+        assert not event_manager.blobs.contains(DIGEST)
+        assert not (event_manager.get_performance_dir(event_id, performance_id) / 'backing.mp3').exists()
+
+    def test_collect_removes_unreferenced_blobs(self, event_manager):
+        orphan = event_manager.blobs.path(DIGEST)
+        orphan.parent.mkdir(parents=True)
+        orphan.write_bytes(AUDIO)
+
+        assert event_manager.blobs.collect() == 1
+        assert not orphan.exists()
+
+
+@pytest.mark.unit
+class TestBlobMigration:
+
+    def test_existing_files_are_moved_into_the_store(self, event_manager, two_events, temp_dir):
+        for event_id, performance_id in two_events:
+            performance_dir = event_manager.get_performance_dir(event_id, performance_id)
+            performance_dir.mkdir(parents=True, exist_ok=True)
+            (performance_dir / 'backing.mp3').write_bytes(AUDIO)
+            event_manager.add_track(event_id, performance_id, 'backing.mp3', 'Asha')
+        event_manager.metadata.wait()
+        (event_manager.blobs.root / blobs.MIGRATED_MARKER).unlink()
+
+        restarted = EventManager(config_dir=temp_dir)
+        try:
+            restarted._blob_migration.join()
+            assert restarted.blobs.is_migrated()
+            inodes = set()
+            for event_id, performance_id in two_events:
+                track = restarted.get_performance(event_id, performance_id)['tracks'][0]
+                assert track['contentHash'] == DIGEST
+                path = restarted.get_performance_dir(event_id, performance_id) / 'backing.mp3'
+                assert path.read_bytes() == AUDIO
+                inodes.add(path.stat().st_ino)
+            assert len(inodes) == 1
+            assert restarted.blobs.refcount(DIGEST) == 2
+        finally:
+            restarted.close()
+
+    def test_new_data_directory_needs_no_migration(self, event_manager):
+        assert event_manager.blobs.is_migrated()
+        assert event_manager._blob_migration is None
+
+
+@pytest.mark.unit
+class TestStreamedHashing:
+
+    def test_upload_is_hashed_while_streaming(self, client, event_manager, two_events, monkeypatch):
+        monkeypatch.setattr(blobs, 'hash_file', lambda path: pytest.fail('file was read back to hash it'))
+        event_id, performance_id = two_events[0]
+        assert upload(client, event_id, performance_id, AUDIO, 'backing.mp3')['contentHash'] == DIGEST
@@ -0,0 +1,167 @@
+"""
+Tests for the per-event change feed and its Server-Sent Events stream
+"""
+
+import json
+import threading
+import time
+
+import pytest
+
+import changefeed
+from app import EventManager
+
+
+@pytest.fixture(autouse=True)
+def short_streams(monkeypatch):
+    # A stream waiting for a message that never comes ends the test soon
+    monkeypatch.setattr(changefeed, 'MAX_STREAM_SECONDS', 3)
+
+
+@pytest.fixture
+def event(event_manager):
+    event = event_manager.create_event('Gala')
+    performances = [event_manager.create_performance(event['id'], name, 'Asha') for name in ('Opening', 'Finale')]
+    event_manager.add_track(event['id'], performances[0]['id'], 'song.mp3', 'Asha')
+    return event['id'], [p['id'] for p in performances]
+
+
+def version(event_manager, event_id):
+    return event_manager.get_event(event_id)['version']
+
+
+def read_messages(response, count):
+    """The first `count` messages of a stream as (event, id, data)"""
+    messages = []
+    buffer = b''
+    for chunk in response.response:
+        buffer += chunk
+        while b'\n\n' in buffer:
+            block, buffer = buffer.split(b'\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in block.decode().splitlines() if not line.startswith(':'))
+            if 'event' in fields:
+                messages.append((fields['event'], int(fields['id']), json.loads(fields['data'])))
+        if len(messages) >= count:
+            break
+    response.close()
+    return messages
+
+
+@pytest.mark.unit
+class TestChangeFeed:
+
+    def test_mutations_are_recorded_as_deltas(self, event_manager, event):
+        event_id, (first, second) = event
+        start = version(event_manager, event_id)
+        track_id = event_manager.get_performance(event_id, first)['tracks'][0]['id']
+
+        event_manager.update_performance(event_id, first, {'isDone': True})
+        event_manager.update_track_completion(event_id, first, track_id, True)
+        event_manager.reorder_performances(event_id, [second, first])
+        event_manager.delete_performance(event_id, second)
+
+        lines = event_manager.changes.path(event_id).read_text().splitlines()
+        deltas = [json.loads(line) for line in lines if json.loads(line)['version'] > start]
+        assert [d['version'] for d in deltas] == list(range(start + 1, start + 5))
+        assert deltas[0]['put'][0]['isDone'] is True
+        assert deltas[1]['put'][0]['tracks'][0]['isCompleted'] is True
+        # Only the performance that moved is written
+        assert [(p['id'], p['order']) for p in deltas[2]['put']] == [(second, -1)]
+        assert deltas[3] == {'version': start + 4, 'kind': 'performances', 'put': [], 'deleted': [second]}
+
+    def test_breaks_and_event_details_are_recorded(self, event_manager, event):
+        event_id, _ = event
+        event_manager.create_break(event_id, 'Interval', 'Intermission')
+        event_manager.update_event(event_id, {'name': 'Spring Gala'})
+
+        kinds = [json.loads(line)['kind'] for line in event_manager.changes.path(event_id).read_text().splitlines()]
+        assert kinds[-2:] == ['breaks', 'event']
+
+
+@pytest.mark.unit
+class TestChangeStream:
+
+    def test_missed_changes_are_replayed(self, client, event_manager, event):
+        event_id, (first, _) = event
+        start = version(event_manager, event_id)
+        event_manager.update_performance(event_id, first, {'name': 'Welcome'})
+        event_manager.update_performance(event_id, first, {'isDone': True})
+
+        response = client.get(f'/api/events/{event_id}/changes', headers={'Last-Event-ID': str(start)}, buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        messages = read_messages(response, 2)
+        assert [(name, number) for name, number, _ in messages] == [('change', start + 1), ('change', start + 2)]
+        assert messages[0][2]['put'][0]['name'] == 'Welcome'
+
+    def test_live_change_is_pushed(self, client, event_manager, event):
+        event_id, (first, _) = event
+        response = client.get(f'/api/events/{event_id}/changes', buffered=False)
+
+        def change():
+            time.sleep(0.1)
+            event_manager.update_performance(event_id, first, {'isDone': True})
+
+        began = time.monotonic()
+        threading.Thread(target=change).start()
+        (ready, start, _), (name, number, data) = read_messages(response, 2)
+        assert (ready, name, number) == ('ready', 'change', start + 1)
+        assert data['put'][0]['isDone'] is True
+        assert time.monotonic() - began < 1
+
+    def test_change_from_another_worker_is_pushed(self, client, event_manager, event, temp_dir):
+        event_id, (first, _) = event
+        since = version(event_manager, event_id)
+        # A second manager on the same data stands in for another server process
+        other = EventManager(config_dir=temp_dir)
+        try:
+            other.update_performance(event_id, first, {'name': 'Welcome'})
+        finally:
+            other.close()
+
+        response = client.get(f'/api/events/{event_id}/changes?since={since}', buffered=False)
+        [(name, number, data)] = read_messages(response, 1)
+        assert (name, number) == ('change', since + 1)
+        assert data['put'][0]['name'] == 'Welcome'
+
+    def test_client_behind_the_trimmed_feed_is_reset(self, client, event_manager, event, monkeypatch):
+        event_id, (first, _) = event
+        monkeypatch.setattr(changefeed, 'MAX_BYTES', 2048)
+        start = version(event_manager, event_id)
+        for i in range(10):
+            event_manager.update_performance(event_id, first, {'name': f'Take {i}'})
+
+        response = client.get(f'/api/events/{event_id}/changes?since={start}', buffered=False)
+        [(name, number, _)] = read_messages(response, 1)
+        assert name == 'reset'
+        assert start + 1 < number <= version(event_manager, event_id)
+
+    def test_streams_per_worker_are_limited(self, client, event, monkeypatch):
+        event_id, _ = event
+        monkeypatch.setattr(changefeed, 'MAX_STREAMS', 1)
+        url = f'/api/events/{event_id}/changes'
+        first = client.get(url, buffered=False)
+        assert first.status_code == 200
+
+        refused = client.get(url, buffered=False)
+        assert refused.status_code == 503
+        assert refused.headers['Retry-After'] == str(changefeed.RETRY_MS // 1000)
+
+        # Closing a stream frees its place
+        first.close()
+        second = client.get(url, buffered=False)
+        assert second.status_code == 200
+        second.close()
+
+    def test_closing_the_manager_ends_streams(self, client, event_manager, event):
+        event_id, _ = event
+        response = client.get(f'/api/events/{event_id}/changes', buffered=False)
+
+        began = time.monotonic()
+        threading.Timer(0.1, event_manager.closing.set).start()
+        assert [name for name, _, _ in read_messages(response, 2)] == ['ready']
+        assert time.monotonic() - began < 1
+
+    def test_invalid_requests(self, client, event):
+        event_id, _ = event
+        assert client.get('/api/events/missing/changes').status_code == 404
+        assert client.get(f'/api/events/{event_id}/changes', headers={'Last-Event-ID': 'x'}).status_code == 400
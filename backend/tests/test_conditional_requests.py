@@ -0,0 +1,77 @@
+"""
+Tests for ETag / Last-Modified validators on JSON read endpoints
+"""
+
+import pytest
+
+
+@pytest.fixture
+def event(event_manager):
+    event = event_manager.create_event('Gala')
+    event_manager.create_performance(event['id'], 'Opening', 'Asha')
+    return event
+
+
+@pytest.mark.unit
+class TestConditionalRequests:
+
+    @pytest.mark.parametrize('path', ['/api/events', '/api/events/{id}', '/api/events/{id}/performances',
+                                      '/api/events/{id}/breaks'])
+    def test_unchanged_resource_returns_304(self, client, event, path):
+        url = path.format(id=event['id'])
+        first = client.get(url)
+        assert first.status_code == 200
+        assert first.headers['ETag'].startswith('"')
+        assert 'Last-Modified' in first.headers
+        assert 'no-cache' in first.headers['Cache-Control']
+
+        second = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 304
+        assert second.data == b''
+        assert second.headers['ETag'] == first.headers['ETag']
+
+    def test_unchanged_poll_does_not_load_records(self, client, event_manager, event, monkeypatch):
+        url = f"/api/events/{event['id']}/performances"
+        etag = client.get(url).headers['ETag']
+
+        def fail(*args):
+            raise AssertionError('records loaded for an unchanged poll')
+        monkeypatch.setattr(event_manager, 'load_event_performances', fail)
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    def test_record_change_bumps_version_and_etag(self, client, event_manager, event):
+        url = f"/api/events/{event['id']}/performances"
+        first = client.get(url)
+        version = event_manager.get_event(event['id'])['version']
+
+        event_manager.create_break(event['id'], 'Interval', 'Tea')
+
+        assert event_manager.get_event(event['id'])['version'] == version + 1
+        second = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 200
+        assert second.headers['ETag'] != first.headers['ETag']
+
+    def test_event_update_changes_event_list_etag(self, client, event_manager, event):
+        etag = client.get('/api/events').headers['ETag']
+        event_manager.update_event(event['id'], {'name': 'Spring Gala'})
+
+        response = client.get('/api/events', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.get_json()[0]['name'] == 'Spring Gala'
+
+    def test_query_string_is_part_of_etag(self, client, event):
+        url = f"/api/events/{event['id']}/performances"
+        etag = client.get(url).headers['ETag']
+        response = client.get(f'{url}?fields=id', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_if_modified_since(self, client, event):
+        url = f"/api/events/{event['id']}"
+        last_modified = client.get(url).headers['Last-Modified']
+        assert client.get(url, headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    def test_errors_carry_no_validators(self, client, event):
+        response = client.get(f"/api/events/{event['id']}/performances?limit=0")
+        assert response.status_code == 400
+        assert 'ETag' not in response.headers
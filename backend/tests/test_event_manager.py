@@ -0,0 +1,330 @@
+"""
+Tests for EventManager persistence: in-memory caching of per-event data and
+coherence between several EventManagers (server workers) sharing a data directory
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import serializers
+from app import EventManager
+from storage import JsonStorage
+
+
+@pytest.fixture
+def event(event_manager):
+    """Create an event with a couple of performances"""
+    event = event_manager.create_event('Gala')
+    event_manager.create_performance(event['id'], 'Opening', 'Artist A')
+    event_manager.create_performance(event['id'], 'Closing', 'Artist B')
+    return event
+
+
+@pytest.mark.unit
+class TestEventCache:
+    """Parsed performances/breaks are served from memory while files are unchanged"""
+
+    def test_repeated_loads_do_not_reparse(self, event_manager, event, mocker):
+        """A warm cache answers reads without decoding the file"""
+        event_manager.load_event_performances(event['id'])
+        spy = mocker.spy(serializers, 'decode')
+
+        for _ in range(3):
+            performances = event_manager.load_event_performances(event['id'])
+            event_manager.get_performance(event['id'], performances[0]['id'])
+
+        assert spy.call_count == 0
+
+    def test_save_writes_through(self, event_manager, event):
+        """Saved data is visible in memory and on disk"""
+        performances = event_manager.load_event_performances(event['id'])
+        updated = event_manager.update_performance(event['id'], performances[0]['id'], {'isDone': True})
+        assert updated['isDone'] is True
+
+        assert event_manager.load_event_performances(event['id'])[0]['isDone'] is True
+        on_disk, _ = JsonStorage(event_manager.config_dir).load(event['id'], 'performances')
+        assert on_disk[0]['isDone'] is True
+
+    def test_external_change_is_detected(self, event_manager, event):
+        """A file rewritten by another process is reloaded"""
+        performances_file = event_manager.get_event_performances_file(event['id'])
+        assert len(event_manager.load_event_performances(event['id'])) == 2
+
+        JsonStorage(event_manager.config_dir).save(event['id'], 'performances',
+                                                   [{'id': 'external', 'tracks': [], 'order': 0}])
+        # Make sure the stamp differs even on coarse-grained filesystems
+        stat = performances_file.stat()
+        os.utime(performances_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        performances = event_manager.load_event_performances(event['id'])
+        assert [p['id'] for p in performances] == ['external']
+
+    def test_least_recently_used_event_is_evicted(self, temp_dir):
+        """Only cache_size events are kept in memory"""
+        from app import EventManager
+
+        manager = EventManager(config_dir=temp_dir, cache_size=2)
+        first, second, third = (manager.create_event(f'Event {i}') for i in range(3))
+
+        manager.load_event_performances(first['id'])
+        manager.load_event_performances(second['id'])
+        manager.load_event_performances(third['id'])
+
+        assert list(manager._cache) == [second['id'], third['id']]
+
+    def test_delete_event_drops_cache(self, event_manager, event):
+        """Deleted events do not linger in the cache"""
+        event_manager.load_event_breaks(event['id'])
+        assert event_manager.delete_event(event['id'])
+        assert event['id'] not in event_manager._cache
+
+
+@pytest.mark.unit
+class TestIndexedLookups:
+    """Id indexes stay in step with create, update, delete and reorder"""
+
+    def test_event_index(self, event_manager, event):
+        """Events are found by id until deleted"""
+        assert event_manager.get_event(event['id']) is event
+        event_manager.delete_event(event['id'])
+        assert event_manager.get_event(event['id']) is None
+
+    def test_track_lookup_checks_parent(self, event_manager, event):
+        """A track is only found under the performance that owns it"""
+        first, second = event_manager.load_event_performances(event['id'])
+        track = event_manager.add_track(event['id'], first['id'], 'song.mp3', 'Artist A')
+
+        updated = event_manager.update_track_completion(event['id'], first['id'], track['id'], True)
+        assert updated['isCompleted'] is True
+        assert event_manager.update_track(event['id'], second['id'], track['id'], {'isDisabled': True}) is None
+
+    def test_delete_track_updates_index(self, event_manager, event):
+        """Deleted tracks disappear from the record and the index"""
+        performance = event_manager.load_event_performances(event['id'])[0]
+        track = event_manager.add_track(event['id'], performance['id'], 'song.mp3', 'Artist A')
+
+        assert event_manager.delete_track(event['id'], performance['id'], track['id'])['id'] == track['id']
+        assert event_manager.get_performance(event['id'], performance['id'])['tracks'] == []
+        assert event_manager.update_track(event['id'], performance['id'], track['id'], {}) is None
+
+    def test_replacing_tracks_reindexes(self, event_manager, event):
+        """A PUT that replaces the track list refreshes nested lookups"""
+        performance = event_manager.load_event_performances(event['id'])[0]
+        old_track = event_manager.add_track(event['id'], performance['id'], 'old.mp3', 'Artist A')
+        new_track = {'id': 'track-new', 'filename': 'new.mp3', 'performer': 'Artist A', 'isCompleted': False}
+
+        event_manager.update_performance(event['id'], performance['id'], {'tracks': [new_track]})
+
+        assert event_manager.update_track_completion(event['id'], performance['id'], 'track-new', True)
+        index = event_manager._load_index(event['id'], 'performances')
+        assert set(index.tracks) == {'track-new'}
+        assert index.get_track(performance['id'], old_track['id']) is None
+
+    def test_deleting_a_performance_drops_its_tracks(self, event_manager, event):
+        """Only the deleted performance's tracks leave the track index"""
+        first, second = event_manager.load_event_performances(event['id'])
+        kept = event_manager.add_track(event['id'], first['id'], 'kept.mp3', 'Artist A')
+        event_manager.add_track(event['id'], second['id'], 'gone.mp3', 'Artist B')
+
+        assert event_manager.delete_performance(event['id'], second['id'])
+        assert set(event_manager._load_index(event['id'], 'performances').tracks) == {kept['id']}
+
+    def test_tracks_are_found_by_filename(self, event_manager, event):
+        """The filename lookup follows renames and deletions"""
+        first, second = event_manager.load_event_performances(event['id'])
+        track = event_manager.add_track(event['id'], first['id'], 'song.mp3', 'Artist A')
+        assert event_manager.get_track_by_filename(event['id'], first['id'], 'song.mp3')['id'] == track['id']
+        assert event_manager.get_track_by_filename(event['id'], second['id'], 'song.mp3') is None
+
+        event_manager.update_track(event['id'], first['id'], track['id'], {'filename': 'renamed.mp3'})
+        assert event_manager.get_track_by_filename(event['id'], first['id'], 'song.mp3') is None
+        assert event_manager.get_track_by_filename(event['id'], first['id'], 'renamed.mp3')['id'] == track['id']
+
+        assert event_manager.delete_track(event['id'], first['id'], track['id'])
+        assert event_manager.get_track_by_filename(event['id'], first['id'], 'renamed.mp3') is None
+
+    def test_delete_and_reorder_keep_index_consistent(self, event_manager, event):
+        """Deleting then reordering preserves every remaining record"""
+        first, second = event_manager.load_event_performances(event['id'])
+        third = event_manager.create_performance(event['id'], 'Encore')
+
+        assert event_manager.delete_performance(event['id'], second['id'])
+        assert event_manager.reorder_performances(event['id'], [third['id']])
+
+        performances = event_manager.load_event_performances(event['id'])
+        assert [p['id'] for p in performances] == [first['id'], third['id']]
+        assert event_manager.get_performance(event['id'], second['id']) is None
+        # Alone in the list, it is already in place
+        assert event_manager.get_performance(event['id'], third['id'])['order'] == 2
+
+    def test_break_reorder_preserves_unlisted_breaks(self, event_manager, event):
+        """reorder_breaks only touches listed breaks, without giving two the same order"""
+        breaks = [event_manager.create_break(event['id'], f'Break {i}', 'Lunch') for i in range(3)]
+
+        event_manager.reorder_breaks(event['id'], [breaks[2]['id']])
+
+        assert [b['order'] for b in event_manager.load_event_breaks(event['id'])] == [0, 1, 2]
+        assert event_manager.delete_break(event['id'], breaks[1]['id'])
+        assert event_manager.get_break(event['id'], breaks[1]['id']) is None
+
+
+@pytest.mark.unit
+class TestEventStats:
+    """Denormalized counters kept on each event"""
+
+    def test_counters_follow_mutations(self, event_manager, event):
+        first, second = event_manager.load_event_performances(event['id'])
+        event_manager.add_track(event['id'], first['id'], 'a.mp3', 'Artist A')
+        track = event_manager.add_track(event['id'], first['id'], 'b.mp3', 'Artist A')
+        event_manager.update_track(event['id'], first['id'], track['id'], {'duration': 95})
+        event_manager.update_track_completion(event['id'], first['id'], track['id'], True)
+        event_manager.update_performance(event['id'], second['id'], {'isDone': True})
+        event_manager.create_break(event['id'], 'Lunch', 'Lunch')
+
+        assert event_manager.get_event_stats(event['id']) == {
+            'performanceCount': 2, 'performancesDone': 1, 'trackCount': 2,
+            'tracksCompleted': 1, 'totalDuration': 95, 'breakCount': 1, 'breaksDone': 0,
+        }
+
+        event_manager.delete_performance(event['id'], first['id'])
+        stats = event_manager.get_event_stats(event['id'])
+        assert (stats['performanceCount'], stats['trackCount'], stats['totalDuration']) == (1, 0, 0)
+
+    def test_listing_does_not_read_event_data(self, client, event_manager, event, mocker):
+        load = mocker.spy(event_manager.storage, 'load')
+
+        response = client.get('/api/events')
+
+        assert response.get_json()[0]['performanceCount'] == 2
+        assert load.call_count == 0
+
+    def test_counters_are_persisted(self, event_manager, event):
+        from app import EventManager
+
+        reopened = EventManager(config_dir=event_manager.config_dir)
+        assert reopened.get_event(event['id'])['stats']['performanceCount'] == 2
+        reopened.close()
+
+    def test_legacy_event_is_backfilled_once(self, event_manager, event, mocker):
+        del event_manager.get_event(event['id'])['stats']
+
+        assert event_manager.get_event_summary(event['id'])['performanceCount'] == 2
+        load = mocker.spy(event_manager.storage, 'load')
+        event_manager.get_event_summary(event['id'])
+        assert load.call_count == 0
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def workers(request, temp_dir):
+    """Two EventManagers on one data directory, like two server worker processes"""
+    managers = [EventManager(config_dir=temp_dir, storage=request.param) for _ in range(2)]
+    yield managers
+    for manager in managers:
+        manager.close()
+
+
+@pytest.mark.unit
+class TestWorkerCoherence:
+    """Each worker sees changes made by the others"""
+
+    def test_sync_reloads_changed_event_list(self, workers):
+        first, second = workers
+        assert first.sync() is False
+
+        event = second.create_event('Gala')
+
+        assert first.sync() is True
+        assert first.get_event(event['id'])['name'] == 'Gala'
+        assert first.sync() is False
+
+    def test_interleaved_event_writes_are_not_lost(self, workers):
+        first, second = workers
+        gala = first.create_event('Gala')
+        recital = first.create_event('Recital')
+        second.sync()
+
+        second.update_event(gala['id'], {'name': 'Spring Gala'})
+        first.update_event(recital['id'], {'name': 'Piano Recital'})
+
+        first.sync()
+        assert first.get_event(gala['id'])['name'] == 'Spring Gala'
+        second.sync()
+        assert second.get_event(recital['id'])['name'] == 'Piano Recital'
+
+    def test_interleaved_record_writes_are_not_lost(self, workers):
+        first, second = workers
+        event = first.create_event('Gala')
+        second.sync()
+        first.load_event_performances(event['id'])
+        second.load_event_performances(event['id'])
+
+        second.create_performance(event['id'], 'Opening', 'Asha')
+        first.create_performance(event['id'], 'Closing', 'Ravi')
+
+        for manager in workers:
+            assert {p['name'] for p in manager.load_event_performances(event['id'])} == {'Opening', 'Closing'}
+
+    def test_requests_see_other_workers_changes(self, workers, monkeypatch):
+        import app as app_module
+        first, second = workers
+        monkeypatch.setattr(app_module, 'em', first)
+        client = app_module.app.test_client()
+        assert client.get('/api/events').get_json() == []
+
+        event = second.create_event('Gala')
+        second.delete_event(second.create_event('Scratch')['id'])
+
+        assert [e['id'] for e in client.get('/api/events').get_json()] == [event['id']]
+
+
+@pytest.mark.unit
+class TestTransactions:
+    """Read-modify-write of one event is atomic across threads and workers"""
+
+    def test_concurrent_track_uploads_are_not_lost(self, workers):
+        first, second = workers
+        event = first.create_event('Gala')
+        performance = first.create_performance(event['id'], 'Opening', 'Asha')
+
+        def upload(i):
+            manager = workers[i % 2]
+            return manager.add_track(event['id'], performance['id'], f'track-{i}.mp3', 'Asha')
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            added = list(pool.map(upload, range(40)))
+
+        assert all(added)
+        for manager in workers:
+            tracks = manager.get_performance(event['id'], performance['id'])['tracks']
+            assert sorted(t['filename'] for t in tracks) == sorted(f'track-{i}.mp3' for i in range(40))
+        first.sync()
+        assert first.get_event_stats(event['id'])['trackCount'] == 40
+
+    def test_transaction_blocks_writers_of_the_same_event_only(self, workers):
+        first, second = workers
+        gala = first.create_event('Gala')
+        recital = first.create_event('Recital')
+        second.sync()
+
+        done = {}
+        def rename(event_id):
+            second.update_event(event_id, {'name': 'Renamed'})
+            done[event_id] = True
+
+        with first.transaction(gala['id']):
+            blocked = threading.Thread(target=rename, args=(gala['id'],))
+            blocked.start()
+            rename(recital['id'])
+            blocked.join(0.2)
+            assert done == {recital['id']: True}
+        blocked.join(1)
+        assert gala['id'] in done
+
+    def test_transaction_is_reentrant(self, event_manager, event):
+        with event_manager.transaction(event['id']):
+            with event_manager.transaction(event['id']):
+                event_manager.update_event(event['id'], {'name': 'Nested'})
+        assert event_manager.get_event(event['id'])['name'] == 'Nested'
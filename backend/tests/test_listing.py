@@ -0,0 +1,83 @@
+"""
+Tests for paginated, filtered and projected list endpoints
+"""
+
+import pytest
+
+
+@pytest.fixture
+def show(event_manager):
+    """An event with six performances of mixed type/mode and two tracks on the first"""
+    event = event_manager.create_event('Gala')
+    specs = [('Song', 'Solo', 'Asha'), ('Dance', 'Group', 'Ravi'), ('Song', 'Duet', 'Asha & Mira'),
+             ('Recitation', 'Solo', 'Kiran'), ('Dance', 'Solo', 'Mira'), ('Song', 'Group', 'Choir')]
+    performances = [event_manager.create_performance(event['id'], f'Act {i}', performer, perf_type, mode)
+                    for i, (perf_type, mode, performer) in enumerate(specs)]
+    for name in ('intro.mp3', 'main.mp3'):
+        event_manager.add_track(event['id'], performances[0]['id'], name, 'Asha')
+    event_manager.update_performance(event['id'], performances[1]['id'], {'isDone': True})
+    # Listing sorts by order, not storage position
+    event_manager.reorder_performances(event['id'], [p['id'] for p in reversed(performances)])
+    return event, performances
+
+
+@pytest.mark.unit
+class TestListingEndpoints:
+
+    def test_unfiltered_listing_is_sorted_by_order(self, client, show):
+        event, performances = show
+        response = client.get(f"/api/events/{event['id']}/performances")
+
+        assert [p['id'] for p in response.get_json()] == [p['id'] for p in reversed(performances)]
+        assert response.headers['X-Total-Count'] == '6'
+
+    def test_filters(self, client, show):
+        event, _ = show
+        url = f"/api/events/{event['id']}/performances"
+
+        assert len(client.get(f'{url}?isDone=true').get_json()) == 1
+        assert {p['type'] for p in client.get(f'{url}?type=Song,Dance&mode=Solo').get_json()} == {'Song', 'Dance'}
+        assert [p['performer'] for p in client.get(f'{url}?performer=mira&type=Song').get_json()] == ['Asha & Mira']
+
+    def test_cursor_pagination_walks_every_record_once(self, client, show):
+        event, performances = show
+        url = f"/api/events/{event['id']}/performances?limit=4"
+
+        first = client.get(url)
+        second = client.get(f"{url}&cursor={first.headers['X-Next-Cursor']}")
+
+        ids = [p['id'] for p in first.get_json() + second.get_json()]
+        assert ids == [p['id'] for p in reversed(performances)]
+        assert 'X-Next-Cursor' not in second.headers
+
+    def test_offset_pagination(self, client, show):
+        event, performances = show
+        page = client.get(f"/api/events/{event['id']}/performances?limit=2&offset=2").get_json()
+        assert [p['id'] for p in page] == [performances[3]['id'], performances[2]['id']]
+
+    def test_field_projection(self, client, show):
+        event, performances = show
+        url = f"/api/events/{event['id']}/performances?fields=id,order,tracks.filename&performer=asha"
+
+        running_order = client.get(url).get_json()
+
+        first = next(p for p in running_order if p['id'] == performances[0]['id'])
+        # Reversing kept the first performance's order and moved the others before it
+        assert first == {'id': performances[0]['id'], 'order': 0,
+                         'tracks': [{'filename': 'intro.mp3'}, {'filename': 'main.mp3'}]}
+
+    def test_breaks_and_events_support_listing(self, client, event_manager, show):
+        event, _ = show
+        for i in range(3):
+            event_manager.create_break(event['id'], f'Break {i}', 'Lunch')
+        event_manager.create_event('Second gala')
+
+        breaks = client.get(f"/api/events/{event['id']}/breaks?limit=2&fields=id,name").get_json()
+        assert breaks == [{'id': b['id'], 'name': b['name']} for b in event_manager.load_event_breaks(event['id'])[:2]]
+        events = client.get('/api/events?fields=id,performanceCount').get_json()
+        assert sorted(e['performanceCount'] for e in events) == [0, 6]
+
+    @pytest.mark.parametrize('query', ['limit=0', 'limit=x', 'isDone=maybe', 'cursor=%%%', 'cursor=abc&offset=2'])
+    def test_invalid_parameters(self, client, show, query):
+        event, _ = show
+        assert client.get(f"/api/events/{event['id']}/performances?{query}").status_code == 400
@@ -0,0 +1,209 @@
+"""
+Tests for loudness analysis and normalization gain
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+import loudness
+import metadata
+from app import EventManager
+from conftest import install_ffmpeg, square_wav, upload
+
+pytestmark = pytest.mark.usefixtures('no_ffmpeg')
+
+
+# Prints the summary of ffmpeg's ebur128 filter
+FAKE_FFMPEG = f'''#!{sys.executable}
+import sys
+sys.stderr.write("""[Parsed_ebur128_0 @ 0x1] t: 1.0 M: -20.0 S: -20.0 I: -20.0 LUFS
+[Parsed_ebur128_0 @ 0x1] Summary:
+
+  Integrated loudness:
+    I:         -23.5 LUFS
+    Threshold: -33.7 LUFS
+
+  True peak:
+    Peak:       -3.2 dBFS
+""")
+'''
+
+
+@pytest.fixture
+def performances(event_manager):
+    event = event_manager.create_event('Gala')
+    return event['id'], [event_manager.create_performance(event['id'], name, 'Asha')['id']
+                         for name in ('Opening', 'Finale')]
+
+
+@pytest.mark.unit
+class TestAnalyzeLoudness:
+
+    def test_square_wave(self, temp_dir):
+        path = temp_dir / 'song.wav'
+        path.write_bytes(square_wav([(3, 0.5)]))
+
+        measured = loudness.analyze_loudness(path)
+        # Mean square 0.25: -0.691 + 10 * log10(0.25)
+        assert measured['loudness'] == pytest.approx(-6.71, abs=0.02)
+        assert measured['truePeak'] == pytest.approx(-6.02, abs=0.02)
+
+    def test_stereo_adds_the_channels(self, temp_dir):
+        path = temp_dir / 'song.wav'
+        path.write_bytes(square_wav([(3, 0.5)], channels=2))
+
+        assert loudness.analyze_loudness(path)['loudness'] == pytest.approx(-6.71 + 3.01, abs=0.02)
+
+    def test_quiet_passages_are_gated(self, temp_dir):
+        path = temp_dir / 'song.wav'
+        # 40 dB below the rest: under the relative gate, so it does not lower the result
+        # (apart from the blocks that overlap the change); averaged in it would give -9.7
+        path.write_bytes(square_wav([(3, 0.5), (3, 0.005), (1, 0)]))
+
+        assert loudness.analyze_loudness(path)['loudness'] == pytest.approx(-6.71, abs=0.3)
+
+    def test_silence_gets_no_gain(self, temp_dir):
+        path = temp_dir / 'song.wav'
+        path.write_bytes(square_wav([(2, 0)]))
+
+        measured = loudness.analyze_loudness(path)
+        assert measured == {'loudness': None, 'truePeak': None}
+        assert loudness.loudness_updates(measured)['gain'] == 0
+
+    def test_gain_keeps_the_peak_under_the_ceiling(self):
+        updates = loudness.loudness_updates({'loudness': -30.0, 'truePeak': -6.0})
+        assert updates['gain'] == loudness.PEAK_CEILING + 6.0
+        assert updates['loudnessStatus'] == 'ready'
+
+        assert loudness.loudness_updates({'loudness': -10.0, 'truePeak': -1.0})['gain'] == loudness.LOUDNESS_TARGET + 10.0
+        assert loudness.loudness_updates({}) == {'loudnessStatus': 'failed'}
+
+    def test_ffmpeg_summary_is_parsed(self, temp_dir, monkeypatch):
+        install_ffmpeg(temp_dir, FAKE_FFMPEG, monkeypatch)
+        path = temp_dir / 'song.mp3'
+        path.write_bytes(b'audio')
+
+        assert loudness.analyze_loudness(path) == {'loudness': -23.5, 'truePeak': -3.2}
+
+
+@pytest.mark.unit
+class TestTrackLoudness:
+
+    def test_upload_is_measured_in_the_background(self, client, event_manager, performances):
+        event_id, (performance_id, _) = performances
+        track = upload(client, event_id, performance_id, square_wav([(3, 0.5)]), 'song.wav')
+        assert track['loudnessStatus'] == 'pending'
+
+        event_manager.loudness.wait()
+        stored = event_manager.get_performance(event_id, performance_id)['tracks'][0]
+        assert stored['loudnessStatus'] == 'ready'
+        assert stored['loudness'] == pytest.approx(-6.71, abs=0.02)
+        assert stored['gain'] == pytest.approx(loudness.LOUDNESS_TARGET + 6.71, abs=0.02)
+
+    def test_same_content_is_measured_once(self, client, event_manager, performances, monkeypatch):
+        event_id, (first, second) = performances
+        data = square_wav([(3, 0.5)])
+        upload(client, event_id, first, data, 'song.wav')
+        event_manager.loudness.wait()
+
+        monkeypatch.setattr(loudness, '_wav_loudness', lambda path: pytest.fail('measured again'))
+        track = upload(client, event_id, second, data, 'song.wav')
+        assert track['loudnessStatus'] == 'ready'
+        assert track['loudness'] == pytest.approx(-6.71, abs=0.02)
+
+    def test_undecodable_file_fails(self, client, event_manager, performances):
+        event_id, (performance_id, _) = performances
+        upload(client, event_id, performance_id, b'not audio', 'song.mp3')
+
+        event_manager.loudness.wait()
+        stored = event_manager.get_performance(event_id, performance_id)['tracks'][0]
+        assert stored['loudnessStatus'] == 'failed'
+        assert 'gain' not in stored
+
+    def test_failure_is_not_cached(self, client, event_manager, performances, monkeypatch):
+        event_id, (first, second) = performances
+        data = square_wav([(3, 0.5)])
+        measure = loudness._wav_loudness
+        failing = [True]
+
+        def flaky(path):
+            # A temporary failure, e.g. an ffmpeg timeout
+            if failing:
+                raise OSError('timed out')
+            return measure(path)
+
+        monkeypatch.setattr(loudness, '_wav_loudness', flaky)
+        upload(client, event_id, first, data, 'song.wav')
+        event_manager.loudness.wait()
+        assert event_manager.get_performance(event_id, first)['tracks'][0]['loudnessStatus'] == 'failed'
+
+        failing.clear()
+        track = upload(client, event_id, second, data, 'song.wav')
+        event_manager.loudness.wait()
+        assert track['loudnessStatus'] == 'pending'
+        assert event_manager.get_performance(event_id, second)['tracks'][0]['loudnessStatus'] == 'ready'
+
+    def test_rescan_measures_older_tracks(self, client, event_manager, performances):
+        event_id, (performance_id, _) = performances
+        performance_dir = event_manager.get_performance_dir(event_id, performance_id)
+        performance_dir.mkdir(parents=True, exist_ok=True)
+        (performance_dir / 'old.wav').write_bytes(square_wav([(3, 0.5)]))
+        # Added without a file, as before loudness analysis existed
+        track = event_manager.add_track(event_id, performance_id, 'old.wav', 'Asha')
+        assert 'loudnessStatus' not in track
+
+        client.post(f'/api/events/{event_id}/rescan')
+        event_manager.loudness.wait()
+        stored = event_manager.get_performance(event_id, performance_id)['tracks'][0]
+        assert stored['loudnessStatus'] == 'ready'
+
+    def test_pending_tracks_are_requeued_after_restart(self, event_manager, performances, temp_dir):
+        event_id, (performance_id, _) = performances
+        performance_dir = event_manager.get_performance_dir(event_id, performance_id)
+        performance_dir.mkdir(parents=True, exist_ok=True)
+        (performance_dir / 'old.wav').write_bytes(square_wav([(3, 0.5)]))
+        # A job lost with the process that queued it
+        track = event_manager.add_track(event_id, performance_id, 'old.wav', 'Asha')
+        event_manager.update_track(event_id, performance_id, track['id'], {'loudnessStatus': 'pending'})
+        old = time.time() - metadata.STALE_PENDING_SECONDS - 60
+        os.utime(performance_dir / 'old.wav', (old, old))
+
+        restarted = EventManager(config_dir=temp_dir)
+        try:
+            assert restarted.get_performance(event_id, performance_id)
+            restarted.loudness.wait()
+            stored = restarted.get_performance(event_id, performance_id)['tracks'][0]
+            assert stored['loudnessStatus'] == 'ready'
+            assert stored['loudness'] == pytest.approx(-6.71, abs=0.02)
+        finally:
+            restarted.close()
+
+    def test_rescan_leaves_unchanged_failures_alone(self, client, event_manager, performances, monkeypatch):
+        event_id, (performance_id, _) = performances
+        performance_dir = event_manager.get_performance_dir(event_id, performance_id)
+        performance_dir.mkdir(parents=True, exist_ok=True)
+        path = performance_dir / 'old.wav'
+        path.write_bytes(b'not audio')
+        event_manager.add_track(event_id, performance_id, 'old.wav', 'Asha')
+
+        client.post(f'/api/events/{event_id}/rescan')
+        event_manager.loudness.wait()
+        assert event_manager.get_performance(event_id, performance_id)['tracks'][0]['loudnessStatus'] == 'failed'
+
+        version = event_manager.get_event(event_id)['version']
+        cache = event_manager.loudness.cache
+        measure = cache.extractor
+        monkeypatch.setattr(cache, 'extractor', lambda path: pytest.fail('measured again'))
+        assert client.post(f'/api/events/{event_id}/rescan').get_json()['updated'] == 0
+        event_manager.loudness.wait()
+        assert event_manager.get_event(event_id)['version'] == version
+
+        # A replaced file is measured again
+        monkeypatch.setattr(cache, 'extractor', measure)
+        path.write_bytes(square_wav([(3, 0.5)]))
+        client.post(f'/api/events/{event_id}/rescan')
+        event_manager.loudness.wait()
+        assert event_manager.get_performance(event_id, performance_id)['tracks'][0]['loudnessStatus'] == 'ready'
@@ -0,0 +1,213 @@
+"""
+Tests for background audio metadata extraction
+"""
+
+import os
+import time
+from io import BytesIO
+
+import pytest
+
+import metadata
+from app import EventManager
+from conftest import square_wav, upload
+
+
+@pytest.fixture
+def performance(event_manager):
+    event = event_manager.create_event('Gala')
+    performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+    return event, performance
+
+
+@pytest.mark.unit
+class TestExtractMetadata:
+
+    def test_reads_audio_properties(self, temp_dir):
+        path = temp_dir / 'tone.wav'
+        path.write_bytes(square_wav([(2, 0)], channels=2))
+
+        assert metadata.extract_metadata(path) == {
+            'duration': 2,
+            'bitrate': 8000 * 16 * 2,
+            'sampleRate': 8000,
+            'channels': 2,
+            'codec': 'wave',
+        }
+
+    def test_unreadable_file_gives_nothing(self, temp_dir):
+        path = temp_dir / 'noise.mp3'
+        path.write_bytes(b'not audio at all')
+        assert metadata.extract_metadata(path) == {}
+
+
+@pytest.mark.unit
+class TestMetadataQueue:
+
+    def test_upload_returns_pending_then_track_is_patched(self, client, event_manager, performance):
+        event, perf = performance
+        assert upload(client, event['id'], perf['id'], square_wav([(2, 0)]), 'tone.wav')['metadataStatus'] == 'pending'
+
+        event_manager.metadata.wait()
+        track = event_manager.get_performance(event['id'], perf['id'])['tracks'][0]
+        assert track['metadataStatus'] == 'ready'
+        assert track['duration'] == 2
+        assert track['sampleRate'] == 8000
+        assert track['channels'] == 1
+
+    def test_unparseable_upload_is_marked_failed(self, client, event_manager, performance):
+        event, perf = performance
+        upload(client, event['id'], perf['id'], b'garbage', 'song.mp3')
+
+        event_manager.metadata.wait()
+        track = event_manager.get_performance(event['id'], perf['id'])['tracks'][0]
+        assert track['metadataStatus'] == 'failed'
+        assert 'duration' not in track
+
+    def test_batch_upload_is_extracted_off_the_request(self, client, event_manager, performance, monkeypatch):
+        event, perf = performance
+        calls = []
+        original = metadata.extract_metadata
+
+        def slow_extract(path):
+            time.sleep(0.2)
+            calls.append(path.name)
+            return original(path)
+
+        monkeypatch.setattr(metadata, 'extract_metadata', slow_extract)
+        began = time.perf_counter()
+        response = client.post(f"/api/events/{event['id']}/performances/{perf['id']}/tracks",
+                               data={'files': [(BytesIO(square_wav([(i + 1, 0)])), f'{i}.wav') for i in range(4)],
+                                     'performer': 'Asha'})
+        assert response.status_code == 201
+        assert time.perf_counter() - began < 0.4
+
+        event_manager.metadata.wait()
+        assert sorted(calls) == ['0.wav', '1.wav', '2.wav', '3.wav']
+        tracks = event_manager.get_performance(event['id'], perf['id'])['tracks']
+        assert all(t['metadataStatus'] == 'ready' for t in tracks)
+
+    def test_deleted_track_is_not_recreated(self, event_manager, performance, temp_dir):
+        event, perf = performance
+        path = event_manager.get_performance_dir(event['id'], perf['id'])
+        path.mkdir(parents=True, exist_ok=True)
+        (path / 'tone.wav').write_bytes(square_wav([(2, 0)]))
+        track = event_manager.add_track(event['id'], perf['id'], 'tone.wav', 'Asha', path / 'tone.wav')
+        event_manager.delete_track(event['id'], perf['id'], track['id'])
+
+        event_manager.metadata.wait()
+        assert event_manager.get_performance(event['id'], perf['id'])['tracks'] == []
+
+    def test_pending_tracks_are_requeued_after_restart(self, event_manager, performance, temp_dir):
+        event, perf = performance
+        path = event_manager.get_performance_dir(event['id'], perf['id'])
+        path.mkdir(parents=True, exist_ok=True)
+        (path / 'tone.wav').write_bytes(square_wav([(2, 0)]))
+        # A job lost with the process that queued it
+        event_manager.add_track(event['id'], perf['id'], 'tone.wav', 'Asha')
+        track = event_manager.get_performance(event['id'], perf['id'])['tracks'][0]
+        event_manager.update_track(event['id'], perf['id'], track['id'], {'metadataStatus': 'pending'})
+        old = time.time() - metadata.STALE_PENDING_SECONDS - 60
+        os.utime(path / 'tone.wav', (old, old))
+
+        restarted = EventManager(config_dir=temp_dir)
+        try:
+            assert restarted.get_performance(event['id'], perf['id'])
+            restarted.metadata.wait()
+            track = restarted.get_performance(event['id'], perf['id'])['tracks'][0]
+            assert track['metadataStatus'] == 'ready'
+            assert track['duration'] == 2
+        finally:
+            restarted.close()
+
+
+@pytest.fixture
+def counted_extract(monkeypatch):
+    calls = []
+    original = metadata.extract_metadata
+
+    def extract(path):
+        calls.append(path.name)
+        return original(path)
+
+    monkeypatch.setattr(metadata, 'extract_metadata', extract)
+    return calls
+
+
+@pytest.mark.unit
+class TestMetadataCache:
+
+    def test_file_is_parsed_once(self, temp_dir, counted_extract):
+        path = temp_dir / 'tone.wav'
+        path.write_bytes(square_wav([(2, 0)]))
+        cache = metadata.MetadataCache(temp_dir / metadata.METADATA_DIR)
+
+        first = cache.extract(path)
+        assert cache.extract(path) == first
+        # Persistent: another process finds the entry
+        assert metadata.MetadataCache(temp_dir / metadata.METADATA_DIR).lookup(path) == first
+        assert counted_extract == ['tone.wav']
+
+    def test_changed_file_is_parsed_again(self, temp_dir, counted_extract):
+        path = temp_dir / 'tone.wav'
+        path.write_bytes(square_wav([(2, 0)]))
+        cache = metadata.MetadataCache(temp_dir / metadata.METADATA_DIR)
+        cache.extract(path)
+
+        path.write_bytes(square_wav([(3, 0)]))
+        assert cache.lookup(path) is None
+        assert cache.extract(path)['duration'] == 3
+        assert len(counted_extract) == 2
+
+    def test_memory_front_is_bounded(self, temp_dir):
+        cache = metadata.MetadataCache(temp_dir / metadata.METADATA_DIR, size=2)
+        for key in ('a' * 64, 'b' * 64, 'c' * 64):
+            cache.put(key, {'duration': 1})
+
+        assert list(cache._memory) == ['b' * 64, 'c' * 64]
+        assert cache.get('a' * 64) == {'duration': 1}
+
+    def test_repeated_upload_is_ready_at_once(self, client, event_manager, performance, counted_extract):
+        event, perf = performance
+        upload(client, event['id'], perf['id'], square_wav([(2, 0)]), 'tone.wav')
+        event_manager.metadata.wait()
+
+        track = upload(client, event['id'], perf['id'], square_wav([(2, 0)]), 'again.wav')
+        assert track['metadataStatus'] == 'ready'
+        assert track['duration'] == 2
+        assert counted_extract == ['tone.wav']
+
+
+@pytest.mark.unit
+class TestRescanEvent:
+
+    def add_files(self, event_manager, event_id, performance_id, count):
+        performance_dir = event_manager.get_performance_dir(event_id, performance_id)
+        performance_dir.mkdir(parents=True, exist_ok=True)
+        for i in range(count):
+            (performance_dir / f'{i}.wav').write_bytes(square_wav([(i + 1, 0)]))
+            event_manager.add_track(event_id, performance_id, f'{i}.wav', 'Asha')
+        return performance_dir
+
+    def test_rescan_parses_only_changed_files(self, client, event_manager, performance, counted_extract):
+        event, perf = performance
+        performance_dir = self.add_files(event_manager, event['id'], perf['id'], 3)
+        url = f"/api/events/{event['id']}/rescan"
+
+        assert client.post(url).get_json() == {'tracks': 3, 'updated': 3, 'parsed': 3, 'missing': 0}
+        tracks = event_manager.get_performance(event['id'], perf['id'])['tracks']
+        assert [t['duration'] for t in tracks] == [1, 2, 3]
+        assert all(t['metadataStatus'] == 'ready' for t in tracks)
+        # Loudness measured in the meantime would count as an update
+        event_manager.loudness.wait()
+
+        assert client.post(url).get_json() == {'tracks': 3, 'updated': 0, 'parsed': 0, 'missing': 0}
+
+        (performance_dir / '1.wav').write_bytes(square_wav([(5, 0)]))
+        (performance_dir / '2.wav').unlink()
+        assert client.post(url).get_json() == {'tracks': 3, 'updated': 1, 'parsed': 1, 'missing': 1}
+        assert event_manager.get_performance(event['id'], perf['id'])['tracks'][1]['duration'] == 5
+        assert len(counted_extract) == 4
+
+    def test_rescan_unknown_event(self, client):
+        assert client.post('/api/events/missing/rescan').status_code == 404
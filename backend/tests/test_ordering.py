@@ -0,0 +1,164 @@
+"""
+Tests for fractional running order and its background rebalancing
+"""
+
+import pytest
+
+import ordering
+from app import EventManager
+from listing import order_key
+
+
+def records(*orders):
+    return [{'id': str(i), 'order': order} for i, order in enumerate(orders)]
+
+
+def running_order(items):
+    return [r['id'] for r in sorted(items, key=order_key)]
+
+
+@pytest.fixture
+def lineup(event_manager):
+    event = event_manager.create_event('Gala')
+    ids = [event_manager.create_performance(event['id'], f'Act {i}', 'Asha')['id'] for i in range(5)]
+    return event['id'], ids
+
+
+@pytest.mark.unit
+class TestArrange:
+
+    def test_one_move_writes_one_record(self):
+        items = records(0, 1, 2, 3, 4)
+
+        changed = ordering.arrange(items, ['0', '4', '1', '2', '3'])
+        assert changed == [items[4]]
+        assert items[4]['order'] == 0.5
+        assert running_order(items) == ['0', '4', '1', '2', '3']
+
+    def test_moves_to_the_ends_use_whole_numbers(self):
+        items = records(0, 1, 2)
+
+        assert ordering.arrange(items, ['1', '2', '0']) == [items[0]]
+        assert items[0]['order'] == 3
+        assert ordering.arrange(items, ['0', '1', '2']) == [items[0]]
+        assert [r['order'] for r in items] == [0, 1, 2]
+
+    def test_unlisted_records_keep_their_place(self):
+        # '1' and '3' are done and left out, as the web interface does
+        items = records(0, 1, 2, 3, 4)
+
+        changed = ordering.arrange(items, ['4', '0', '2'])
+        assert changed == [items[4]]
+        assert running_order(items) == ['4', '0', '1', '2', '3']
+        assert not ordering.needs_rebalance(items)
+
+    def test_unknown_and_repeated_ids_are_ignored(self):
+        items = records(0, 1)
+        assert ordering.arrange(items, ['missing', '1', '0', '1']) == [items[1]]
+        assert running_order(items) == ['1', '0']
+
+    def test_list_is_renumbered_when_there_is_no_room(self):
+        items = records(0, ordering.MIN_GAP * 1.5, 5)
+
+        changed = ordering.arrange(items, ['0', '2', '1'])
+        assert running_order(items) == ['0', '2', '1']
+        assert [r['order'] for r in items] == [0, 1, 0.5]
+        assert {r['id'] for r in changed} == {'1', '2'}
+
+
+@pytest.mark.unit
+class TestRebalance:
+
+    def test_needs_rebalance(self):
+        assert not ordering.needs_rebalance(records(0, 0.5, 7))
+        assert ordering.needs_rebalance(records(0, 1, 1))
+        assert ordering.needs_rebalance(records(0, ordering.MIN_GAP / 2))
+        assert ordering.needs_rebalance(records(0, None))
+
+    def test_rebalance_keeps_running_order(self):
+        items = records(3, 0.25, 0.25, -2)
+
+        changed = ordering.rebalance(items)
+        assert [r['order'] for r in items] == [3, 1, 2, 0]
+        assert {r['id'] for r in changed} == {'1', '2', '3'}
+        assert ordering.rebalance(items) == []
+
+    def test_next_order(self):
+        assert ordering.next_order([]) == 0
+        assert ordering.next_order(records(0, 2.5, None)) == 3
+
+
+@pytest.mark.unit
+class TestEventOrdering:
+
+    def test_orders_too_close_are_rebalanced(self, event_manager, lineup):
+        event_id, ids = lineup
+        event_manager.update_performance(event_id, ids[4], {'order': ordering.MIN_GAP / 4})
+
+        event_manager.rebalancer.wait()
+        performances = event_manager.load_event_performances(event_id)
+        assert sorted(p['order'] for p in performances) == [0, 1, 2, 3, 4]
+        assert running_order(performances) == [ids[0], ids[4]] + ids[1:4]
+
+    def test_repeated_moves_into_one_gap_keep_room(self, event_manager, lineup):
+        event_id, _ = lineup
+        # Each move lands between the first performance and the one moved last
+        for _ in range(50):
+            current = running_order(event_manager.load_event_performances(event_id))
+            event_manager.reorder_performances(event_id, current[:1] + current[-1:] + current[1:-1])
+            expected = current[:1] + current[-1:] + current[1:-1]
+
+        event_manager.rebalancer.wait()
+        performances = event_manager.load_event_performances(event_id)
+        assert running_order(performances) == expected
+        assert not ordering.needs_rebalance(performances)
+
+    def test_integer_ties_are_migrated_on_load(self, event_manager, lineup, temp_dir):
+        event_id, ids = lineup
+        performances = event_manager.load_event_performances(event_id)
+        for performance in performances[3:]:
+            performance['order'] = 0
+        event_manager.storage.save(event_id, 'performances', performances)
+        expected = running_order(performances)
+
+        # A new process (a restart) loads the old orders
+        other = EventManager(config_dir=temp_dir)
+        try:
+            other.load_event_performances(event_id)
+            other.rebalancer.wait()
+            migrated = other.load_event_performances(event_id)
+        finally:
+            other.close()
+        assert sorted(p['order'] for p in migrated) == [0, 1, 2, 3, 4]
+        assert running_order(migrated) == expected
+
+    def test_unchanged_order_writes_nothing(self, event_manager, lineup):
+        event_id, ids = lineup
+        breaks = [event_manager.create_break(event_id, f'Break {i}', 'Lunch')['id'] for i in range(3)]
+        version = event_manager.get_event(event_id)['version']
+        feed = event_manager.changes.path(event_id)
+        size = feed.stat().st_size
+
+        assert event_manager.reorder_performances(event_id, ids)
+        event_manager.reorder_breaks(event_id, breaks)
+        assert event_manager.get_event(event_id)['version'] == version
+        assert feed.stat().st_size == size
+
+    def test_move_request_writes_one_record(self, client, event_manager, lineup):
+        event_id, ids = lineup
+
+        response = client.post(f'/api/events/{event_id}/performances/reorder', json={'id': ids[4], 'after': ids[0]})
+        assert response.status_code == 200
+        assert [p['id'] for p in response.get_json()['changed']] == [ids[4]]
+        assert running_order(event_manager.load_event_performances(event_id)) == [ids[0], ids[4]] + ids[1:4]
+
+        assert client.post(f'/api/events/{event_id}/performances/reorder',
+                           json={'id': ids[0], 'before': 'missing'}).status_code == 404
+
+    def test_break_move_request(self, client, event_manager, lineup):
+        event_id, _ = lineup
+        breaks = [event_manager.create_break(event_id, f'Break {i}', 'Lunch')['id'] for i in range(3)]
+
+        response = client.post(f'/api/events/{event_id}/breaks/reorder', json={'id': breaks[0]})
+        assert [b['id'] for b in response.get_json()['changed']] == [breaks[0]]
+        assert running_order(event_manager.load_event_breaks(event_id)) == breaks[1:] + breaks[:1]
@@ -0,0 +1,138 @@
+"""
+Tests for waveform peaks
+"""
+
+import math
+
+import pytest
+
+import peaks
+from conftest import square_wav, upload
+
+pytestmark = pytest.mark.usefixtures('no_ffmpeg')
+
+
+def tone_wav(seconds=3, rate=8000, channels=1, width=2):
+    """A 1 s silence then a full-scale square wave"""
+    return square_wav([(1, 0), (seconds - 1, 1.0)], rate, channels, width)
+
+
+@pytest.fixture
+def track(client, event_manager):
+    event = event_manager.create_event('Gala')
+    performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+    # Under werkzeug's 500 KiB limit for spooling test request bodies in memory
+    track = upload(client, event['id'], performance['id'], tone_wav(seconds=20), 'tone.wav')
+    return f"/api/events/{event['id']}/performances/{performance['id']}/tracks/{track['id']}/peaks", track
+
+
+@pytest.mark.unit
+class TestComputePeaks:
+
+    def test_buckets_hold_min_and_max(self, temp_dir):
+        path = temp_dir / 'tone.wav'
+        path.write_bytes(tone_wav(seconds=3))
+
+        sample_rate, levels = peaks.compute_peaks(path)
+        per_bucket, pairs = levels[0]
+        assert sample_rate == 8000
+        assert per_bucket == peaks.SAMPLES_PER_BUCKET
+        assert len(pairs) // 2 == math.ceil(3 * 8000 / per_bucket)
+        # Silence first, then full scale
+        assert (pairs[0], pairs[1]) == (0, 0)
+        assert (pairs[-2], pairs[-1]) == (-128, 127)
+
+    def test_coarser_levels_merge_buckets(self, temp_dir):
+        path = temp_dir / 'tone.wav'
+        path.write_bytes(tone_wav(seconds=40))
+
+        _, levels = peaks.compute_peaks(path)
+        assert len(levels) > 1
+        assert len(levels[-1][1]) // 2 <= peaks.MIN_BUCKETS
+        for (fine_size, fine), (coarse_size, coarse) in zip(levels, levels[1:]):
+            assert coarse_size == fine_size * peaks.LEVEL_FACTOR
+            assert len(coarse) // 2 == math.ceil(len(fine) // 2 / peaks.LEVEL_FACTOR)
+            assert min(coarse[0::2]) == min(fine[0::2])
+            assert max(coarse[1::2]) == max(fine[1::2])
+
+    def test_stereo_and_8_bit_files(self, temp_dir):
+        path = temp_dir / 'tone.wav'
+        path.write_bytes(tone_wav(seconds=3, rate=16000, channels=2, width=1))
+
+        sample_rate, levels = peaks.compute_peaks(path)
+        per_bucket, pairs = levels[0]
+        # Buckets span the same time as for 8 kHz mono
+        assert per_bucket / sample_rate == peaks.SAMPLES_PER_BUCKET / peaks.SAMPLE_RATE
+        assert (pairs[-2], pairs[-1]) == (-128, 127)
+
+    def test_binary_format_round_trips(self, temp_dir):
+        path = temp_dir / 'tone.wav'
+        path.write_bytes(tone_wav(seconds=40))
+        sample_rate, levels = peaks.compute_peaks(path)
+
+        data = peaks.encode_peaks(sample_rate, levels)
+        assert data[:4] == b'PEAK'
+        assert peaks.decode_peaks(data) == (sample_rate, levels)
+        # Two bytes per bucket plus headers
+        assert len(data) == peaks.HEADER.size + sum(peaks.LEVEL.size + len(p) for _, p in levels)
+
+
+@pytest.mark.unit
+class TestPeaksEndpoint:
+
+    def test_peaks_are_computed_after_upload(self, client, event_manager, track):
+        url, _ = track
+        event_manager.peaks.wait()
+
+        response = client.get(url, buffered=True)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/octet-stream'
+        assert response.headers['Cache-Control'] == f'public, max-age={peaks.CACHE_MAX_AGE}'
+        sample_rate, levels = peaks.decode_peaks(response.data)
+        assert sample_rate == 8000
+        assert len(levels) > 1
+
+        etag = response.headers['ETag']
+        assert client.get(url, headers={'If-None-Match': etag}, buffered=True).status_code == 304
+
+    def test_pending_peaks_answer_202(self, client, event_manager, track):
+        url, added = track
+        event_manager.peaks.wait()
+        path = next(event_manager.config_dir.rglob('.tone.wav.peaks'))
+        path.unlink()
+
+        response = client.get(url)
+        assert response.status_code == 202
+        assert response.headers['Retry-After'] == '2'
+        event_manager.peaks.wait()
+        assert client.get(url, buffered=True).status_code == 200
+
+    def test_undecodable_file_is_reported(self, client, event_manager):
+        event = event_manager.create_event('Gala')
+        performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+        added = upload(client, event['id'], performance['id'], b'not audio', 'song.mp3')
+        event_manager.peaks.wait()
+
+        url = f"/api/events/{event['id']}/performances/{performance['id']}/tracks/{added['id']}/peaks"
+        assert client.get(url).status_code == 422
+
+    def test_unknown_track(self, client, event_manager):
+        event = event_manager.create_event('Gala')
+        performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+        assert client.get(f"/api/events/{event['id']}/performances/{performance['id']}/tracks/x/peaks").status_code == 404
+
+    def test_track_of_another_performance(self, client, event_manager, track):
+        url, _ = track
+        event_id = url.split('/')[3]
+        other = event_manager.create_performance(event_id, 'Finale', 'Asha')
+        performance_id = url.split('/')[5]
+        assert client.get(url.replace(performance_id, other['id'])).status_code == 404
+
+    def test_deleting_track_removes_peaks(self, client, event_manager, track):
+        url, added = track
+        event_manager.peaks.wait()
+        path = next(event_manager.config_dir.rglob('.tone.wav.peaks'))
+
+        event_id, performance_id = url.split('/')[3], url.split('/')[5]
+        event_manager.delete_track(event_id, performance_id, added['id'])
+        assert not path.exists()
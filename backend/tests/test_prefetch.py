@@ -0,0 +1,107 @@
+"""
+Tests for show mode cache warming and the prefetch hint
+"""
+
+import os
+from io import BytesIO
+
+import pytest
+
+import prefetch
+
+
+AUDIO = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def show(client, event_manager):
+    """An event with four performances of one track each; the second is done"""
+    event = event_manager.create_event('Gala')
+    ids = []
+    for i, name in enumerate(('Opening', 'Duet', 'Dance', 'Finale')):
+        performance = event_manager.create_performance(event['id'], name, 'Asha')
+        client.post(f"/api/events/{event['id']}/performances/{performance['id']}/upload",
+                    data={'file': (BytesIO(AUDIO + bytes([i])), f'{name}.mp3'), 'performer': 'Asha'})
+        ids.append(performance['id'])
+    event_manager.update_performance(event['id'], ids[1], {'isDone': True})
+    event_manager.metadata.wait()
+    event_manager.peaks.wait()
+    return event['id'], ids
+
+
+@pytest.fixture
+def warmed(monkeypatch):
+    paths = []
+    monkeypatch.setattr(prefetch, 'warm_file', paths.append)
+    return paths
+
+
+@pytest.mark.unit
+class TestUpcomingPerformances:
+
+    def test_current_and_next_not_done_in_running_order(self):
+        performances = [{'id': 'c', 'order': 2}, {'id': 'a', 'order': 0},
+                        {'id': 'b', 'order': 1, 'isDone': True}, {'id': 'd', 'order': 3}]
+
+        assert [p['id'] for p in prefetch.upcoming_performances(performances, 'a', 1)] == ['a', 'c']
+        assert [p['id'] for p in prefetch.upcoming_performances(performances, 'a', 5)] == ['a', 'c', 'd']
+        assert [p['id'] for p in prefetch.upcoming_performances(performances, 'd', 2)] == ['d']
+        # Before the show starts: from the first performance not done
+        assert [p['id'] for p in prefetch.upcoming_performances(performances, None, 1)] == ['a', 'c']
+        assert prefetch.upcoming_performances(performances, 'missing', 1) is None
+
+    def test_warm_file_asks_the_kernel_to_read_ahead(self, temp_dir, monkeypatch):
+        if not hasattr(os, 'posix_fadvise'):
+            pytest.skip('posix_fadvise is not available')
+        calls = []
+        monkeypatch.setattr(os, 'posix_fadvise', lambda fd, offset, length, advice: calls.append((offset, length, advice)))
+        path = temp_dir / 'song.mp3'
+        path.write_bytes(AUDIO)
+
+        prefetch.warm_file(path)
+        prefetch.warm_file(temp_dir / 'deleted.mp3')
+        assert calls == [(0, 0, os.POSIX_FADV_WILLNEED)]
+
+
+@pytest.mark.unit
+class TestShowMode:
+
+    def test_show_warms_current_and_next_performances(self, client, event_manager, show, warmed):
+        event_id, ids = show
+        response = client.post(f'/api/events/{event_id}/show', json={'performanceId': ids[0], 'count': 1})
+        assert response.status_code == 200
+        hint = response.get_json()
+        # The done performance is skipped
+        assert [p['id'] for p in hint['performances']] == [ids[0], ids[2]]
+        assert [t['filename'] for p in hint['performances'] for t in p['tracks']] == ['Opening.mp3', 'Dance.mp3']
+
+        event_manager.prefetcher.wait()
+        assert {path.name for path in warmed} == {'Opening.mp3', 'Dance.mp3'}
+
+    def test_show_warms_ready_derived_files(self, client, event_manager, show, warmed):
+        event_id, ids = show
+        peaks_file = event_manager.get_performance_dir(event_id, ids[3]) / '.Finale.mp3.peaks'
+        peaks_file.write_bytes(b'PEAK')
+
+        client.post(f'/api/events/{event_id}/show', json={'performanceId': ids[3]})
+        event_manager.prefetcher.wait()
+        assert sorted(path.name for path in warmed) == ['.Finale.mp3.peaks', 'Finale.mp3']
+
+    def test_invalid_requests(self, client, show, warmed):
+        event_id, ids = show
+        assert client.post('/api/events/missing/show', json={}).status_code == 404
+        assert client.post(f'/api/events/{event_id}/show', json={'performanceId': 'missing'}).status_code == 404
+        assert client.post(f'/api/events/{event_id}/show', json={'count': 99}).status_code == 400
+        assert client.get(f'/api/events/{event_id}/prefetch?count=x').status_code == 400
+
+    def test_prefetch_hint_is_conditional(self, client, event_manager, show, warmed):
+        event_id, ids = show
+        url = f'/api/events/{event_id}/prefetch?performance={ids[2]}&count=2'
+        response = client.get(url)
+        assert [p['id'] for p in response.get_json()['performances']] == [ids[2], ids[3]]
+        assert warmed == []
+
+        assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+        event_manager.update_performance(event_id, ids[3], {'isDone': True})
+        changed = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        assert [p['id'] for p in changed.get_json()['performances']] == [ids[2]]
@@ -0,0 +1,135 @@
+"""
+Tests for resumable chunked uploads
+"""
+
+import os
+import time
+
+import pytest
+
+import resumable
+
+
+AUDIO = bytes(range(256)) * 400
+
+
+@pytest.fixture
+def performance(event_manager):
+    event = event_manager.create_event('Gala')
+    performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+    return event, performance
+
+
+@pytest.fixture
+def uploads_url(performance):
+    event, perf = performance
+    return f"/api/events/{event['id']}/performances/{perf['id']}/uploads"
+
+
+def start_upload(client, uploads_url, length=len(AUDIO), filename='song.mp3'):
+    response = client.post(uploads_url, json={'filename': filename, 'length': length, 'performer': 'Asha'})
+    assert response.status_code == 201
+    return response.headers['Location']
+
+
+@pytest.mark.unit
+class TestResumableUploads:
+
+    def test_upload_in_pieces_and_finalize(self, client, event_manager, performance, uploads_url):
+        event, perf = performance
+        location = start_upload(client, uploads_url)
+
+        response = client.patch(location, data=AUDIO[:10000], headers={'Upload-Offset': '0'})
+        assert response.status_code == 204
+        assert response.headers['Upload-Offset'] == '10000'
+
+        # After a dropped connection the client asks where to continue
+        response = client.head(location)
+        assert response.headers['Upload-Offset'] == '10000'
+        assert response.headers['Upload-Length'] == str(len(AUDIO))
+
+        response = client.patch(location, data=AUDIO[10000:], headers={'Upload-Offset': '10000'})
+        assert response.headers['Upload-Offset'] == str(len(AUDIO))
+
+        response = client.post(f'{location}/finalize')
+        assert response.status_code == 201
+        track = response.get_json()
+        assert track['filename'] == 'song.mp3'
+        assert track['performer'] == 'Asha'
+
+        performance_dir = event_manager.get_performance_dir(event['id'], perf['id'])
+        assert (performance_dir / 'song.mp3').read_bytes() == AUDIO
+        assert sorted(p.name for p in performance_dir.iterdir()) == ['song.mp3']
+        assert len(event_manager.get_performance(event['id'], perf['id'])['tracks']) == 1
+        assert client.get(location).status_code == 404
+
+    def test_offset_mismatch_is_a_conflict(self, client, uploads_url):
+        location = start_upload(client, uploads_url)
+        client.patch(location, data=AUDIO[:100], headers={'Upload-Offset': '0'})
+
+        response = client.patch(location, data=AUDIO[:100], headers={'Upload-Offset': '0'})
+        assert response.status_code == 409
+        assert response.headers['Upload-Offset'] == '100'
+
+    def test_missing_offset_header_is_rejected(self, client, uploads_url):
+        location = start_upload(client, uploads_url)
+        assert client.patch(location, data=AUDIO[:100]).status_code == 400
+
+    def test_data_beyond_length_is_rejected(self, client, uploads_url):
+        location = start_upload(client, uploads_url, length=100)
+
+        response = client.patch(location, data=AUDIO[:150], headers={'Upload-Offset': '0'})
+        assert response.status_code == 413
+        assert response.headers['Upload-Offset'] == '0'
+
+    def test_finalize_incomplete_upload_is_a_conflict(self, client, uploads_url):
+        location = start_upload(client, uploads_url)
+        client.patch(location, data=AUDIO[:100], headers={'Upload-Offset': '0'})
+
+        assert client.post(f'{location}/finalize').status_code == 409
+        assert client.head(location).headers['Upload-Offset'] == '100'
+
+    def test_upload_is_finalized_once(self, client, event_manager, performance, uploads_url):
+        event, perf = performance
+        location = start_upload(client, uploads_url)
+        client.patch(location, data=AUDIO, headers={'Upload-Offset': '0'})
+        # Two finalize requests that both found the upload
+        directory = event_manager.get_performance_dir(event['id'], perf['id'])
+        first, second = (resumable.get_upload(directory, location.rsplit('/', 1)[1]) for _ in range(2))
+
+        first.finish().discard()
+        with pytest.raises(resumable.UploadError) as error:
+            second.finish()
+        assert error.value.status == 404
+
+    def test_create_validates_file_and_length(self, client, uploads_url, monkeypatch):
+        assert client.post(uploads_url, json={'filename': 'notes.txt', 'length': 10}).status_code == 400
+        assert client.post(uploads_url, json={'filename': 'song.mp3'}).status_code == 400
+        monkeypatch.setattr('uploads.MAX_FILE_SIZE', 50)
+        assert client.post(uploads_url, json={'filename': 'song.mp3', 'length': 51}).status_code == 413
+
+    def test_unknown_upload_is_not_found(self, client, uploads_url):
+        assert client.get(f'{uploads_url}/{"0" * 32}').status_code == 404
+        assert client.get(f'{uploads_url}/../../secret').status_code == 404
+
+    def test_delete_removes_partial_data(self, client, event_manager, performance, uploads_url):
+        event, perf = performance
+        location = start_upload(client, uploads_url)
+        client.patch(location, data=AUDIO[:100], headers={'Upload-Offset': '0'})
+
+        assert client.delete(location).status_code == 204
+        assert client.get(location).status_code == 404
+        performance_dir = event_manager.get_performance_dir(event['id'], perf['id'])
+        assert list(performance_dir.iterdir()) == []
+
+    def test_abandoned_uploads_expire(self, client, event_manager, performance, uploads_url):
+        event, perf = performance
+        stale = start_upload(client, uploads_url)
+        active = start_upload(client, uploads_url)
+        performance_dir = event_manager.get_performance_dir(event['id'], perf['id'])
+        old = time.time() - resumable.UPLOAD_EXPIRY_SECONDS - 60
+        os.utime(performance_dir / f"{resumable.PREFIX}{stale.rsplit('/', 1)[1]}.part", (old, old))
+
+        assert resumable.expire_uploads(event_manager.config_dir, force=True) == 1
+        assert client.get(stale).status_code == 404
+        assert client.get(active).status_code == 200
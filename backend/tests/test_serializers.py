@@ -0,0 +1,76 @@
+"""
+Tests for persisted-data serializers and the JSON response provider
+"""
+
+import json
+
+import pytest
+
+import serializers
+from storage import JsonStorage
+
+
+@pytest.mark.unit
+class TestSerializers:
+    """Encoding, decoding and format detection"""
+
+    def test_json_is_compact(self, sample_performances):
+        encoded = serializers.encode(sample_performances, 'json')
+        assert b'\n' not in encoded and b'": ' not in encoded
+        assert serializers.decode(encoded) == sample_performances
+
+    def test_stdlib_fallback_matches(self, sample_performances, monkeypatch):
+        fast = serializers.encode(sample_performances, 'json')
+        monkeypatch.setattr(serializers, 'orjson', None)
+        assert serializers.decode(serializers.encode(sample_performances, 'json')) == serializers.decode(fast)
+
+    def test_reads_legacy_indented_json(self, sample_breaks):
+        assert serializers.decode(json.dumps(sample_breaks, indent=2).encode()) == sample_breaks
+
+    def test_msgpack_round_trip_and_detection(self, sample_performances):
+        pytest.importorskip('msgpack')
+        encoded = serializers.encode(sample_performances, 'msgpack')
+        assert serializers.detect_format(encoded) == 'msgpack'
+        assert serializers.decode(encoded) == sample_performances
+
+    def test_garbage_raises_decode_error(self):
+        with pytest.raises(serializers.DecodeError):
+            serializers.decode(b'[{"id": ')
+
+
+@pytest.mark.unit
+class TestStorageFormats:
+    """Snapshots in either format load regardless of the configured one"""
+
+    def test_switching_format_keeps_data_readable(self, temp_dir, sample_performances):
+        pytest.importorskip('msgpack')
+        JsonStorage(temp_dir, fmt='msgpack').save('event-1', 'performances', sample_performances)
+        snapshot = temp_dir / 'event-1' / 'performances.json'
+        assert serializers.detect_format(snapshot.read_bytes()) == 'msgpack'
+
+        assert JsonStorage(temp_dir, fmt='json').load('event-1', 'performances')[0] == sample_performances
+
+    def test_missing_msgpack_falls_back_to_json(self, temp_dir, monkeypatch, sample_breaks):
+        monkeypatch.setattr(serializers, 'msgpack', None)
+        engine = JsonStorage(temp_dir, fmt='msgpack')
+        engine.save('event-1', 'breaks', sample_breaks)
+        assert serializers.detect_format((temp_dir / 'event-1' / 'breaks.json').read_bytes()) == 'json'
+
+
+@pytest.mark.unit
+class TestJsonResponses:
+    """API responses go through the fast provider with unchanged content"""
+
+    def test_response_matches_stdlib_encoding(self, client, event_manager):
+        event = event_manager.create_event('Gala', 'Annual show')
+
+        response = client.get(f"/api/events/{event['id']}")
+
+        assert response.mimetype == 'application/json'
+        assert response.get_json()['name'] == 'Gala'
+        assert json.loads(response.data) == json.loads(json.dumps(response.get_json()))
+
+    def test_request_bodies_are_parsed(self, client, event_manager):
+        response = client.post('/api/events', json={'name': 'Ünïcode Gala'})
+        assert response.status_code == 201
+        assert response.get_json()['name'] == 'Ünïcode Gala'
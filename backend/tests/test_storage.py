@@ -0,0 +1,291 @@
+"""
+Tests for the pluggable storage engines (JSON files and SQLite)
+"""
+
+import json
+import time
+import threading
+
+import pytest
+
+from storage import (
+    JsonStorage, SqliteStorage, EVENTS, SQLITE_DB_NAME, DURABILITY_MODES,
+    atomic_write, create_storage, file_lock, migrate_json_to_sqlite, op_put, op_delete,
+)
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def storage(request, temp_dir):
+    """Each storage engine, rooted in a temporary directory"""
+    engine = create_storage(request.param, temp_dir)
+    yield engine
+    engine.close()
+
+
+@pytest.mark.unit
+class TestStorageEngines:
+    """Behaviour shared by every engine"""
+
+    def test_missing_list_loads_empty(self, storage):
+        records, _ = storage.load('no-such-event', 'performances')
+        assert records == []
+
+    def test_full_save_round_trip(self, storage, sample_performances):
+        storage.save('event-1', 'performances', sample_performances)
+        records, _ = storage.load('event-1', 'performances')
+        assert records == sample_performances
+
+    def test_row_changes_are_applied(self, storage, sample_performances):
+        storage.save('event-1', 'performances', sample_performances)
+
+        sample_performances[3]['isDone'] = True
+        removed = sample_performances.pop(0)
+        added = {'id': 'perf-new', 'name': 'New', 'tracks': [], 'order': 10}
+        sample_performances.append(added)
+        storage.save('event-1', 'performances', sample_performances,
+                     [op_put(sample_performances[2]), op_delete(removed['id']), op_put(added)])
+
+        records, _ = storage.load('event-1', 'performances')
+        assert records == sample_performances
+
+    def test_stamp_changes_on_save(self, storage, sample_breaks):
+        before = storage.stamp('event-1', 'breaks')
+        after = storage.save('event-1', 'breaks', sample_breaks)
+        assert after != before
+        assert storage.stamp('event-1', 'breaks') == after
+
+    def test_events_are_separate_from_event_lists(self, storage, sample_breaks):
+        storage.save(None, EVENTS, [{'id': 'event-1', 'name': 'Gala'}])
+        storage.save('event-1', 'breaks', sample_breaks)
+
+        events, _ = storage.load(None, EVENTS)
+        assert events == [{'id': 'event-1', 'name': 'Gala'}]
+
+
+@pytest.mark.unit
+class TestSqliteStorage:
+    """SQLite specific behaviour"""
+
+    def test_uses_wal_and_indexes(self, temp_dir):
+        engine = SqliteStorage(temp_dir / SQLITE_DB_NAME)
+        conn = engine.connection()
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        indexes = {row[1] for row in conn.execute("SELECT type, name FROM sqlite_master WHERE type = 'index'")}
+        assert {'performances_event_order', 'breaks_event_order'} <= indexes
+
+    def test_drop_event_removes_rows(self, temp_dir, sample_performances):
+        engine = SqliteStorage(temp_dir / SQLITE_DB_NAME)
+        engine.save('event-1', 'performances', sample_performances)
+        engine.drop_event('event-1')
+        assert engine.load('event-1', 'performances')[0] == []
+
+    def test_event_manager_on_sqlite(self, temp_dir):
+        from app import EventManager
+
+        manager = EventManager(config_dir=temp_dir, storage='sqlite')
+        event = manager.create_event('Gala')
+        performance = manager.create_performance(event['id'], 'Opening')
+        manager.update_performance(event['id'], performance['id'], {'isDone': True})
+
+        reopened = EventManager(config_dir=temp_dir, storage='sqlite')
+        assert reopened.get_event(event['id'])['name'] == 'Gala'
+        assert reopened.get_performance(event['id'], performance['id'])['isDone'] is True
+
+
+@pytest.mark.integration
+class TestJsonToSqliteMigration:
+    """One-shot migration of the existing JSON layout"""
+
+    def test_migrates_events_performances_and_breaks(self, temp_dir, event_id, performances_file, breaks_file,
+                                                     sample_performances, sample_breaks):
+        with open(temp_dir / 'events.json', 'w') as f:
+            json.dump([{'id': event_id, 'name': 'Gala'}], f)
+
+        counts = migrate_json_to_sqlite(temp_dir)
+
+        assert counts == {EVENTS: 1, 'performances': 10, 'breaks': 5}
+        engine = SqliteStorage(temp_dir / SQLITE_DB_NAME)
+        assert engine.load(event_id, 'performances')[0] == sample_performances
+        assert engine.load(event_id, 'breaks')[0] == sample_breaks
+        # The JSON files are left in place
+        assert JsonStorage(temp_dir).load(event_id, 'performances')[0] == sample_performances
+
+    def test_first_sqlite_start_migrates_automatically(self, temp_dir, event_id, performances_file):
+        with open(temp_dir / 'events.json', 'w') as f:
+            json.dump([{'id': event_id, 'name': 'Gala'}], f)
+
+        engine = create_storage('sqlite', temp_dir)
+
+        assert len(engine.load(event_id, 'performances')[0]) == 10
+
+
+@pytest.mark.unit
+class TestJsonJournal:
+    """Appended change journal for the JSON engine"""
+
+    @pytest.fixture
+    def journaled(self, temp_dir, sample_performances):
+        engine = JsonStorage(temp_dir, compact_ops=5, compact_seconds=3600)
+        engine.save('event-1', 'performances', sample_performances)
+        yield engine
+        engine.close()
+
+    def test_changes_are_appended_not_rewritten(self, journaled, sample_performances):
+        snapshot = journaled.path('event-1', 'performances')
+        before = snapshot.read_bytes()
+
+        sample_performances[4]['isDone'] = True
+        journaled.save('event-1', 'performances', sample_performances, [op_put(sample_performances[4])])
+
+        assert snapshot.read_bytes() == before
+        assert journaled.journal_path(snapshot).exists()
+        assert journaled.load('event-1', 'performances')[0] == sample_performances
+
+    def test_compacts_after_n_saves(self, journaled, sample_performances):
+        snapshot = journaled.path('event-1', 'performances')
+        for i in range(5):
+            sample_performances[i]['isDone'] = True
+            journaled.save('event-1', 'performances', sample_performances, [op_put(sample_performances[i])])
+
+        assert not journaled.journal_path(snapshot).exists()
+        with open(snapshot) as f:
+            assert json.load(f) == sample_performances
+
+    def test_background_compaction(self, temp_dir, sample_breaks):
+        engine = JsonStorage(temp_dir, compact_seconds=0, fsync_seconds=0.01)
+        engine.save('event-1', 'breaks', sample_breaks)
+        deleted = sample_breaks.pop(2)
+        engine.save('event-1', 'breaks', sample_breaks, [op_delete(deleted['id'])])
+
+        snapshot = engine.path('event-1', 'breaks')
+        for _ in range(200):
+            if not engine.journal_path(snapshot).exists():
+                break
+            time.sleep(0.01)
+        engine.close()
+
+        assert not engine.journal_path(snapshot).exists()
+        with open(snapshot) as f:
+            assert json.load(f) == sample_breaks
+
+    def test_torn_entry_is_skipped_on_replay(self, journaled, sample_performances):
+        snapshot = journaled.path('event-1', 'performances')
+        sample_performances[0]['isDone'] = True
+        journaled.save('event-1', 'performances', sample_performances, [op_put(sample_performances[0])])
+        # Simulate a crash in the middle of the next append
+        with open(journaled.journal_path(snapshot), 'a') as f:
+            f.write('[{"op": "put", "rec')
+        sample_performances[1]['isDone'] = True
+        journaled.save('event-1', 'performances', sample_performances, [op_put(sample_performances[1])])
+
+        # A fresh engine (as after a restart) recovers every complete entry
+        recovered, _ = JsonStorage(journaled.config_dir).load('event-1', 'performances')
+        assert recovered == sample_performances
+
+    def test_event_manager_toggle_uses_journal(self, event_manager):
+        event = event_manager.create_event('Gala')
+        performance = event_manager.create_performance(event['id'], 'Opening')
+        snapshot = event_manager.get_event_performances_file(event['id'])
+        before = snapshot.read_bytes()
+
+        event_manager.update_performance(event['id'], performance['id'], {'isDone': True})
+
+        assert snapshot.read_bytes() == before
+        assert event_manager.get_performance(event['id'], performance['id'])['isDone'] is True
+
+    def test_compaction_keeps_changes_journaled_by_another_worker(self, temp_dir):
+        from app import EventManager
+
+        # Two managers on the same data stand in for two server processes
+        first = EventManager(config_dir=temp_dir)
+        second = EventManager(config_dir=temp_dir)
+        try:
+            first.storage.compact_ops = 3
+            one, two = first.create_event('One'), first.create_event('Two')
+            second.sync()
+            with first.transaction(one['id']):
+                # The second worker journals a change the first has not loaded
+                second.update_event(two['id'], {'name': 'Renamed'})
+                first.update_event(one['id'], {'description': 'First'})
+                first.update_event(one['id'], {'description': 'Second'})
+                assert not first.storage.journal_path(first.storage.path(None, EVENTS)).exists()
+        finally:
+            first.close()
+            second.close()
+
+        names = {e['id']: e['name'] for e in JsonStorage(temp_dir).load(None, EVENTS)[0]}
+        assert names == {one['id']: 'One', two['id']: 'Renamed'}
+
+
+@pytest.mark.unit
+class TestDurability:
+    """Atomic snapshot writes and durability modes"""
+
+    @pytest.mark.parametrize('durability', DURABILITY_MODES)
+    def test_every_mode_round_trips(self, temp_dir, durability, sample_performances):
+        engine = JsonStorage(temp_dir, durability=durability, compact_ops=2)
+        engine.save('event-1', 'performances', sample_performances)
+        for i in range(3):
+            sample_performances[i]['isDone'] = True
+            engine.save('event-1', 'performances', sample_performances, [op_put(sample_performances[i])])
+        engine.close()
+
+        assert JsonStorage(temp_dir).load('event-1', 'performances')[0] == sample_performances
+        assert not list((temp_dir / 'event-1').glob('*.tmp'))
+
+    def test_failed_write_keeps_previous_content(self, temp_dir, mocker):
+        target = temp_dir / 'events.json'
+        atomic_write(target, b'[1]')
+        mocker.patch('storage.os.replace', side_effect=OSError('disk full'))
+
+        with pytest.raises(OSError):
+            atomic_write(target, b'[2]')
+
+        assert target.read_bytes() == b'[1]'
+        assert [p.name for p in temp_dir.iterdir()] == ['events.json']
+
+    def test_rename_replaces_inode(self, temp_dir):
+        """Readers holding the old file keep a complete copy"""
+        target = temp_dir / 'events.json'
+        atomic_write(target, b'[1]', 'rename')
+        with open(target, 'rb') as reader:
+            atomic_write(target, b'[2]', 'rename')
+            assert reader.read() == b'[1]'
+        assert target.read_bytes() == b'[2]'
+
+    def test_unknown_mode_is_rejected(self, temp_dir):
+        with pytest.raises(ValueError):
+            JsonStorage(temp_dir, durability='sometimes')
+
+
+@pytest.mark.unit
+class TestFileLock:
+    """Shared locks for readers, exclusive locks for writers"""
+
+    def _acquired_within(self, path, shared, seconds=0.2):
+        """Whether another thread gets the lock within the given time"""
+        acquired = threading.Event()
+
+        def take():
+            with file_lock(path, shared=shared):
+                acquired.set()
+        thread = threading.Thread(target=take)
+        thread.start()
+        result = acquired.wait(seconds)
+        return result, thread
+
+    def test_readers_share_the_lock(self, temp_dir):
+        path = temp_dir / 'performances.json'
+        with file_lock(path, shared=True):
+            acquired, thread = self._acquired_within(path, shared=True)
+            assert acquired
+        thread.join()
+
+    @pytest.mark.parametrize('holder_shared,waiter_shared', [(True, False), (False, True), (False, False)])
+    def test_writers_are_exclusive(self, temp_dir, holder_shared, waiter_shared):
+        path = temp_dir / 'performances.json'
+        with file_lock(path, shared=holder_shared):
+            acquired, thread = self._acquired_within(path, shared=waiter_shared)
+            assert not acquired
+        thread.join(1)
+        assert not thread.is_alive()
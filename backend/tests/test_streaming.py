@@ -0,0 +1,100 @@
+"""
+Tests for Range streaming of audio files
+"""
+
+import pytest
+
+import streaming
+
+
+@pytest.fixture
+def track(client, event_manager):
+    """An event with one performance holding a 1000-byte FLAC file"""
+    event = event_manager.create_event('Gala')
+    performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+    data = bytes(range(256)) * 3 + bytes(232)
+    (event_manager.get_performance_dir(event['id'], performance['id']) / 'song.flac').write_bytes(data)
+    return f"/api/events/{event['id']}/performances/{performance['id']}/files/song.flac", data
+
+
+@pytest.mark.unit
+class TestRangeStreaming:
+
+    def test_full_file(self, client, track):
+        url, data = track
+        response = client.get(url, buffered=True)
+        assert response.status_code == 200
+        assert response.data == data
+        assert response.mimetype == 'audio/flac'
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        assert response.headers['Content-Length'] == '1000'
+
+    @pytest.mark.parametrize('header,start,stop', [
+        ('bytes=0-', 0, 1000),
+        ('bytes=100-199', 100, 200),
+        ('bytes=-300', 700, 1000),
+        ('bytes=900-5000', 900, 1000),
+    ])
+    def test_single_range(self, client, track, header, start, stop):
+        url, data = track
+        response = client.get(url, headers={'Range': header}, buffered=True)
+        assert response.status_code == 206
+        assert response.data == data[start:stop]
+        assert response.headers['Content-Range'] == f'bytes {start}-{stop - 1}/1000'
+        assert response.headers['Content-Length'] == str(stop - start)
+
+    def test_multiple_ranges(self, client, track):
+        url, data = track
+        response = client.get(url, headers={'Range': 'bytes=0-9,-5,5-19'}, buffered=True)
+        assert response.status_code == 206
+        assert response.mimetype == 'multipart/byteranges'
+        boundary = response.mimetype_params['boundary'].encode()
+        assert int(response.headers['Content-Length']) == len(response.data)
+
+        parts = response.data.split(b'--' + boundary)
+        assert parts[-1] == b'--\r\n'
+        # Overlapping ranges are merged: 0-19 and 995-999
+        bodies = [part.split(b'\r\n\r\n', 1) for part in parts[1:-1]]
+        assert [b'Content-Range: bytes 0-19/1000' in head for head, _ in bodies] == [True, False]
+        assert [body for _, body in bodies] == [data[0:20] + b'\r\n', data[995:] + b'\r\n']
+
+    def test_unsatisfiable_range(self, client, track):
+        url, _ = track
+        response = client.get(url, headers={'Range': 'bytes=2000-'}, buffered=True)
+        assert response.status_code == 416
+        assert response.headers['Content-Range'] == 'bytes */1000'
+
+    def test_malformed_range_is_ignored(self, client, track):
+        url, data = track
+        response = client.get(url, headers={'Range': 'bytes=50-10'}, buffered=True)
+        assert response.status_code == 200
+        assert response.data == data
+
+    def test_if_range(self, client, track):
+        url, data = track
+        etag = client.get(url, buffered=True).headers['ETag']
+        assert client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': etag}, buffered=True).status_code == 206
+
+        stale = client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'}, buffered=True)
+        assert stale.status_code == 200
+        assert stale.data == data
+
+    def test_conditional_get(self, client, track):
+        url, _ = track
+        etag = client.get(url, buffered=True).headers['ETag']
+        assert client.get(url, headers={'If-None-Match': etag}, buffered=True).status_code == 304
+
+    def test_reads_are_bounded(self, client, track, monkeypatch):
+        url, data = track
+        monkeypatch.setattr(streaming, 'CHUNK_SIZE', 64)
+        response = client.get(url, headers={'Range': 'bytes=10-'}, buffered=False)
+        chunks = list(response.response)
+        assert max(len(chunk) for chunk in chunks) <= 64
+        assert b''.join(chunks) == data[10:]
+        response.close()
+
+    @pytest.mark.parametrize('name,mimetype', [
+        ('a.mp3', 'audio/mpeg'), ('a.M4A', 'audio/mp4'), ('a.wav', 'audio/wav'), ('a.bin', 'application/octet-stream'),
+    ])
+    def test_audio_mimetype(self, tmp_path, name, mimetype):
+        assert streaming.audio_mimetype(tmp_path / name) == mimetype
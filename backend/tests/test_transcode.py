@@ -0,0 +1,129 @@
+"""
+Tests for compressed streaming renditions
+"""
+
+import sys
+from io import BytesIO
+
+import pytest
+
+import transcode
+from conftest import install_ffmpeg
+
+
+AUDIO = bytes(range(256)) * 400
+
+# Stands in for ffmpeg: writes the first 1000 bytes of the input as the output
+# (to stdout for '-', where the peaks queue reads decoded samples)
+FAKE_FFMPEG = f'''#!{sys.executable}
+import sys
+args = sys.argv[1:]
+if 'fail' in args[args.index('-i') + 1]:
+    sys.exit('cannot decode')
+with open(args[args.index('-i') + 1], 'rb') as src:
+    data = src.read(1000)
+if args[-1] == '-':
+    sys.stdout.buffer.write(data)
+    sys.exit()
+with open(args[-1], 'wb') as out:
+    out.write(data)
+with open(args[-1] + '.args', 'w') as log:
+    log.write(' '.join(args))
+'''
+
+
+@pytest.fixture
+def ffmpeg(temp_dir, monkeypatch):
+    path = install_ffmpeg(temp_dir, FAKE_FFMPEG, monkeypatch)
+    monkeypatch.setattr(transcode, 'UPLOAD_QUALITIES', [])
+    return path
+
+
+@pytest.fixture
+def track(client, event_manager):
+    event = event_manager.create_event('Gala')
+    performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+    response = client.post(f"/api/events/{event['id']}/performances/{performance['id']}/upload",
+                           data={'file': (BytesIO(AUDIO), 'song.wav'), 'performer': 'Asha'})
+    track = response.get_json()
+    event_manager.metadata.wait()
+    return event['id'], performance['id'], track
+
+
+@pytest.mark.unit
+class TestRenditions:
+
+    def test_original_is_served_without_quality(self, client, ffmpeg, track):
+        response = client.get(track[2]['url'], buffered=True)
+        assert response.status_code == 200
+        assert response.data == AUDIO
+
+    def test_rendition_is_made_on_first_request(self, client, event_manager, ffmpeg, track):
+        url = track[2]['url']
+
+        response = client.get(f'{url}?quality=low')
+        assert response.status_code == 307
+        assert response.headers['Location'].endswith(url)
+        assert 'no-store' in response.headers['Cache-Control']
+
+        event_manager.transcoder.wait()
+        response = client.get(f'{url}?quality=low', buffered=True)
+        assert response.status_code == 200
+        assert response.mimetype == 'audio/ogg'
+        assert response.data == AUDIO[:1000]
+
+        response = client.get(f'{url}?quality=low', headers={'Range': 'bytes=0-99'}, buffered=True)
+        assert response.status_code == 206
+        assert response.data == AUDIO[:100]
+
+    def test_aac_rendition_is_streamable_mp4(self, client, event_manager, ffmpeg, track):
+        event_id, performance_id, added = track
+        client.get(f"{added['url']}?quality=aac")
+        event_manager.transcoder.wait()
+
+        performance_dir = event_manager.get_performance_dir(event_id, performance_id)
+        assert client.get(f"{added['url']}?quality=aac", buffered=True).mimetype == 'audio/mp4'
+        assert '+faststart' in next(performance_dir.glob('*.args')).read_text()
+
+    def test_upload_queues_configured_renditions(self, client, event_manager, ffmpeg, monkeypatch):
+        monkeypatch.setattr(transcode, 'UPLOAD_QUALITIES', ['low', 'medium'])
+        event = event_manager.create_event('Gala')
+        performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+        client.post(f"/api/events/{event['id']}/performances/{performance['id']}/upload",
+                    data={'file': (BytesIO(AUDIO), 'song.wav'), 'performer': 'Asha'})
+        event_manager.transcoder.wait()
+
+        original = event_manager.get_performance_dir(event['id'], performance['id']) / 'song.wav'
+        assert transcode.ready_rendition(original, 'low')
+        assert transcode.ready_rendition(original, 'medium')
+
+    def test_without_ffmpeg_the_original_is_used(self, client, event_manager, track, monkeypatch):
+        monkeypatch.setattr(transcode, 'FFMPEG', None)
+        response = client.get(f"{track[2]['url']}?quality=low")
+        assert response.status_code == 307
+        event_manager.transcoder.wait()
+        assert client.get(f"{track[2]['url']}?quality=low").status_code == 307
+
+    def test_failed_transcode_is_not_retried(self, client, event_manager, ffmpeg, track, monkeypatch):
+        event_id, performance_id, added = track
+        performance_dir = event_manager.get_performance_dir(event_id, performance_id)
+        (performance_dir / 'fail.wav').write_bytes(AUDIO)
+
+        assert event_manager.transcoder.submit(performance_dir / 'fail.wav', 'low')
+        event_manager.transcoder.wait()
+        assert transcode.ready_rendition(performance_dir / 'fail.wav', 'low') is None
+        assert not event_manager.transcoder.submit(performance_dir / 'fail.wav', 'low')
+        assert not list(performance_dir.glob('.upload-*'))
+
+    def test_unknown_quality_is_rejected(self, client, ffmpeg, track):
+        assert client.get(f"{track[2]['url']}?quality=ultra").status_code == 400
+
+    def test_deleting_track_removes_renditions(self, client, event_manager, ffmpeg, track):
+        event_id, performance_id, added = track
+        client.get(f"{added['url']}?quality=low")
+        event_manager.transcoder.wait()
+        original = event_manager.get_performance_dir(event_id, performance_id) / 'song.wav'
+        assert transcode.ready_rendition(original, 'low')
+
+        event_manager.delete_track(event_id, performance_id, added['id'])
+        assert not transcode.rendition_path(original, 'low').exists()
@@ -0,0 +1,111 @@
+"""
+Tests for streaming multipart uploads
+"""
+
+from io import BytesIO
+
+import pytest
+
+import uploads
+
+
+AUDIO = bytes(range(256)) * 400
+
+
+@pytest.fixture
+def performance(event_manager):
+    event = event_manager.create_event('Gala')
+    performance = event_manager.create_performance(event['id'], 'Opening', 'Asha')
+    return event, performance
+
+
+def leftovers(directory):
+    return list(directory.rglob(f'{uploads.TEMP_PREFIX}*'))
+
+
+@pytest.mark.unit
+class TestStreamingUploads:
+
+    def test_upload_streams_file_into_place(self, client, event_manager, performance, monkeypatch):
+        event, perf = performance
+        # Many small reads exercise parts split across chunk boundaries
+        monkeypatch.setattr(uploads, 'CHUNK_SIZE', 1000)
+        response = client.post(f"/api/events/{event['id']}/performances/{perf['id']}/upload",
+                               data={'file': (BytesIO(AUDIO), 'song.mp3'), 'performer': 'Asha'})
+
+        assert response.status_code == 201
+        track = response.get_json()
+        assert track['filename'] == 'song.mp3'
+        assert track['performer'] == 'Asha'
+        performance_dir = event_manager.get_performance_dir(event['id'], perf['id'])
+        assert (performance_dir / 'song.mp3').read_bytes() == AUDIO
+        assert leftovers(event_manager.config_dir) == []
+
+    def test_duplicate_names_are_not_overwritten(self, client, event_manager, performance):
+        event, perf = performance
+        url = f"/api/events/{event['id']}/performances/{perf['id']}/tracks"
+        response = client.post(url, data={'files': [(BytesIO(b'one'), 'song.mp3'), (BytesIO(b'two'), 'song.mp3')]})
+
+        assert response.status_code == 201
+        assert [t['filename'] for t in response.get_json()['tracks']] == ['song.mp3', 'song_1.mp3']
+        performance_dir = event_manager.get_performance_dir(event['id'], perf['id'])
+        assert (performance_dir / 'song_1.mp3').read_bytes() == b'two'
+
+    def test_disallowed_type_is_not_written(self, client, event_manager, performance):
+        event, perf = performance
+        response = client.post(f"/api/events/{event['id']}/performances/{perf['id']}/upload",
+                               data={'file': (BytesIO(b'#!/bin/sh'), 'run.sh')})
+
+        assert response.status_code == 400
+        assert list(event_manager.get_performance_dir(event['id'], perf['id']).iterdir()) == []
+
+    def test_file_size_limit(self, client, event_manager, performance, monkeypatch):
+        event, perf = performance
+        monkeypatch.setattr(uploads, 'MAX_FILE_SIZE', 1000)
+        response = client.post(f"/api/events/{event['id']}/performances/{perf['id']}/tracks",
+                               data={'files': [(BytesIO(b'small'), 'a.mp3'), (BytesIO(AUDIO), 'b.mp3')]})
+
+        assert response.status_code == 413
+        # Nothing from the rejected request is kept, including the first file
+        assert list(event_manager.get_performance_dir(event['id'], perf['id']).iterdir()) == []
+        assert event_manager.get_performance(event['id'], perf['id'])['tracks'] == []
+
+    def test_total_size_limit_is_checked_before_reading(self, client, performance, monkeypatch):
+        event, perf = performance
+        monkeypatch.setattr(uploads, 'MAX_UPLOAD_SIZE', 1000)
+
+        def fail(*args):
+            raise AssertionError('body was read')
+        monkeypatch.setattr(uploads, '_read_chunks', fail)
+        response = client.post(f"/api/events/{event['id']}/performances/{perf['id']}/upload",
+                               data={'file': (BytesIO(AUDIO), 'song.mp3')})
+        assert response.status_code == 413
+
+    def test_truncated_body_is_rejected(self, client, event_manager, performance):
+        event, perf = performance
+        body = (b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="song.mp3"\r\n'
+                b'Content-Type: audio/mpeg\r\n\r\n' + AUDIO[:5000])
+        response = client.post(f"/api/events/{event['id']}/performances/{perf['id']}/upload",
+                               data=body, content_type='multipart/form-data; boundary=xyz')
+
+        assert response.status_code == 400
+        assert leftovers(event_manager.config_dir) == []
+
+    def test_create_performance_with_files_after_fields(self, client, event_manager, performance):
+        event, _ = performance
+        # Files come before the performer field, as the frontend sends them
+        response = client.post(f"/api/events/{event['id']}/performances",
+                               data={'files': [(BytesIO(AUDIO), 'intro.wav')], 'name': 'Finale', 'performer': 'Ravi'})
+
+        assert response.status_code == 201
+        created = response.get_json()
+        assert [(t['filename'], t['performer']) for t in created['tracks']] == [('intro.wav', 'Ravi')]
+        assert (event_manager.get_performance_dir(event['id'], created['id']) / 'intro.wav').read_bytes() == AUDIO
+        assert leftovers(event_manager.config_dir) == []
+
+    def test_missing_name_leaves_no_files(self, client, event_manager, performance):
+        event, _ = performance
+        response = client.post(f"/api/events/{event['id']}/performances",
+                               data={'files': [(BytesIO(AUDIO), 'intro.wav')]})
+        assert response.status_code == 400
+        assert leftovers(event_manager.config_dir) == []
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Compressed renditions of track files for streaming over weak networks
+
+When an ffmpeg binary is available, tracks can be streamed as a smaller
+rendition with ?quality=<name>. Renditions are produced in the background
+and cached next to the original as a hidden file
+(.<filename>.<quality>.<ext>); until one is ready, requests are redirected
+to the original.
+The original always stays available (no ?quality, or ?quality=original).
+
+- PERFORMANCE_MANAGER_FFMPEG                ffmpeg binary (default: ffmpeg on PATH)
+- PERFORMANCE_MANAGER_TRANSCODE_QUALITIES   renditions made right after an upload
+                                            (default: low; empty for on demand only)
+- PERFORMANCE_MANAGER_TRANSCODE_WORKERS     parallel ffmpeg processes (default 1)
+"""
+
+import os
+import uuid
+import shutil
+import logging
+import subprocess
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from jobs import JobQueue
+from uploads import TEMP_PREFIX
+
+FFMPEG = shutil.which(os.environ.get('PERFORMANCE_MANAGER_FFMPEG', 'ffmpeg'))
+TRANSCODE_WORKERS = int(os.environ.get('PERFORMANCE_MANAGER_TRANSCODE_WORKERS', '1'))
+
+# Seconds an ffmpeg run may take before it is killed
+TRANSCODE_TIMEOUT = 600
+
+ORIGINAL = 'original'
+
+class Rendition(NamedTuple):
+    codec: str
+    bitrate: int  # bits per second
+    extension: str
+    ffmpeg_format: str
+
+# Opus is the most efficient at low bitrates; AAC plays everywhere
+RENDITIONS: Dict[str, Rendition] = {
+    'low': Rendition('libopus', 48_000, '.opus', 'ogg'),
+    'medium': Rendition('libopus', 96_000, '.opus', 'ogg'),
+    'aac': Rendition('aac', 128_000, '.m4a', 'ipod'),
+}
+
+UPLOAD_QUALITIES: List[str] = [
+    q.strip() for q in os.environ.get('PERFORMANCE_MANAGER_TRANSCODE_QUALITIES', 'low').split(',')
+    if q.strip() in RENDITIONS
+]
+
+def available() -> bool:
+    return FFMPEG is not None
+
+def rendition_path(file_path: Path, quality: str) -> Path:
+    return file_path.parent / f'.{file_path.name}.{quality}{RENDITIONS[quality].extension}'
+
+def ready_rendition(file_path: Path, quality: str) -> Optional[Path]:
+    """The cached rendition if it exists and is newer than the original"""
+    path = rendition_path(file_path, quality)
+    try:
+        if path.stat().st_mtime_ns >= file_path.stat().st_mtime_ns:
+            return path
+    except FileNotFoundError:
+        pass
+    return None
+
+def remove_renditions(file_path: Path) -> None:
+    for quality in RENDITIONS:
+        rendition_path(file_path, quality).unlink(missing_ok=True)
+
+def transcode(file_path: Path, quality: str) -> bool:
+    """Run ffmpeg to produce a rendition; the file appears atomically when complete"""
+    rendition = RENDITIONS[quality]
+    target = rendition_path(file_path, quality)
+    # Named like upload temp files, so expire_uploads() removes it after a crash
+    temp = target.parent / f'{TEMP_PREFIX}{uuid.uuid4().hex}.part'
+    command = [
+        FFMPEG, '-nostdin', '-v', 'error', '-y', '-i', str(file_path),
+        '-vn', '-c:a', rendition.codec, '-b:a', str(rendition.bitrate),
+        # Index at the front, so playback can start before the download ends
+        *(['-movflags', '+faststart'] if rendition.ffmpeg_format == 'ipod' else []),
+        '-f', rendition.ffmpeg_format, str(temp),
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+        if result.returncode != 0:
+            logging.warning(f"ffmpeg could not make the {quality} rendition of {file_path}: "
+                            f"{result.stderr.decode(errors='replace').strip()}")
+            return False
+        os.replace(temp, target)
+        return True
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.warning(f"Transcoding {file_path} to {quality} failed: {e}")
+        return False
+    finally:
+        temp.unlink(missing_ok=True)
+
+class TranscodeQueue(JobQueue):
+    """Background ffmpeg runs, each rendition queued at most once"""
+
+    def __init__(self, workers: int = TRANSCODE_WORKERS):
+        super().__init__('transcode', workers)
+
+    def submit(self, file_path: Path, quality: str) -> bool:
+        """Queue a rendition unless ffmpeg is missing or it is ready or queued"""
+        if not available() or quality not in RENDITIONS or ready_rendition(file_path, quality):
+            return False
+        return super().submit(rendition_path(file_path, quality), _transcode_existing, file_path, quality)
+
+def _transcode_existing(file_path: Path, quality: str) -> bool:
+    # The track may have been deleted while queued
+    return transcode(file_path, quality) if file_path.exists() else True
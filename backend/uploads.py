@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Streaming multipart uploads
+
+Werkzeug's request.files spools each uploaded file to memory or a temporary
+file before file.save() copies it to its destination. streamed_upload()
+instead parses the request body incrementally with werkzeug's sansio
+MultipartDecoder and writes every file part straight into a hidden temp file
+in a staging directory on the same filesystem as its destination, reading at
+most CHUNK_SIZE bytes at a time. UploadedFile.move_to_unique() then renames
+it into place, so each byte is written to disk once. The SHA-256 of every
+file is computed while it streams in, for the blob store (see blobs.py).
+
+Size limits are checked against Content-Length before anything is read and
+enforced again while streaming:
+- PERFORMANCE_MANAGER_MAX_FILE_SIZE    bytes per file (default 1 GiB)
+- PERFORMANCE_MANAGER_MAX_UPLOAD_SIZE  bytes per request (default 4 GiB)
+"""
+
+import os
+import uuid
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Tuple
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.wrappers import Request
+
+MAX_FILE_SIZE = int(os.environ.get('PERFORMANCE_MANAGER_MAX_FILE_SIZE', str(1024 ** 3)))
+MAX_UPLOAD_SIZE = int(os.environ.get('PERFORMANCE_MANAGER_MAX_UPLOAD_SIZE', str(4 * 1024 ** 3)))
+
+# Limits for the non-file form fields, as in werkzeug's form parser
+MAX_FORM_MEMORY_SIZE = 500 * 1024
+MAX_FORM_PARTS = 1000
+
+CHUNK_SIZE = 64 * 1024
+
+# Prefix of in-progress upload files; they are hidden and never served
+TEMP_PREFIX = '.upload-'
+
+class UploadError(Exception):
+    """Raised for malformed or oversized uploads; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+class UploadedFile:
+    """A file part written to a temp file in the staging directory
+
+    temp_path is None for parts that were not accepted (their data was
+    discarded) and after the file has been moved into place. sha256 is the
+    hex digest of the complete file.
+    """
+
+    def __init__(self, field: str, filename: str, temp_path: Optional[Path], size: int = 0,
+                 sha256: Optional[str] = None):
+        self.field = field
+        self.filename = filename
+        self.temp_path = temp_path
+        self.size = size
+        self.sha256 = sha256
+
+    def move_to_unique(self, directory: Path, filename: str) -> str:
+        """Rename the file into directory without overwriting anything
+
+        name_1.ext, name_2.ext, ... are tried if the name is taken. Returns the
+        name the file was stored under.
+        """
+        try:
+            candidate = link_unique(self.temp_path, directory, filename)
+        except OSError:
+            # Filesystem without hard links: check, then rename
+            stem, ext = os.path.splitext(filename)
+            candidate, counter = filename, 1
+            while (directory / candidate).exists():
+                candidate = f"{stem}_{counter}{ext}"
+                counter += 1
+            os.replace(self.temp_path, directory / candidate)
+            self.temp_path = None
+            return candidate
+        self.discard()
+        return candidate
+
+    def discard(self) -> None:
+        """Delete the temp file if it was not moved into place"""
+        if self.temp_path is not None:
+            try:
+                self.temp_path.unlink()
+            except FileNotFoundError:
+                pass
+            self.temp_path = None
+
+def link_unique(source: Path, directory: Path, filename: str) -> str:
+    """Hard-link source into directory as filename, or name_1.ext, name_2.ext, ...
+
+    link() fails if the target exists, unlike rename(), so nothing is ever
+    overwritten. Returns the name used; OSError if links are not supported.
+    """
+    stem, ext = os.path.splitext(filename)
+    candidate, counter = filename, 1
+    while True:
+        try:
+            os.link(source, directory / candidate)
+            return candidate
+        except FileExistsError:
+            candidate = f"{stem}_{counter}{ext}"
+            counter += 1
+
+def _read_chunks(stream, limit: int) -> Iterator[Optional[bytes]]:
+    """Read a body in chunks, then None to mark the end (as the decoder expects)"""
+    total = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            yield None
+            return
+        total += len(chunk)
+        if total > limit:
+            raise UploadError('Upload too large', 413)
+        yield chunk
+
+def parse_upload(request: Request, staging_dir: Path, accept: Callable[[str], bool] = bool,
+                 max_file_size: Optional[int] = None,
+                 max_upload_size: Optional[int] = None) -> Tuple[MultiDict, MultiDict]:
+    """Parse a multipart/form-data body, streaming file parts into staging_dir
+
+    Returns (form, files) like request.form and request.files; files maps
+    field names to UploadedFile objects. Parts whose filename is rejected by
+    accept() are skipped without being written. On error every temp file is
+    removed before UploadError is raised.
+    """
+    max_file_size = MAX_FILE_SIZE if max_file_size is None else max_file_size
+    max_upload_size = MAX_UPLOAD_SIZE if max_upload_size is None else max_upload_size
+
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadError('Expected a multipart/form-data request')
+    if request.content_length is not None and request.content_length > max_upload_size:
+        raise UploadError('Upload too large', 413)
+
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=MAX_FORM_MEMORY_SIZE,
+                               max_parts=MAX_FORM_PARTS)
+    fields = []
+    files = []
+    current = None
+    field_data = []
+    out = None
+    digest = None
+    event = None
+
+    try:
+        for chunk in _read_chunks(request.stream, max_upload_size):
+            decoder.receive_data(chunk)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    current, field_data = event, []
+                elif isinstance(event, File):
+                    current = UploadedFile(event.name, event.filename or '', None)
+                    files.append((event.name, current))
+                    if accept(current.filename):
+                        current.temp_path = staging_dir / f"{TEMP_PREFIX}{uuid.uuid4().hex}.part"
+                        out = open(current.temp_path, 'wb')
+                        digest = hashlib.sha256()
+                elif isinstance(event, Data):
+                    if isinstance(current, UploadedFile):
+                        if out is not None:
+                            current.size += len(event.data)
+                            if current.size > max_file_size:
+                                raise UploadError(f'{current.filename} is too large', 413)
+                            out.write(event.data)
+                            digest.update(event.data)
+                            if not event.more_data:
+                                out.close()
+                                out = None
+                                current.sha256 = digest.hexdigest()
+                    else:
+                        field_data.append(event.data)
+                        if not event.more_data:
+                            fields.append((current.name, b''.join(field_data).decode('utf-8', 'replace')))
+                event = decoder.next_event()
+        if not isinstance(event, Epilogue):
+            raise UploadError('Incomplete multipart body')
+    except BaseException as e:
+        if out is not None:
+            out.close()
+        for _, uploaded in files:
+            uploaded.discard()
+        if isinstance(e, RequestEntityTooLarge):
+            # Form fields over MAX_FORM_MEMORY_SIZE or too many parts
+            raise UploadError('Upload form too large', 413) from e
+        if isinstance(e, ValueError):
+            raise UploadError(f'Invalid upload: {e}') from e
+        raise
+    return MultiDict(fields), MultiDict(files)
+
+@contextmanager
+def streamed_upload(request: Request, staging_dir: Path, accept: Callable[[str], bool] = bool, **limits):
+    """parse_upload() as a context manager that removes files not moved into place"""
+    form, files = parse_upload(request, staging_dir, accept, **limits)
+    try:
+        yield form, files
+    finally:
+        for _, uploaded in files.items(multi=True):
+            uploaded.discard()
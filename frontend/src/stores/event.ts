@@ -1,6 +1,6 @@
 import { defineStore } from 'pinia'
 import { ref, computed } from 'vue'
-import type { Event, Performance } from '@/types'
+import type { BatchOperation, BatchResult, Event, EventChange, Performance } from '@/types'
 
 export const useEventStore = defineStore('event', () => {
   const events = ref<Event[]>([])
@@ -111,11 +111,80 @@ export const useEventStore = defineStore('event', () => {
       if (!response.ok) throw new Error('Failed to load event')
       selectedEvent.value = await response.json()
       await loadEventPerformances(eventId)
+      subscribe(eventId, selectedEvent.value?.version ?? 0)
     } catch (error) {
       console.error('Error selecting event:', error)
     }
   }
 
+  // Push channel: changes made on other screens arrive as deltas, so the
+  // selected event stays in sync without polling
+  // Retry-After of a refused change stream
+  const CHANGE_STREAM_RETRY_MS = 2000
+  let changeStream: EventSource | null = null
+  let resubscribeTimer: ReturnType<typeof setTimeout> | null = null
+
+  function subscribe(eventId: string, version: number) {
+    unsubscribe()
+    if (typeof EventSource === 'undefined') return
+    // After a dropped connection EventSource resumes from the last change it got
+    const stream = new EventSource(`/api/events/${eventId}/changes?since=${version}`)
+    changeStream = stream
+    stream.addEventListener('change', (message) => {
+      applyChange(eventId, JSON.parse((message as MessageEvent).data))
+    })
+    stream.addEventListener('reset', () => {
+      // Changes were missed: load the event again
+      selectEvent(eventId)
+    })
+    stream.addEventListener('error', () => {
+      // Refused (e.g. the server has too many streams open): EventSource
+      // gives up, so load the event again a little later
+      if (stream.readyState !== EventSource.CLOSED || changeStream !== stream) return
+      unsubscribe()
+      resubscribeTimer = setTimeout(() => selectEvent(eventId), CHANGE_STREAM_RETRY_MS)
+    })
+  }
+
+  function unsubscribe() {
+    if (resubscribeTimer) clearTimeout(resubscribeTimer)
+    resubscribeTimer = null
+    changeStream?.close()
+    changeStream = null
+  }
+
+  function applyChange(eventId: string, change: EventChange) {
+    if (selectedEvent.value?.id !== eventId) return
+    if (change.kind === 'event') {
+      const [event] = change.put || []
+      if (event) {
+        selectedEvent.value = { ...selectedEvent.value, ...event }
+        const index = events.value.findIndex(e => e.id === eventId)
+        if (index !== -1) events.value[index] = { ...events.value[index], ...event }
+      }
+    } else if (change.kind === 'performances') {
+      if (change.records) {
+        eventPerformances.value = change.records
+        return
+      }
+      const deleted = new Set(change.deleted || [])
+      const performances = eventPerformances.value.filter(p => !deleted.has(p.id))
+      for (const performance of change.put || []) {
+        const index = performances.findIndex(p => p.id === performance.id)
+        if (index !== -1) {
+          performances[index] = performance
+        } else {
+          performances.push(performance)
+        }
+      }
+      eventPerformances.value = performances
+      if (selectedPerformanceId.value && deleted.has(selectedPerformanceId.value)) {
+        selectedPerformanceId.value = null
+      }
+    }
+    // Breaks are not kept in this store
+  }
+
   async function loadEventPerformances(eventId: string) {
     isLoading.value = true
     try {
@@ -191,21 +260,47 @@ export const useEventStore = defineStore('event', () => {
       })
       if (!response.ok) throw new Error('Failed to reorder performances')
 
-      // IMPORTANT: Update order only for performances in newOrder list
-      // Preserve ALL other performances with their existing order
-      const performanceMap = new Map(eventPerformances.value.map(p => [p.id, p]))
+      // The server gives new orders only to the performances that moved,
+      // between the orders of their neighbours, so read them back
+      await loadEventPerformances(eventId)
+    } catch (error) {
+      console.error('Error reordering performances:', error)
+      throw error
+    }
+  }
 
-      newOrder.forEach((id, index) => {
-        const perf = performanceMap.get(id)
-        if (perf) {
-          perf.order = index
-        }
+  // Move one performance next to another; only the moved one is written
+  async function movePerformance(eventId: string, performanceId: string, neighbour: { before?: string; after?: string }) {
+    try {
+      const response = await fetch(`/api/events/${eventId}/performances/reorder`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ id: performanceId, ...neighbour }),
       })
+      if (!response.ok) throw new Error('Failed to move performance')
+      const { changed } = await response.json() as { changed: Performance[] }
+      const byId = new Map(changed.map(p => [p.id, p]))
+      eventPerformances.value = eventPerformances.value.map(p => byId.get(p.id) || p)
+    } catch (error) {
+      console.error('Error moving performance:', error)
+      throw error
+    }
+  }
 
-      // Keep ALL performances, not just the reordered ones
-      eventPerformances.value = Array.from(performanceMap.values())
+  async function applyBatch(eventId: string, operations: BatchOperation[], version?: number): Promise<BatchResult> {
+    try {
+      const response = await fetch(`/api/events/${eventId}/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ operations, version }),
+      })
+      if (!response.ok) throw new Error('Failed to apply changes')
+      const result: BatchResult = await response.json()
+      const changed = new Map((result.changed.performances || []).map(p => [p.id, p]))
+      eventPerformances.value = eventPerformances.value.map(p => changed.get(p.id) || p)
+      return result
     } catch (error) {
-      console.error('Error reordering performances:', error)
+      console.error('Error applying changes:', error)
       throw error
     }
   }
@@ -230,6 +325,7 @@ export const useEventStore = defineStore('event', () => {
   }
 
   function clearSelection() {
+    unsubscribe()
     selectedEvent.value = null
     eventPerformances.value = []
     selectedPerformanceId.value = null
@@ -253,6 +349,8 @@ export const useEventStore = defineStore('event', () => {
     updatePerformance,
     deletePerformance,
     reorderPerformances,
+    movePerformance,
+    applyBatch,
     togglePerformanceDone,
     selectPerformance,
     clearSelection,
@@ -1,7 +1,7 @@
 import { defineStore } from 'pinia'
 import { ref, computed, watch } from 'vue'
 import { Howl } from 'howler'
-import type { PlayState, Track } from '@/types'
+import type { PlayState, PrefetchHint, StreamQuality, Track } from '@/types'
 import { useEventStore } from './event'
 
 export const usePlayerStore = defineStore('player', () => {
@@ -17,6 +17,7 @@ export const usePlayerStore = defineStore('player', () => {
   const isLoading = ref(false)
   const loadProgress = ref(0)
   const isRemoteEnabled = ref(false)
+  const streamQuality = ref<StreamQuality>((localStorage.getItem('streamQuality') as StreamQuality) || 'original')
   
   // Watch for selected event changes to auto-configure remote player
   watch(() => eventStore.selectedEvent, (event) => {
@@ -52,6 +53,58 @@ export const usePlayerStore = defineStore('player', () => {
     isRemoteEnabled.value = !isRemoteEnabled.value
   }
 
+  // Applies from the next loaded track; the server falls back to the original
+  // until a rendition has been made
+  function setStreamQuality(quality: StreamQuality) {
+    streamQuality.value = quality
+    localStorage.setItem('streamQuality', quality)
+  }
+
+  function streamUrl(url: string): string {
+    return streamQuality.value === 'original' ? url : `${url}?quality=${streamQuality.value}`
+  }
+
+  // Level-matched playback: the server measures each track's loudness and
+  // sends the gain (dB) towards a common target. Volume cannot go above 1,
+  // so quiet tracks play unchanged and loud ones are turned down.
+  function trackVolume(track: Track): number {
+    return track.gain != null ? Math.min(1, Math.pow(10, track.gain / 20)) : 1.0
+  }
+
+  // Show mode: when a performance starts, the server reads its tracks and
+  // the next performances' into its cache, and the browser prefetches the
+  // first track of the next one
+  let warmedPerformanceId: string | undefined
+
+  async function warmShow(performanceId: string) {
+    const eventId = eventStore.selectedEvent?.id
+    if (!eventId || warmedPerformanceId === performanceId) return
+    warmedPerformanceId = performanceId
+
+    try {
+      const response = await fetch(`/api/events/${eventId}/show`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ performanceId })
+      })
+      if (!response.ok) return
+      const hint: PrefetchHint = await response.json()
+      const next = hint.performances[1]?.tracks[0]
+      if (next?.url) prefetchAudio(streamUrl(next.url))
+    } catch (error) {
+      console.error('Failed to warm upcoming performances:', error)
+    }
+  }
+
+  function prefetchAudio(url: string) {
+    document.querySelectorAll('link[data-audio-prefetch]').forEach(link => link.remove())
+    const link = document.createElement('link')
+    link.rel = 'prefetch'
+    link.href = url
+    link.dataset.audioPrefetch = ''
+    document.head.appendChild(link)
+  }
+
   // Helper to send commands to remote player
   async function sendRemoteCommand(endpoint: string, data: any = {}) {
     if (!isRemoteEnabled.value) return
@@ -103,14 +156,15 @@ export const usePlayerStore = defineStore('player', () => {
     currentTrack.value = track
     playState.value.currentPerformanceId = performanceId
     playState.value.currentTrackId = track.id
+    if (performanceId) warmShow(performanceId)
 
     // Create new Howl instance with streaming configuration
     const newHowl = new Howl({
-      src: [track.url],
+      src: [streamUrl(track.url)],
       html5: true,          // Force HTML5 for streaming
       preload: 'metadata',  // Only load metadata initially
       format: ['mp3', 'mp4', 'aac', 'm4a', 'wav', 'flac', 'wma'],
-      volume: options.crossfade ? 0 : 1.0, // Start at 0 if crossfading
+      volume: options.crossfade ? 0 : trackVolume(track), // Start at 0 if crossfading
 
       // Event handlers
       onload: () => {
@@ -138,7 +192,7 @@ export const usePlayerStore = defineStore('player', () => {
         startTimeUpdates()
         
         if (options.crossfade) {
-            newHowl.fade(0, 1.0, 5000) // Fade in over 5s
+            newHowl.fade(0, trackVolume(track), 5000) // Fade in over 5s
             // Reset crossfading flag after transition
             setTimeout(() => {
                 isCrossfading = false
@@ -339,6 +393,7 @@ export const usePlayerStore = defineStore('player', () => {
     isLoading,
     loadProgress,
     isRemoteEnabled,
+    streamQuality,
     formattedCurrentTime,
     formattedDuration,
     formattedLoadProgress,
@@ -352,6 +407,7 @@ export const usePlayerStore = defineStore('player', () => {
     rewind,
     handleSpaceKey,
     cleanupHowl,
-    toggleRemote
+    toggleRemote,
+    setStreamQuality
   }
 })
\ No newline at end of file
@@ -4,6 +4,16 @@ export interface Track {
   performer: string
   url?: string
   duration?: number  // Duration in seconds, extracted from audio file
+  bitrate?: number  // Bits per second
+  sampleRate?: number
+  channels?: number
+  codec?: string
+  contentHash?: string  // SHA-256 of the file; tracks with the same content share one stored copy
+  metadataStatus?: 'pending' | 'ready' | 'failed'  // The fields above are read in the background after upload
+  loudness?: number | null  // Integrated loudness in LUFS; null for silence
+  truePeak?: number | null  // dBTP
+  gain?: number  // dB towards the server's target loudness, limited by the peak
+  loudnessStatus?: 'pending' | 'ready' | 'failed'  // Measured in the background after upload
   isCompleted?: boolean
   isDisabled?: boolean
 }
@@ -33,16 +43,65 @@ export interface Break {
   expectedDuration?: number // in minutes
 }
 
+export interface EventStats {
+  performanceCount: number
+  performancesDone: number
+  trackCount: number
+  tracksCompleted: number
+  totalDuration: number // in seconds, sum of track durations
+  breakCount: number
+  breaksDone: number
+}
+
 export interface Event {
   id: string
   name: string
   description?: string
   createdAt: string
+  updatedAt?: string
+  version?: number
   performances: Performance[]
   breaks: Break[]
   coverImage?: string | null
   imagePosition?: { x: number; y: number }
   remotePlayerUrl?: string
+  performanceCount?: number
+  stats?: EventStats
+}
+
+// A delta from the push channel (GET /api/events/<id>/changes); either the
+// changed and deleted records, or the whole list in `records`
+export interface EventChange {
+  version: number
+  kind: 'performances' | 'breaks' | 'event'
+  put?: any[]
+  deleted?: string[]
+  records?: any[]
+}
+
+// POST /api/events/<id>/batch: applied in one transaction, all or nothing
+export type BatchOperation =
+  | { op: 'move'; kind: 'performances' | 'breaks'; id: string; before?: string; after?: string }
+  | { op: 'update'; kind: 'performances' | 'breaks'; id: string; set: Record<string, any> }
+  | { op: 'setDone'; kind: 'performances' | 'breaks'; id: string; isDone: boolean }
+  | { op: 'completeTrack'; performanceId: string; trackId: string; isCompleted?: boolean }
+
+export interface BatchResult {
+  version: number
+  changed: { performances?: Performance[]; breaks?: any[] }
+}
+
+// 'original' streams the uploaded file; the others are compressed server renditions
+export type StreamQuality = 'original' | 'low' | 'medium' | 'aac'
+
+// POST /api/events/<id>/show: the current performance and the next ones, whose files the server is warming
+export interface PrefetchHint {
+  eventId: string
+  performances: Array<{
+    id: string
+    name: string
+    tracks: Array<Pick<Track, 'id' | 'filename' | 'url' | 'duration' | 'gain'>>
+  }>
 }
 
 export interface PlayState {
@@ -1,7 +1,8 @@
 #!/bin/bash
 
 # Performance Manager - Quick Start Script
-# Usage: ./quick-start.sh {start|stop|restart|status|logs|build|help} [port]
+# Usage: ./quick-start.sh {start|stop|restart|reload|status|logs|build|help} [port]
+# Set PERFORMANCE_MANAGER_MODE=production to serve with gunicorn (see backend/gunicorn.conf.py)
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PROJECT_DIR="$SCRIPT_DIR"
@@ -166,6 +167,12 @@ stop_app() {
     python3 stop.py
 }
 
+# Function to gracefully reload the workers (production mode)
+reload_app() {
+    cd "$PROJECT_DIR/backend"
+    python3 stop.py reload
+}
+
 # Function to show status
 show_status() {
     cd "$PROJECT_DIR/backend"
@@ -232,6 +239,7 @@ show_help() {
     echo -e "  ${YELLOW}start [port]${NC}     - Start Performance Manager (default port: 5000)"
     echo -e "  ${YELLOW}stop${NC}             - Stop Performance Manager"
     echo -e "  ${YELLOW}restart [port]${NC}   - Restart Performance Manager"
+    echo -e "  ${YELLOW}reload${NC}           - Gracefully reload workers (production mode)"
     echo -e "  ${YELLOW}status${NC}           - Check if Performance Manager is running"
     echo -e "  ${YELLOW}logs${NC}             - Show recent logs"
     echo -e "  ${YELLOW}build${NC}            - Build frontend and setup backend"
@@ -269,6 +277,9 @@ case "${1:-help}" in
         shift
         start_app "$@"
         ;;
+    "reload")
+        reload_app
+        ;;
     "status")
         show_status
         ;;